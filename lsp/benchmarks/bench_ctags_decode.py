@@ -0,0 +1,144 @@
+"""Cost of turning ctags JSON output into indexed symbols.
+
+Usage:
+    python benchmarks/bench_ctags_decode.py --tags 200000
+    python benchmarks/bench_ctags_decode.py --source ~/src/some-repo
+
+Without ``--source`` the output is synthesized in the shape ctags writes with
+``--fields=*`` and with the lean field set, so no ctags install is needed.
+With ``--source`` the files under that directory are also run through ctags
+in both modes.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from triggerfish import ctags_manager
+from triggerfish.config import TriggerfishConfig
+from triggerfish.ctags_manager import (
+    CTagsError,
+    CTagsManager,
+    _parse_ctags_line,
+    _parse_ctags_record,
+)
+from triggerfish.file_walker import walk_files
+from triggerfish.server import _tags_to_symbols, _to_symbol_records
+from triggerfish.symbol_index import SymbolIndex
+
+_KINDS = ["class", "method", "function", "variable", "member", "import"]
+
+
+def _full_line(position: int) -> bytes:
+    kind = _KINDS[position % len(_KINDS)]
+    return json.dumps(
+        {
+            "_type": "tag",
+            "name": f"symbol_{position}",
+            "path": f"src/pkg_{position // 4000}/module_{position // 40}.py",
+            "pattern": f"/^    def symbol_{position}(self, value, *args, **kwargs):$/",
+            "file": False,
+            "line": position % 2000 + 1,
+            "column": 4,
+            "language": "Python",
+            "typeref": "typename:None",
+            "kind": kind,
+            "kindName": kind,
+            "roles": "def",
+            "extras": "",
+            "end": position % 2000 + 9,
+            "access": "public",
+            "signature": "(self, value, *args, **kwargs)",
+            "scope": f"Class{position // 20}",
+            "scopeKind": "class",
+            "nth": position % 7,
+        }
+    ).encode()
+
+
+def _lean_line(position: int) -> bytes:
+    kind = _KINDS[position % len(_KINDS)]
+    return json.dumps(
+        {
+            "_type": "tag",
+            "name": f"symbol_{position}",
+            "path": f"src/pkg_{position // 4000}/module_{position // 40}.py",
+            "language": "Python",
+            "line": position % 2000 + 1,
+            "kind": kind,
+            "scope": f"Class{position // 20}",
+            "scopeKind": "class",
+        }
+    ).encode()
+
+
+def _dict_path(lines: List[bytes]) -> None:
+    """Decode to normalized dicts, build Symbol objects, then index them."""
+    index = SymbolIndex()
+    for line in lines:
+        tag = _parse_ctags_line(line)
+        if tag is not None:
+            index.add_symbols(_tags_to_symbols(Path(tag["path"]), [tag]))
+
+
+def _record_path(lines: List[bytes]) -> None:
+    """Decode straight to record tuples and append them to the index columns."""
+    index = SymbolIndex()
+    for line in lines:
+        parsed = _parse_ctags_record(line)
+        if parsed is not None:
+            path, record = parsed
+            index.add_records(Path(path), _to_symbol_records([record]))
+
+
+def _time(run: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+async def _drain(manager: CTagsManager, files: List[Path]) -> None:
+    async for _file_path, _records in manager.stream_records_by_file(files):
+        pass
+
+
+def _run_ctags(source: Path) -> None:
+    files = list(walk_files(source))
+    for lean in (False, True):
+        config = TriggerfishConfig(
+            log_file=Path("/dev/null"), ctags_lean_output=lean, ctags_timeout=600
+        )
+        manager = CTagsManager(config)
+        try:
+            elapsed = _time(lambda: asyncio.run(_drain(manager, files)))
+        except CTagsError as exc:
+            print(f"ctags unavailable: {exc}")
+            return
+        label = "lean fields" if lean else "--fields=*"
+        print(f"ctags {label:12} {len(files)} files: {elapsed:6.2f} s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tags", type=int, default=200000)
+    parser.add_argument("--source", type=Path, help="Also run ctags on this tree")
+    args = parser.parse_args()
+
+    full = [_full_line(position) for position in range(args.tags)]
+    lean = [_lean_line(position) for position in range(args.tags)]
+    decoder = "orjson" if ctags_manager.orjson is not None else "json"
+    print(f"{args.tags} tags, decoder: {decoder}")
+    print(f"full fields, dicts + Symbols: {_time(lambda: _dict_path(full)):6.2f} s")
+    print(f"lean fields, dicts + Symbols: {_time(lambda: _dict_path(lean)):6.2f} s")
+    print(f"lean fields, records:         {_time(lambda: _record_path(lean)):6.2f} s")
+    if args.source:
+        _run_ctags(args.source)
+
+
+if __name__ == "__main__":
+    main()
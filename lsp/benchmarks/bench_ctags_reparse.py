@@ -0,0 +1,59 @@
+"""Latency of reparsing one edited buffer with ctags.
+
+Usage:
+    python benchmarks/bench_ctags_reparse.py path/to/module.py --runs 200
+
+Compares starting ctags for every reparse with sending the buffer to the
+long-lived ``--_interactive`` session. Needs universal-ctags on PATH (or
+``--ctags``) built with interactive mode.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from pathlib import Path
+from typing import List
+
+from triggerfish.config import TriggerfishConfig
+from triggerfish.ctags_manager import CTagsManager
+
+
+async def _latencies(manager: CTagsManager, file_path: Path, runs: int) -> List[float]:
+    text = file_path.read_text(encoding="utf-8")
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await manager.generate_tags_for_text(file_path, text)
+        latencies.append((time.perf_counter() - start) * 1000)
+    await manager.close()
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", type=Path)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--ctags", default="ctags")
+    args = parser.parse_args()
+
+    for interactive in (False, True):
+        config = TriggerfishConfig(
+            log_file=Path("/dev/null"),
+            ctags_executable=args.ctags,
+            ctags_interactive=interactive,
+            # Every run reparses the same bytes, which the tag cache would serve
+            ctags_cache_max_bytes=0,
+        )
+        latencies = asyncio.run(_latencies(CTagsManager(config), args.file, args.runs))
+        label = "interactive session" if interactive else "process per reparse"
+        print(
+            f"{label:20} median {statistics.median(latencies):6.2f} ms, "
+            f"p95 {sorted(latencies)[int(len(latencies) * 0.95)]:6.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
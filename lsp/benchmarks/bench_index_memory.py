@@ -0,0 +1,77 @@
+"""Memory held by SymbolIndex per symbol.
+
+Usage:
+    python benchmarks/bench_index_memory.py --symbols 500000
+
+Compares the index against simply keeping the ``Symbol`` objects alive,
+which is what the index stored before it went columnar.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import random
+import tracemalloc
+from pathlib import Path
+from typing import List
+
+from triggerfish.symbol_index import Symbol, SymbolIndex, SymbolKind
+
+_WORDS = ["get", "set", "user", "name", "load", "save", "cache", "order", "item"]
+_KINDS = [SymbolKind.CLASS, SymbolKind.METHOD, SymbolKind.FUNCTION]
+
+
+def _symbols(count: int, rng: random.Random) -> List[Symbol]:
+    """Symbols spread over files of ~40 symbols, as ctags would report them."""
+    symbols = []
+    for position in range(count):
+        if position % 40 == 0:
+            file_path = Path(f"/workspace/pkg_{position // 4000}/mod_{position}.py")
+        name = "_".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 3)))
+        symbols.append(
+            Symbol(
+                name=f"{name}_{position}",
+                kind=rng.choice(_KINDS),
+                file_path=Path(str(file_path)),
+                line=position % 2000 + 1,
+                scope=f"Class{position // 20}" if position % 3 else None,
+                language="Python",
+            )
+        )
+    return symbols
+
+
+def _measure(build) -> int:  # type: ignore[no-untyped-def]
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=500000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    def objects() -> List[Symbol]:
+        return _symbols(args.symbols, random.Random(args.seed))
+
+    def index() -> SymbolIndex:
+        built = SymbolIndex()
+        built.add_symbols(_symbols(args.symbols, random.Random(args.seed)))
+        return built
+
+    for label, build in [("Symbol objects", objects), ("SymbolIndex", index)]:
+        size = _measure(build)
+        per_symbol = size / args.symbols
+        print(f"{label:15} {size / 2**20:8.1f} MiB  {per_symbol:6.0f} B/symbol")
+
+
+if __name__ == "__main__":
+    main()
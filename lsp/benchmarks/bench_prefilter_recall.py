@@ -0,0 +1,116 @@
+"""Recall and latency of the trigram prefilter against the exhaustive scan.
+
+Usage:
+    python benchmarks/bench_prefilter_recall.py --symbols 300000 --cap 5000
+    python benchmarks/bench_prefilter_recall.py --names names.txt
+
+``--names`` takes one symbol name per line (e.g. the name column of
+``ctags -R -x``); otherwise a synthetic corpus is generated.
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List
+
+from triggerfish.symbol_index import Symbol, SymbolIndex, SymbolKind
+
+_WORDS = [
+    "get", "set", "user", "name", "id", "load", "save", "cache", "by", "account",
+    "order", "item", "handle", "click", "render", "manager", "service", "data",
+    "config", "request", "response", "parse", "build", "index", "symbol", "file",
+]  # fmt: skip
+
+
+def _synthetic_names(count: int, rng: random.Random) -> List[str]:
+    names = []
+    for _ in range(count):
+        words = [rng.choice(_WORDS) for _ in range(rng.randint(1, 4))]
+        if rng.random() < 0.5:
+            names.append("_".join(words))
+        else:
+            names.append(words[0] + "".join(word.title() for word in words[1:]))
+    return names
+
+
+def _queries(names: List[str], count: int, rng: random.Random) -> List[str]:
+    """Prefixes, abbreviations and single-typo variants of real names."""
+    queries = []
+    for name in rng.sample(names, count):
+        compact = name.replace("_", "")
+        variant = rng.randrange(3)
+        if variant == 0:
+            queries.append(compact[: rng.randint(3, max(3, len(compact)))])
+        elif variant == 1 and len(compact) > 4:
+            position = rng.randrange(1, len(compact) - 1)
+            queries.append(compact[:position] + compact[position + 1 :])
+        else:
+            queries.append(compact)
+    return queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=300000)
+    parser.add_argument("--names", type=Path, help="File with one name per line")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--cap", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--min-score", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.names:
+        names = [line.strip() for line in args.names.read_text().splitlines()]
+        names = [name for name in names if name]
+    else:
+        names = _synthetic_names(args.symbols, rng)
+    symbols = [
+        Symbol(
+            name=name,
+            kind=SymbolKind.FUNCTION,
+            file_path=Path(f"/bench/{position // 50}.py"),
+            line=position,
+        )
+        for position, name in enumerate(names)
+    ]
+    exhaustive = SymbolIndex()
+    exhaustive.add_symbols(symbols)
+    prefiltered = SymbolIndex(candidate_cap=args.cap)
+    prefiltered.add_symbols(symbols)
+
+    recalls = []
+    exhaustive_ms = []
+    prefiltered_ms = []
+    for query in _queries(names, min(args.queries, len(names)), rng):
+        start = time.perf_counter()
+        expected = exhaustive.fuzzy_search(
+            query, SymbolKind.FUNCTION, args.limit, args.min_score
+        )
+        exhaustive_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        actual = prefiltered.fuzzy_search(
+            query, SymbolKind.FUNCTION, args.limit, args.min_score
+        )
+        prefiltered_ms.append((time.perf_counter() - start) * 1000)
+        if expected:
+            # Compare scores, not symbols: equally scored names are interchangeable
+            found = Counter(score for _symbol, score in actual)
+            wanted = Counter(score for _symbol, score in expected)
+            recalls.append(sum((wanted & found).values()) / len(expected))
+
+    print(f"symbols:          {len(names)}")
+    print(f"candidate cap:    {args.cap}")
+    print(f"recall@{args.limit}:        {statistics.mean(recalls):.3f}")
+    print(f"exhaustive p50:   {statistics.median(exhaustive_ms):.1f} ms")
+    print(f"prefiltered p50:  {statistics.median(prefiltered_ms):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ from pathlib import Path
 
 from lsprotocol.types import CompletionItemKind
 
-from triggerfish.completion_handler import CompletionHandler
+from triggerfish.completion_handler import CompletionHandler, decode_item_data
 from triggerfish.config import TriggerfishConfig
 from triggerfish.symbol_index import Symbol, SymbolIndex, SymbolKind
 
@@ -33,3 +33,150 @@ def test_get_completions() -> None:
     completions = handler.get_completions("@util", len("@util"))
     assert completions
     assert completions[0].label == "utils.py"
+
+
+def _large_method_index() -> SymbolIndex:
+    index = SymbolIndex()
+    names = ["get_user", "get_user_name", "get_users", "set_user", "load_items"]
+    index.add_symbols(
+        Symbol(name=f"{name}_{i}", kind=SymbolKind.METHOD, file_path=Path(f"/tmp/{i}.py"), line=1)
+        for i in range(40)
+        for name in names
+    )
+    return index
+
+
+def test_typed_ahead_query_rescores_previous_candidates(monkeypatch) -> None:
+    monkeypatch.setattr("triggerfish.completion_handler._REFINE_MIN_CORPUS", 0)
+    index = _large_method_index()
+    config = TriggerfishConfig(log_file=Path("/tmp/log.txt"), max_completion_items=10)
+    handler = CompletionHandler(index, config, "#", [SymbolKind.METHOD], CompletionItemKind.Method)
+    scored_slots = []
+    iter_score_jobs = index.iter_score_jobs
+
+    def spy(query, kind, min_score, chunk_size, limit=None, slots=None):
+        scored_slots.append(slots)
+        return iter_score_jobs(
+            query, kind, min_score, chunk_size, limit=limit, slots=slots
+        )
+
+    monkeypatch.setattr(index, "iter_score_jobs", spy)
+    handler.get_completions("#getUs", len("#getUs"), "file:///notes.txt")
+    refined = handler.get_completions("#getUser", len("#getUser"), "file:///notes.txt")
+
+    assert scored_slots[0] is None
+    assert scored_slots[1] is not None and len(scored_slots[1]) < 200
+    assert scored_slots[1].typecode == "I"
+    assert [item.label for item in refined] == [
+        item.label
+        for item in CompletionHandler(
+            index, config, "#", [SymbolKind.METHOD], CompletionItemKind.Method
+        ).get_completions("#getUser", len("#getUser"))
+    ]
+
+
+def test_refinement_invalidated_by_index_mutation(monkeypatch) -> None:
+    monkeypatch.setattr("triggerfish.completion_handler._REFINE_MIN_CORPUS", 0)
+    index = _large_method_index()
+    config = TriggerfishConfig(log_file=Path("/tmp/log.txt"), max_completion_items=5)
+    handler = CompletionHandler(index, config, "#", [SymbolKind.METHOD], CompletionItemKind.Method)
+
+    handler.get_completions("#load", len("#load"), "file:///notes.txt")
+    assert handler._refinement_for("loadU", "file:///notes.txt") is not None
+    index.add_symbols(
+        [Symbol(name="getUserById", kind=SymbolKind.METHOD, file_path=Path("/tmp/new.py"), line=1)]
+    )
+    assert handler._refinement_for("loadU", "file:///notes.txt") is None
+    completions = handler.get_completions("#getUserBy", len("#getUserBy"), "file:///notes.txt")
+    assert completions[0].label == "getUserById"
+
+
+def test_first_page_then_full_search_on_re_request(monkeypatch) -> None:
+    monkeypatch.setattr("triggerfish.completion_handler._FIRST_PAGE_MIN_CORPUS", 0)
+    index = _large_method_index()
+    config = TriggerfishConfig(
+        log_file=Path("/tmp/log.txt"), completion_first_page=True
+    )
+    handler = CompletionHandler(
+        index, config, "#", [SymbolKind.METHOD], CompletionItemKind.Method
+    )
+    uri = "file:///notes.txt"
+
+    first, incomplete = handler.complete_paged("get_u", uri)
+    assert incomplete
+    assert first and all(item.label.startswith("get_user") for item in first)
+
+    typed, incomplete = handler.complete_paged("get_us", uri)
+    assert not incomplete
+    assert [item.label for item in typed] == [
+        item.label for item in handler.complete("get_us")
+    ]
+    # A new word starts over with a first page
+    assert handler.complete_paged("load", uri)[1]
+
+
+def test_stream_yields_first_page_then_new_matches(monkeypatch) -> None:
+    monkeypatch.setattr("triggerfish.completion_handler.STREAM_CHUNK_SIZE", 30)
+    index = _large_method_index()
+    config = TriggerfishConfig(log_file=Path("/tmp/log.txt"), max_completion_items=10)
+    handler = CompletionHandler(
+        index, config, "#", [SymbolKind.METHOD], CompletionItemKind.Method
+    )
+
+    batches = list(handler.stream("getUser"))
+
+    assert len(batches) == 1 + 200 // 30 + 1
+    streamed = [item for batch in batches for item in batch]
+    keys = [(item.label, tuple(item.data)) for item in streamed]
+    assert len(keys) == len(set(keys))
+    best = sorted(streamed, key=lambda item: item.sort_text)[:10]
+    expected = handler.complete("getUser")
+    assert [item.sort_text for item in best] == [item.sort_text for item in expected]
+
+
+def test_items_carry_a_handle_instead_of_detail() -> None:
+    index = SymbolIndex()
+    file_path = Path("/tmp/project/api.py")
+    index.add_symbols(
+        [Symbol(name="load", kind=SymbolKind.FUNCTION, file_path=file_path, line=7)]
+    )
+    config = TriggerfishConfig(log_file=Path("/tmp/log.txt"))
+    handler = CompletionHandler(
+        index, config, "#", [SymbolKind.FUNCTION], CompletionItemKind.Function
+    )
+
+    item = handler.complete("load")[0]
+
+    assert item.detail is None
+    assert decode_item_data(item.data, index) == (SymbolKind.FUNCTION, file_path, 7)
+    assert decode_item_data(["function", 99, 7], index) is None
+    assert decode_item_data({"path": str(file_path)}, index) is None
+
+
+def test_clearing_files_while_a_job_is_outstanding_keeps_slots_valid() -> None:
+    index = SymbolIndex()
+    for i in range(3700):
+        index.add_records(
+            Path(f"/tmp/gen_{i // 100}.py"),
+            [(f"load_{i}", SymbolKind.FUNCTION, i, None, None)],
+        )
+    config = TriggerfishConfig(log_file=Path("/tmp/log.txt"), max_completion_items=5)
+    handler = CompletionHandler(
+        index, config, "#", [SymbolKind.FUNCTION], CompletionItemKind.Function
+    )
+
+    steps = handler.complete_paged_steps("load_3650", "file:///notes.txt")
+    job = next(steps)
+    # A branch switch clears most files while the job is in the pool
+    for i in range(30):
+        index.clear_file(Path(f"/tmp/gen_{i}.py"))
+    try:
+        while True:
+            job = steps.send(index.score_job(job))
+    except StopIteration as done:
+        items, _incomplete = done.value
+
+    assert items[0].label == "load_3650"
+    assert all(int(item.label[5:]) >= 3000 for item in items)
+    # Compaction waited for the search and ran once it was done
+    assert len(index._columns[SymbolKind.FUNCTION].choices) == 700
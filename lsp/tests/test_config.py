@@ -18,6 +18,7 @@ def test_env_overrides(tmp_path, monkeypatch) -> None:
     monkeypatch.setenv("TRIGGERFISH_CTAGS_TIMEOUT", "55")
     monkeypatch.setenv("TRIGGERFISH_MIN_FUZZY_SCORE", "70")
     monkeypatch.setenv("TRIGGERFISH_MAX_COMPLETION_ITEMS", "25")
+    monkeypatch.setenv("TRIGGERFISH_INDEX_WORKERS", "3")
 
     config = TriggerfishConfig.from_env()
     assert config.log_level == "DEBUG"
@@ -25,3 +26,22 @@ def test_env_overrides(tmp_path, monkeypatch) -> None:
     assert config.ctags_timeout == 55
     assert config.min_fuzzy_score == 70
     assert config.max_completion_items == 25
+    assert config.index_workers == 3
+
+
+def test_index_exclude_env(monkeypatch) -> None:
+    monkeypatch.setenv("TRIGGERFISH_INDEX_EXCLUDE", "*.min.js, generated/ ,")
+    monkeypatch.setenv("TRIGGERFISH_INDEX_USE_GIT", "true")
+
+    config = TriggerfishConfig.from_env()
+    assert config.index_exclude == ["*.min.js", "generated/"]
+    assert config.index_use_git
+
+
+def test_unknown_fuzzy_backend_falls_back_to_extract(monkeypatch, caplog) -> None:
+    monkeypatch.setenv("TRIGGERFISH_FUZZY_BACKEND", "cdsit")
+
+    config = TriggerfishConfig.from_env()
+
+    assert config.fuzzy_backend == "extract"
+    assert "cdsit" in caplog.text
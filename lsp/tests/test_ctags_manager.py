@@ -1,48 +1,439 @@
 """Tests for ctags manager."""
 
+import asyncio
+import os
+import sys
 from pathlib import Path
-from subprocess import CompletedProcess, TimeoutExpired
 
 import pytest
 
 from triggerfish.config import TriggerfishConfig
 from triggerfish.ctags_manager import (
+    CTagsError,
     CTagsManager,
+    CTagsNotFoundError,
     CTagsTimeoutError,
 )
 
 
-def test_generate_tags_parses_json(sample_ctags_output, monkeypatch, tmp_path) -> None:
-    config = TriggerfishConfig(log_file=tmp_path / "log.txt")
-    manager = CTagsManager(config)
+def _fake_ctags(tmp_path, stdout: str, delay: float = 0) -> Path:
+    """Write a ctags stand-in that records its input and prints ``stdout``."""
+    (tmp_path / "out.json").write_text(stdout)
+    script = tmp_path / "fake-ctags"
+    script.write_text(
+        "#!/bin/sh\n"
+        # Like a ctags build without interactive mode
+        'case " $* " in *" --_interactive "*) exit 1 ;; esac\n'
+        f'echo $$ > "{tmp_path}/pid"\n'
+        f'echo "$@" > "{tmp_path}/args"\n'
+        f'cat > "{tmp_path}/stdin"\n'
+        # exec so a timeout kill reaches the sleeping process itself
+        + (f"exec sleep {delay}\n" if delay else f'cat "{tmp_path}/out.json"\n')
+    )
+    script.chmod(0o755)
+    return script
+
 
-    def fake_run(*_args, **_kwargs):
-        return CompletedProcess(args=["ctags"], returncode=0, stdout=sample_ctags_output, stderr="")
+@pytest.mark.asyncio
+async def test_generate_tags_parses_json(sample_ctags_output, tmp_path) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_ctags(tmp_path, sample_ctags_output)),
+    )
+    manager = CTagsManager(config)
 
-    monkeypatch.setattr("subprocess.run", fake_run)
-    tags = manager.generate_tags(Path("main.py"))
+    tags = await manager.generate_tags(Path("main.py"))
     assert len(tags) == 3
     assert tags[0]["name"] == "Application"
+    assert (tmp_path / "args").read_text().split()[-1] == "main.py"
+
+
+@pytest.mark.asyncio
+async def test_generate_tags_timeout(tmp_path) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_ctags(tmp_path, "", delay=5)),
+        ctags_timeout=1,
+    )
+    manager = CTagsManager(config)
+    with pytest.raises(CTagsTimeoutError):
+        await manager.generate_tags(Path("main.py"))
+    _assert_exited(tmp_path)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_generate_tags_kills_ctags(tmp_path) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_ctags(tmp_path, "", delay=5)),
+    )
+    task = asyncio.ensure_future(CTagsManager(config).generate_tags(Path("main.py")))
+    while not (tmp_path / "args").exists():
+        await asyncio.sleep(0.01)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    _assert_exited(tmp_path)
 
 
-def test_generate_tags_timeout(monkeypatch, tmp_path) -> None:
-    config = TriggerfishConfig(log_file=tmp_path / "log.txt")
+@pytest.mark.asyncio
+async def test_missing_ctags_raises_not_found(tmp_path) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt", ctags_executable=str(tmp_path / "missing")
+    )
     manager = CTagsManager(config)
+    with pytest.raises(CTagsNotFoundError):
+        await manager.generate_tags(Path("main.py"))
+    assert not await manager.verify_ctags_available()
 
-    def fake_run(*_args, **_kwargs):
-        raise TimeoutExpired(cmd="ctags", timeout=1)
 
-    monkeypatch.setattr("subprocess.run", fake_run)
+@pytest.mark.asyncio
+async def test_verify_ctags_available(tmp_path) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_ctags(tmp_path, "Universal Ctags")),
+    )
+    assert await CTagsManager(config).verify_ctags_available()
+
+
+def _assert_exited(tmp_path) -> None:
+    """Assert the fake ctags process was killed and reaped."""
+    with pytest.raises(ProcessLookupError):
+        os.kill(int((tmp_path / "pid").read_text()), 0)
+
+
+@pytest.mark.asyncio
+async def test_generate_tags_batch_splits_by_file(tmp_path) -> None:
+    stdout = (
+        '{"_type": "tag", "name": "Application", "kind": "class", "line": 1, "path": "main.py"}\n'
+        '{"_type": "tag", "name": "helper", "kind": "function", "line": 3, "path": "utils.py"}\n'
+        '{"_type": "tag", "name": "run", "kind": "method", "line": 2, "path": "main.py"}\n'
+    )
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_ctags(tmp_path, stdout)),
+    )
+    manager = CTagsManager(config)
+    paths = [Path("main.py"), Path("utils.py"), Path("empty.txt")]
+    tags = await manager.generate_tags_batch(paths)
+
+    assert (tmp_path / "args").read_text().split()[-2:] == ["-L", "-"]
+    assert (tmp_path / "stdin").read_text().splitlines() == [
+        "main.py",
+        "utils.py",
+        "empty.txt",
+    ]
+    assert [tag["name"] for tag in tags[Path("main.py")]] == ["Application", "run"]
+    assert [tag["name"] for tag in tags[Path("utils.py")]] == ["helper"]
+    assert tags[Path("empty.txt")] == []
+
+
+@pytest.mark.asyncio
+async def test_stream_tags_by_file_yields_each_file_when_done(tmp_path) -> None:
+    stdout = (
+        '{"_type": "tag", "name": "A", "kind": "class", "line": 1, "path": "a.py"}\n'
+        '{"_type": "tag", "name": "b", "kind": "function", "line": 1, "path": "a.py"}\n'
+        '{"_type": "tag", "name": "c", "kind": "function", "line": 1, "path": "c.py"}\n'
+    )
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_ctags(tmp_path, stdout)),
+    )
+    manager = CTagsManager(config)
+    paths = [Path("a.py"), Path("empty.py"), Path("c.py")]
+
+    groups = [
+        (path.name, [tag["name"] for tag in tags])
+        async for path, tags in manager.stream_tags_by_file(paths)
+    ]
+    assert groups == [("a.py", ["A", "b"]), ("c.py", ["c"]), ("empty.py", [])]
+
+
+@pytest.mark.asyncio
+async def test_stream_records_by_file_uses_lean_fields(tmp_path) -> None:
+    stdout = (
+        '{"_type": "tag", "name": "run", "path": "a.py", "language": "Python", '
+        '"line": 2, "kind": "method", "scope": "App", "scopeKind": "class"}\n'
+    )
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_ctags(tmp_path, stdout)),
+    )
+    manager = CTagsManager(config)
+
+    records = [
+        record
+        async for record in manager.stream_records_by_file([Path("a.py"), Path("b.py")])
+    ]
+
+    args = (tmp_path / "args").read_text().split()
+    assert "--fields=NFnKsl" in args and "--excmd=number" in args
+    assert records == [
+        (Path("a.py"), [("run", "method", 2, "App", "Python")]),
+        (Path("b.py"), []),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_full_output_mode_requests_every_field(tmp_path) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_ctags(tmp_path, "")),
+        ctags_lean_output=False,
+    )
+    await CTagsManager(config).generate_tags_batch([Path("a.py")])
+
+    args = (tmp_path / "args").read_text().split()
+    assert "--fields=*" in args and "--excmd=pattern" in args
+
+
+@pytest.mark.asyncio
+async def test_stream_tags_timeout(tmp_path) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_ctags(tmp_path, "", delay=5)),
+        ctags_timeout=1,
+    )
+    manager = CTagsManager(config)
     with pytest.raises(CTagsTimeoutError):
-        manager.generate_tags(Path("main.py"))
+        async for _tag in manager.stream_tags([Path("main.py")]):
+            pass
+    _assert_exited(tmp_path)
 
 
-def test_verify_ctags_available(monkeypatch, tmp_path) -> None:
-    config = TriggerfishConfig(log_file=tmp_path / "log.txt")
+@pytest.mark.asyncio
+async def test_generate_tags_for_text_reports_buffer_path(tmp_path) -> None:
+    script = tmp_path / "fake-ctags"
+    # Keep a copy of the buffer file and report a tag at its temporary path
+    script.write_text(
+        "#!/bin/sh\n"
+        'case " $* " in *" --_interactive "*) exit 1 ;; esac\n'
+        'for last; do :; done\n'
+        f'cp "$last" "{tmp_path}/buffer"\n'
+        'printf \'{"_type": "tag", "name": "edited", "kind": "function", '
+        '"line": 1, "path": "%s"}\\n\' "$last"\n'
+    )
+    script.chmod(0o755)
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt", ctags_executable=str(script)
+    )
     manager = CTagsManager(config)
+    file_path = tmp_path / "main.py"
+    tags = await manager.generate_tags_for_text(file_path, "def edited():\n    pass\n")
+
+    assert (tmp_path / "buffer").read_text() == "def edited():\n    pass\n"
+    assert tags[0]["name"] == "edited"
+    assert tags[0]["path"] == str(file_path)
+
+
+@pytest.mark.asyncio
+async def test_list_language_maps(tmp_path) -> None:
+    stdout = (
+        "#LANGUAGE      PATTERNS/EXTENSIONS\n"
+        "Python         *.py *.pyx *.pxd\n"
+        "Make           *.mak *.mk [Mm]akefile GNUmakefile\n"
+    )
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_ctags(tmp_path, stdout)),
+    )
+    assert await CTagsManager(config).list_language_maps() == {
+        "Python": ["*.py", "*.pyx", "*.pxd"],
+        "Make": ["*.mak", "*.mk", "[Mm]akefile", "GNUmakefile"],
+    }
+
+
+def _fake_interactive_ctags(tmp_path) -> Path:
+    """Write an interactive ctags stand-in that tags ``def`` lines.
+
+    Each start is logged to ``starts``; a buffer starting with ``crash``
+    makes it exit and one starting with ``hang`` makes it stop answering.
+    """
+    script = tmp_path / "fake-ctags"
+    script.write_text(
+        f"#!{sys.executable}\n"
+        "import json, os, sys, time\n"
+        f"with open({str(tmp_path / 'starts')!r}, 'a') as log:\n"
+        "    log.write(' '.join(sys.argv[1:]) + '\\n')\n"
+        "def send(entry):\n"
+        "    sys.stdout.write(json.dumps(entry) + '\\n')\n"
+        "    sys.stdout.flush()\n"
+        "send({'_type': 'program', 'name': 'Universal Ctags'})\n"
+        "for line in sys.stdin.buffer:\n"
+        "    request = json.loads(line)\n"
+        "    if 'size' in request:\n"
+        "        text = sys.stdin.buffer.read(request['size']).decode()\n"
+        "    else:\n"
+        "        text = open(request['filename']).read()\n"
+        "    if text.startswith('crash'):\n"
+        "        sys.exit(1)\n"
+        "    if text.startswith('hang'):\n"
+        "        time.sleep(60)\n"
+        "    for number, source in enumerate(text.splitlines(), start=1):\n"
+        "        if source.startswith('def '):\n"
+        "            send({'_type': 'tag', 'name': source[4:].split('(')[0],\n"
+        "                  'path': request['filename'], 'line': number,\n"
+        "                  'kind': 'function'})\n"
+        "    send({'_type': 'completed', 'command': 'generate-tags'})\n"
+    )
+    script.chmod(0o755)
+    return script
+
+
+def _interactive_manager(tmp_path, **overrides) -> CTagsManager:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_interactive_ctags(tmp_path)),
+        **overrides,
+    )
+    return CTagsManager(config)
 
-    def fake_run(*_args, **_kwargs):
-        return CompletedProcess(args=["ctags"], returncode=0, stdout="ctags", stderr="")
 
-    monkeypatch.setattr("subprocess.run", fake_run)
-    assert manager.verify_ctags_available()
+def _starts(tmp_path) -> list:
+    return (tmp_path / "starts").read_text().splitlines()
+
+
+@pytest.mark.asyncio
+async def test_interactive_session_serves_every_request(tmp_path) -> None:
+    manager = _interactive_manager(tmp_path)
+    file_path = tmp_path / "main.py"
+    file_path.write_text("def on_disk():\n    pass\n")
+
+    first = await manager.generate_tags_for_text(file_path, "def one():\n")
+    second = await manager.generate_tags_for_text(file_path, "x = 1\ndef two():\n")
+    from_disk = await manager.generate_tags(file_path)
+    await manager.close()
+
+    assert [(tag["name"], tag["line"]) for tag in first] == [("one", 1)]
+    assert [(tag["name"], tag["line"]) for tag in second] == [("two", 2)]
+    assert [tag["name"] for tag in from_disk] == ["on_disk"]
+    assert second[0]["path"] == str(file_path)
+    starts = _starts(tmp_path)
+    assert len(starts) == 1 and "--_interactive" in starts[0].split()
+
+
+@pytest.mark.asyncio
+async def test_interactive_session_restarts_after_crash(tmp_path) -> None:
+    manager = _interactive_manager(tmp_path)
+    file_path = tmp_path / "main.py"
+
+    with pytest.raises(CTagsError):
+        await manager.generate_tags_for_text(file_path, "crash")
+    tags = await manager.generate_tags_for_text(file_path, "def revived():\n")
+    await manager.close()
+
+    assert [tag["name"] for tag in tags] == ["revived"]
+    assert len(_starts(tmp_path)) == 2
+
+
+@pytest.mark.asyncio
+async def test_interactive_session_restarts_after_timeout(tmp_path) -> None:
+    manager = _interactive_manager(tmp_path, ctags_timeout=1)
+    file_path = tmp_path / "main.py"
+
+    with pytest.raises(CTagsTimeoutError):
+        await manager.generate_tags_for_text(file_path, "hang")
+    tags = await manager.generate_tags_for_text(file_path, "def revived():\n")
+    await manager.close()
+
+    assert [tag["name"] for tag in tags] == ["revived"]
+    assert len(_starts(tmp_path)) == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_interactive_request_leaves_session_usable(tmp_path) -> None:
+    manager = _interactive_manager(tmp_path)
+    file_path = tmp_path / "main.py"
+
+    stale = asyncio.ensure_future(
+        manager.generate_tags_for_text(file_path, "def stale():\n")
+    )
+    await asyncio.sleep(0)
+    stale.cancel()
+    tags = await manager.generate_tags_for_text(file_path, "def fresh():\n")
+    await manager.close()
+
+    assert [tag["name"] for tag in tags] == ["fresh"]
+    assert len(_starts(tmp_path)) == 1
+
+
+@pytest.mark.asyncio
+async def test_identical_content_runs_ctags_once(tmp_path) -> None:
+    manager = _interactive_manager(tmp_path)
+    first = tmp_path / "vendor_a" / "util.py"
+    second = tmp_path / "vendor_b" / "util.py"
+    for file_path in (first, second):
+        file_path.parent.mkdir()
+        file_path.write_text("def shared():\n    pass\n")
+
+    await manager.generate_tags(first)
+    tags = await manager.generate_tags(second)
+    reverted = await manager.generate_tags_for_text(first, "def shared():\n    pass\n")
+    await manager.close()
+
+    assert [(tag["name"], tag["path"]) for tag in tags] == [("shared", str(second))]
+    assert reverted[0]["path"] == str(first)
+    assert manager.cache is not None
+    assert (manager.cache.hits, manager.cache.misses) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_stream_outlives_timeout_while_ctags_keeps_writing(tmp_path) -> None:
+    script = tmp_path / "fake-ctags"
+    script.write_text(
+        "#!/bin/sh\n"
+        "for name in a b c; do\n"
+        '  printf \'{"_type": "tag", "name": "%s", "path": "a.py"}\\n\' "$name"\n'
+        "  sleep 0.6\n"
+        "done\n"
+    )
+    script.chmod(0o755)
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt", ctags_executable=str(script), ctags_timeout=1
+    )
+    manager = CTagsManager(config)
+
+    names = [tag["name"] async for tag in manager.stream_tags([Path("a.py")])]
+
+    assert names == ["a", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_stream_does_not_count_time_the_consumer_holds_a_line(
+    sample_ctags_output, tmp_path
+) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_ctags(tmp_path, sample_ctags_output)),
+        ctags_timeout=1,
+    )
+    manager = CTagsManager(config)
+
+    names = []
+    async for tag in manager.stream_tags([Path("main.py")]):
+        names.append(tag["name"])
+        await asyncio.sleep(0.6)
+
+    assert len(names) == 3
+
+
+@pytest.mark.asyncio
+async def test_generate_tags_skips_reading_the_file_without_a_cache(
+    monkeypatch, sample_ctags_output, tmp_path
+) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(_fake_ctags(tmp_path, sample_ctags_output)),
+        ctags_cache_max_bytes=0,
+    )
+    manager = CTagsManager(config)
+
+    def read_bytes(self):
+        raise AssertionError(f"{self} was read")
+
+    monkeypatch.setattr(Path, "read_bytes", read_bytes)
+    tags = await manager.generate_tags(tmp_path / "main.py")
+
+    assert manager.cache is None
+    assert len(tags) == 3
@@ -0,0 +1,113 @@
+"""Tests for workspace file discovery."""
+
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from triggerfish.file_walker import (
+    DEFAULT_EXCLUDES,
+    IgnoreFilter,
+    git_files,
+    walk_files,
+)
+
+
+def _write(root: Path, *relative_paths: str) -> None:
+    for relative in relative_paths:
+        path = root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("x\n")
+
+
+def _relative(root: Path, paths) -> set:
+    return {path.relative_to(root).as_posix() for path in paths}
+
+
+def test_walk_skips_default_excludes(tmp_path) -> None:
+    _write(
+        tmp_path,
+        "src/app.py",
+        ".hidden.py",
+        ".git/config",
+        ".venv/lib/site.py",
+        "node_modules/pkg/index.js",
+        "src/build/out.js",
+    )
+
+    assert _relative(tmp_path, walk_files(tmp_path)) == {"src/app.py", ".hidden.py"}
+
+
+def test_walk_honors_nested_ignore_files(tmp_path) -> None:
+    _write(
+        tmp_path,
+        "app.py",
+        "app.log",
+        "keep.log",
+        "generated/schema.py",
+        "pkg/module.py",
+        "pkg/module_pb2.py",
+        "pkg/vendor/lib.py",
+        "pkg/sub/vendor/lib.py",
+    )
+    (tmp_path / ".gitignore").write_text("# logs\n*.log\n!keep.log\n/generated/\n")
+    (tmp_path / "pkg" / ".gitignore").write_text("*_pb2.py\n")
+    (tmp_path / "pkg" / ".ignore").write_text("/vendor\n")
+
+    assert _relative(tmp_path, walk_files(tmp_path)) == {
+        ".gitignore",
+        "app.py",
+        "keep.log",
+        "pkg/.gitignore",
+        "pkg/.ignore",
+        "pkg/module.py",
+        "pkg/sub/vendor/lib.py",
+    }
+
+
+def test_walk_applies_extra_excludes(tmp_path) -> None:
+    _write(tmp_path, "a.py", "static/app.min.js", "docs/api/index.md", ".github/ci.yml")
+    excludes = [*DEFAULT_EXCLUDES, "*.min.js", "docs/**/api", "!.github/"]
+
+    assert _relative(tmp_path, walk_files(tmp_path, excludes)) == {
+        "a.py",
+        ".github/ci.yml",
+    }
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_git_files_lists_tracked_and_untracked(tmp_path) -> None:
+    _write(tmp_path, "tracked.py", "deleted.py", "node_modules/x.js", "ignored.tmp")
+    (tmp_path / ".gitignore").write_text("*.tmp\n")
+    git = ["git", "-c", "user.name=t", "-c", "user.email=t@example.com"]
+    subprocess.run(["git", "init", "-q"], cwd=tmp_path, check=True)
+    subprocess.run([*git, "add", "-A"], cwd=tmp_path, check=True)
+    subprocess.run([*git, "commit", "-q", "-m", "init"], cwd=tmp_path, check=True)
+    (tmp_path / "deleted.py").unlink()
+    _write(tmp_path, "untracked.py")
+
+    assert _relative(tmp_path, git_files(tmp_path)) == {
+        ".gitignore",
+        "tracked.py",
+        "untracked.py",
+    }
+
+
+def test_git_files_outside_repository_returns_none(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv("GIT_CEILING_DIRECTORIES", str(tmp_path.parent))
+    assert git_files(tmp_path) is None
+
+
+def test_ignore_filter_matches_walk(tmp_path) -> None:
+    _write(tmp_path, "src/app.py", "src/gen/out.py", "src/app.log", "dist/x.js")
+    (tmp_path / ".gitignore").write_text("*.log\n")
+    (tmp_path / "src" / ".ignore").write_text("gen/\n")
+    ignore = IgnoreFilter(tmp_path)
+
+    assert not ignore.ignored(tmp_path / "src" / "app.py")
+    assert ignore.ignored(tmp_path / "src" / "gen" / "out.py")
+    assert ignore.ignored(tmp_path / "src" / "app.log")
+    assert ignore.ignored(tmp_path / "dist" / "x.js")
+    assert ignore.ignored(tmp_path / ".git", is_dir=True)
+    assert ignore.ignored(tmp_path.parent / "elsewhere.py")
@@ -0,0 +1,35 @@
+"""Tests for the native file watcher."""
+
+from pathlib import Path
+from types import SimpleNamespace
+
+from triggerfish.file_watcher import _EventHandler
+
+
+def _event(event_type, src_path, is_directory=False, dest_path=""):
+    return SimpleNamespace(
+        event_type=event_type,
+        src_path=src_path,
+        dest_path=dest_path,
+        is_directory=is_directory,
+    )
+
+
+def test_events_translate_to_changes() -> None:
+    changes = []
+    handler = _EventHandler(lambda path, created: changes.append((path, created)))
+
+    handler.dispatch(_event("created", "/ws/new.py"))
+    handler.dispatch(_event("modified", "/ws/old.py"))
+    handler.dispatch(_event("modified", "/ws/pkg", is_directory=True))
+    handler.dispatch(_event("moved", "/ws/a.py", dest_path="/ws/b.py"))
+    handler.dispatch(_event("deleted", b"/ws/gone.py"))
+    handler.dispatch(_event("opened", "/ws/old.py"))
+
+    assert changes == [
+        (Path("/ws/new.py"), True),
+        (Path("/ws/old.py"), False),
+        (Path("/ws/a.py"), False),
+        (Path("/ws/b.py"), True),
+        (Path("/ws/gone.py"), False),
+    ]
@@ -0,0 +1,80 @@
+"""Tests for the persistent index cache."""
+
+import os
+
+from triggerfish.index_cache import IndexCache
+from triggerfish.symbol_index import SymbolKind
+
+RECORDS = [("run", SymbolKind.METHOD, 3, "Application", "Python")]
+
+
+def test_round_trip_unchanged_file(tmp_path) -> None:
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    file_path = workspace / "main.py"
+    file_path.write_text("class Application:\n    pass\n")
+
+    cache = IndexCache(tmp_path / "cache", workspace)
+    stamp = cache.stamp(file_path)
+    cache.store_records(file_path, stamp, RECORDS)
+    cache.save()
+
+    reloaded = IndexCache(tmp_path / "cache", workspace)
+    reloaded.load()
+    assert reloaded.lookup_records(file_path, reloaded.stamp(file_path)) == RECORDS
+
+
+def test_modified_file_is_a_miss(tmp_path) -> None:
+    file_path = tmp_path / "main.py"
+    file_path.write_text("x = 1\n")
+    cache = IndexCache(tmp_path / "cache", tmp_path)
+    cache.store_records(file_path, cache.stamp(file_path), RECORDS)
+
+    file_path.write_text("x = 10\n")
+    assert cache.lookup_records(file_path, cache.stamp(file_path)) is None
+
+
+def test_content_hash_survives_touch(tmp_path) -> None:
+    file_path = tmp_path / "main.py"
+    file_path.write_text("x = 1\n")
+    cache = IndexCache(tmp_path / "cache", tmp_path, use_content_hash=True)
+    cache.store_records(file_path, cache.stamp(file_path), RECORDS)
+    cache.save()
+
+    stat = file_path.stat()
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    reloaded = IndexCache(tmp_path / "cache", tmp_path, use_content_hash=True)
+    reloaded.load()
+    assert reloaded.lookup_records(file_path, reloaded.stamp(file_path)) == RECORDS
+
+
+def test_corrupt_cache_is_ignored(tmp_path) -> None:
+    cache = IndexCache(tmp_path, tmp_path / "workspace")
+    cache.path.write_text("{not json")
+    cache.load()
+    assert cache.lookup_records(tmp_path / "main.py", cache.stamp(cache.path)) is None
+
+
+def test_mapped_lookup_decodes_only_requested_files(tmp_path) -> None:
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    cache = IndexCache(tmp_path / "cache", workspace)
+    paths = []
+    for i in range(200):
+        file_path = workspace / f"module_{i:03d}.py"
+        file_path.write_text(f"def func_{i}():\n    pass\n")
+        paths.append(file_path)
+        record = (f"func_{i}", SymbolKind.FUNCTION, 1, None, None)
+        cache.store_records(file_path, cache.stamp(file_path), [record])
+    cache.save()
+
+    reloaded = IndexCache(tmp_path / "cache", workspace)
+    reloaded.load()
+    records = reloaded.lookup_records(paths[137], reloaded.stamp(paths[137]))
+    assert records == [("func_137", SymbolKind.FUNCTION, 1, None, None)]
+    assert (
+        reloaded.lookup_records(workspace / "missing.py", reloaded.stamp(paths[0]))
+        is None
+    )
+    # Only the binary search probes and the hit's own strings were decoded
+    assert len(reloaded._mapped._strings) < 20
@@ -0,0 +1,82 @@
+"""Tests for scoring completion searches off the event loop."""
+
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from triggerfish.search_pool import SearchPool
+from triggerfish.symbol_index import SymbolIndex, SymbolKind
+
+
+def _index(count: int) -> SymbolIndex:
+    index = SymbolIndex()
+    index.add_records(
+        Path("/tmp/api.py"),
+        [(f"get_user_{i}", SymbolKind.FUNCTION, i, None, None) for i in range(count)],
+    )
+    return index
+
+
+@pytest.mark.asyncio
+async def test_thread_pool_scores_like_inline() -> None:
+    index = _index(300)
+    pool = SearchPool(index, threads=2)
+    try:
+        jobs = list(index.iter_score_jobs("getuser1", SymbolKind.FUNCTION, 60, 100))
+        scored = await asyncio.gather(*(pool.score(job) for job in jobs))
+    finally:
+        pool.close()
+
+    assert len(jobs) == 3
+    assert scored == [index.score_job(job) for job in jobs]
+
+
+@pytest.mark.asyncio
+async def test_process_pool_scores_against_current_snapshot(monkeypatch) -> None:
+    index = _index(300)
+    pool = SearchPool(index, threads=1, processes=1)
+    try:
+        job = next(index.iter_score_jobs("getuser1", SymbolKind.FUNCTION, 60, 300))
+        expected = index.score_job(job)
+        # No snapshot yet: scored on a thread while one is published
+        assert await pool.score(job) == expected
+        await asyncio.gather(*pool._publishing.values())
+
+        def fail(job, release_gil=False):
+            raise AssertionError("scored outside the process pool")
+
+        monkeypatch.setattr(index, "score_job", fail)
+        assert await asyncio.wait_for(pool.score(job), timeout=60) == expected
+
+        # A newer kind version never reaches the stale snapshot
+        monkeypatch.undo()
+        index.add_records(
+            Path("/tmp/new.py"), [("get_user_x", SymbolKind.FUNCTION, 1, None, None)]
+        )
+        newer = next(index.iter_score_jobs("getuserx", SymbolKind.FUNCTION, 60, 400))
+        assert newer.version != job.version
+        assert await pool.score(newer) == index.score_job(newer)
+        assert SymbolKind.FUNCTION in pool._publishing
+    finally:
+        pool.close()
+
+
+@pytest.mark.asyncio
+async def test_prefix_index_is_built_on_a_worker_thread(monkeypatch) -> None:
+    monkeypatch.setattr("triggerfish.symbol_index._PREFIX_TAIL_SCAN", 10)
+    index = _index(300)
+    pool = SearchPool(index, threads=1)
+    try:
+        pool.prepare_prefix_search([SymbolKind.FUNCTION])
+        # Nothing is sorted on the loop; the first page scans a bounded tail
+        assert SymbolKind.FUNCTION not in index._prefixes
+        first_page = index.prefix_search("get_user_2", SymbolKind.FUNCTION, 200)
+        assert [symbol.name for symbol, _score in first_page] == ["get_user_2"]
+        await pool._building[SymbolKind.FUNCTION]
+    finally:
+        pool.close()
+
+    matches = index.prefix_search("get_user_2", SymbolKind.FUNCTION, limit=200)
+    assert matches[0] == (index.symbol_at(SymbolKind.FUNCTION, 2), 100.0)
+    assert len(matches) == 1 + 10 + 100
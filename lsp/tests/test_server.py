@@ -1,8 +1,12 @@
 """Tests for LSP server."""
 
+import asyncio
+import threading
+
 import pytest
 
 from lsprotocol.types import (
+    CompletionList,
     CompletionParams,
     Position,
     TextDocumentIdentifier,
@@ -11,10 +15,23 @@ from lsprotocol.types import (
 from pygls.workspace import Workspace
 
 from triggerfish.config import TriggerfishConfig
+from triggerfish.ctags_manager import CTagsTimeoutError
 from triggerfish.server import TriggerfishLanguageServer
 from triggerfish.symbol_index import Symbol, SymbolKind
 
 
+def _streaming(fake_batch):
+    """Adapt a fake batch parser to the per-file record stream indexing uses."""
+
+    async def stream_records_by_file(file_paths):
+        for file_path, tags in fake_batch(file_paths).items():
+            yield file_path, [
+                (tag["name"], tag["kind"], tag["line"], None, None) for tag in tags
+            ]
+
+    return stream_records_by_file
+
+
 @pytest.mark.asyncio
 async def test_index_file_adds_symbols(tmp_path) -> None:
     log_file = tmp_path / "log.txt"
@@ -68,3 +85,550 @@ async def test_completion_restricted_to_txt(tmp_path) -> None:
     )
     py_result = await server._completion(py_params)
     assert not py_result.items
+
+
+@pytest.mark.asyncio
+async def test_index_workspace_batches_ctags(sample_python_project, tmp_path) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt", core_enabled=False, index_workers=1
+    )
+    server = TriggerfishLanguageServer(config)
+    server._workspace_root = sample_python_project
+    batches = []
+
+    def fake_batch(file_paths):
+        batches.append(list(file_paths))
+        return {
+            file_path: (
+                [{"name": "main", "kind": "function", "line": 5, "path": str(file_path)}]
+                if file_path.name == "main.py"
+                else []
+            )
+            for file_path in file_paths
+        }
+
+    server.ctags.stream_records_by_file = _streaming(fake_batch)
+    await server._index_workspace(sample_python_project)
+
+    assert len(batches) == 1
+    assert {path.name for path in batches[0]} == {"main.py", "utils.py"}
+    assert [symbol.name for symbol in server.index.get_symbols(SymbolKind.FUNCTION)] == ["main"]
+    assert len(server.index.get_symbols(SymbolKind.FILE)) == 2
+
+
+@pytest.mark.asyncio
+async def test_completion_incomplete_while_indexing(sample_python_project, tmp_path) -> None:
+    config = TriggerfishConfig(log_file=tmp_path / "log.txt", core_enabled=False)
+    server = TriggerfishLanguageServer(config)
+    server._workspace_root = sample_python_project
+    server.protocol._workspace = Workspace(None)
+    release = asyncio.Event()
+
+    async def blocking_stream(file_paths):
+        await release.wait()
+        for file_path in file_paths:
+            yield file_path, []
+
+    server.ctags.stream_records_by_file = blocking_stream
+    server._start_workspace_indexing(sample_python_project)
+
+    uri = (tmp_path / "notes.txt").as_uri()
+    server.workspace.put_text_document(
+        TextDocumentItem(uri=uri, language_id="text", version=1, text="@main")
+    )
+    params = CompletionParams(
+        text_document=TextDocumentIdentifier(uri=uri),
+        position=Position(line=0, character=5),
+    )
+    while not server.index.get_symbols(SymbolKind.FILE):
+        await asyncio.sleep(0.01)
+
+    # FILE symbols are served before ctags finishes
+    partial = await server._completion(params)
+    assert partial.is_incomplete
+    assert partial.items[0].label == "main.py"
+
+    release.set()
+    await server._index_task
+    final = await server._completion(params)
+    assert not final.is_incomplete
+
+
+@pytest.mark.asyncio
+async def test_index_workspace_shards_across_workers(tmp_path) -> None:
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    for i in range(10):
+        (workspace / f"module_{i}.py").write_text(f"def func_{i}():\n    pass\n")
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        core_enabled=False,
+        ctags_batch_size=3,
+        index_workers=2,
+    )
+    server = TriggerfishLanguageServer(config)
+    server._workspace_root = workspace
+    shards = []
+
+    def fake_batch(file_paths):
+        shards.append(len(file_paths))
+        return {
+            file_path: [
+                {"name": f"func_{file_path.stem[-1]}", "kind": "function", "line": 1}
+            ]
+            for file_path in file_paths
+        }
+
+    server.ctags.stream_records_by_file = _streaming(fake_batch)
+    await server._index_workspace(workspace)
+
+    assert sorted(shards) == [1, 3, 3, 3]
+    assert len(server.index.get_symbols(SymbolKind.FUNCTION)) == 10
+
+
+@pytest.mark.asyncio
+async def test_warm_restart_uses_index_cache(sample_python_project, tmp_path) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        core_enabled=False,
+        cache_dir=tmp_path / "cache",
+    )
+    parsed = []
+
+    def fake_batch(file_paths):
+        parsed.extend(file_paths)
+        return {
+            file_path: [{"name": f"{file_path.stem}_func", "kind": "function", "line": 1}]
+            for file_path in file_paths
+        }
+
+    cold = TriggerfishLanguageServer(config)
+    cold.ctags.stream_records_by_file = _streaming(fake_batch)
+    await cold._index_workspace(sample_python_project)
+    assert len(parsed) == 2
+
+    (sample_python_project / "utils.py").write_text("def changed():\n    pass\n\n")
+    parsed.clear()
+    warm = TriggerfishLanguageServer(config)
+    warm.ctags.stream_records_by_file = _streaming(fake_batch)
+    await warm._index_workspace(sample_python_project)
+
+    assert [path.name for path in parsed] == ["utils.py"]
+    names = {symbol.name for symbol in warm.index.get_symbols(SymbolKind.FUNCTION)}
+    assert names == {"main_func", "utils_func"}
+
+
+@pytest.mark.asyncio
+async def test_did_change_reparses_buffer_once_after_quiet_period(tmp_path) -> None:
+    config = TriggerfishConfig(log_file=tmp_path / "log.txt", reindex_debounce_ms=20)
+    server = TriggerfishLanguageServer(config)
+    server._workspace_root = tmp_path
+    server.protocol._workspace = Workspace(None)
+    file_path = tmp_path / "main.py"
+    uri = file_path.as_uri()
+    parsed = []
+
+    async def fake_for_text(path, text, language=None):
+        parsed.append(text)
+        return [{"name": "edited", "kind": "function", "line": 1, "path": str(path)}]
+
+    server.ctags.generate_tags_for_text = fake_for_text
+    for version, text in enumerate(["def e", "def ed", "def edited(): pass"], start=1):
+        server.workspace.put_text_document(
+            TextDocumentItem(uri=uri, language_id="python", version=version, text=text)
+        )
+        server._schedule_reindex(uri)
+        await asyncio.sleep(0)
+
+    await server._reindex_tasks[uri]
+
+    assert parsed == ["def edited(): pass"]
+    names = {symbol.name for symbol in server.index.get_symbols()}
+    assert names == {"main.py", "edited"}
+
+
+@pytest.mark.asyncio
+async def test_disk_changes_are_applied_in_one_batch(tmp_path) -> None:
+    config = TriggerfishConfig(log_file=tmp_path / "log.txt", reindex_debounce_ms=10)
+    server = TriggerfishLanguageServer(config)
+    server._workspace_root = tmp_path
+    server.protocol._workspace = Workspace(None)
+    for name in ("kept.py", "edited.py", "deleted.py", "pkg/old.py"):
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text("pass\n")
+        server._add_file_symbol(tmp_path / name)
+    batches = []
+
+    def fake_batch(file_paths):
+        batches.append(sorted(path.name for path in file_paths))
+        return {
+            path: [{"name": f"{path.stem}_fn", "kind": "function", "line": 1}]
+            for path in file_paths
+        }
+
+    server.ctags.stream_records_by_file = _streaming(fake_batch)
+    (tmp_path / "deleted.py").unlink()
+    (tmp_path / "pkg" / "old.py").unlink()
+    (tmp_path / "pkg").rmdir()
+    (tmp_path / "created.py").write_text("pass\n")
+    (tmp_path / "node_modules").mkdir()
+    (tmp_path / "node_modules" / "dep.js").write_text("pass\n")
+    for name, created in [
+        ("edited.py", False),
+        ("deleted.py", False),
+        ("pkg", False),
+        ("created.py", True),
+        ("created.py", False),
+        ("node_modules/dep.js", True),
+    ]:
+        server._queue_file_change(tmp_path / name, created)
+    await server._file_changes_task
+
+    assert batches == [["created.py", "edited.py"]]
+    files = {symbol.name for symbol in server.index.get_symbols(SymbolKind.FILE)}
+    assert files == {"kept.py", "edited.py", "created.py"}
+    functions = server.index.get_symbols(SymbolKind.FUNCTION)
+    assert {symbol.name for symbol in functions} == {"edited_fn", "created_fn"}
+
+
+@pytest.mark.asyncio
+async def test_index_workspace_merges_files_while_ctags_runs(
+    sample_python_project, tmp_path
+) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt", core_enabled=False, index_workers=1
+    )
+    server = TriggerfishLanguageServer(config)
+    first_merged = asyncio.Event()
+
+    async def stream_records_by_file(file_paths):
+        first, *rest = sorted(file_paths)
+        yield first, [("first_func", "function", 1, None, None)]
+        # ctags is still "running" until the first file reaches the index
+        await first_merged.wait()
+        for file_path in rest:
+            yield file_path, [("later_func", "function", 1, None, None)]
+
+    server.ctags.stream_records_by_file = stream_records_by_file
+    server._start_workspace_indexing(sample_python_project)
+    while not server.index.get_symbols(SymbolKind.FUNCTION):
+        await asyncio.sleep(0.01)
+
+    assert [s.name for s in server.index.get_symbols(SymbolKind.FUNCTION)] == [
+        "first_func"
+    ]
+    first_merged.set()
+    await server._index_task
+    assert len(server.index.get_symbols(SymbolKind.FUNCTION)) == 2
+
+
+@pytest.mark.asyncio
+async def test_completion_answered_while_ctags_runs(tmp_path) -> None:
+    script = tmp_path / "slow-ctags"
+    script.write_text("#!/bin/sh\nexec sleep 5\n")
+    script.chmod(0o755)
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt",
+        ctags_executable=str(script),
+        ctags_interactive=False,
+    )
+    server = TriggerfishLanguageServer(config)
+    server._workspace_root = tmp_path
+    server.protocol._workspace = Workspace(None)
+    file_path = tmp_path / "main.py"
+    file_path.write_text("def main():\n    pass\n")
+    server._add_file_symbol(file_path)
+
+    opening = asyncio.ensure_future(server._index_file(file_path))
+    await asyncio.sleep(0.1)
+    uri = (tmp_path / "notes.txt").as_uri()
+    server.workspace.put_text_document(
+        TextDocumentItem(uri=uri, language_id="text", version=1, text="@main")
+    )
+    params = CompletionParams(
+        text_document=TextDocumentIdentifier(uri=uri),
+        position=Position(line=0, character=5),
+    )
+    result = await asyncio.wait_for(server._completion(params), timeout=1)
+
+    assert result.items[0].label == "main.py"
+    assert not opening.done()
+    opening.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await opening
+
+
+@pytest.mark.asyncio
+async def test_completion_streams_partial_results(monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr("triggerfish.server.STREAM_CHUNK_SIZE", 10)
+    monkeypatch.setattr("triggerfish.completion_handler.STREAM_CHUNK_SIZE", 10)
+    config = TriggerfishConfig(log_file=tmp_path / "log.txt")
+    server = TriggerfishLanguageServer(config)
+    server.protocol._workspace = Workspace(None)
+    server.index.add_records(
+        tmp_path / "api.py",
+        [(f"load_{i}", SymbolKind.FUNCTION, i, None, None) for i in range(35)],
+    )
+    sent = []
+    monkeypatch.setattr(server, "progress", sent.append)
+    pooled = []
+    score = server.search_pool.score
+
+    async def counting(job):
+        pooled.append(job)
+        return await score(job)
+
+    monkeypatch.setattr(server.search_pool, "score", counting)
+
+    uri = (tmp_path / "notes.txt").as_uri()
+    server.workspace.put_text_document(
+        TextDocumentItem(uri=uri, language_id="text", version=1, text="#load_3")
+    )
+    params = CompletionParams(
+        text_document=TextDocumentIdentifier(uri=uri),
+        position=Position(line=0, character=7),
+        partial_result_token="partial-1",
+    )
+    result = await server._completion(params)
+
+    assert result == []
+    # Each chunk was scored in the search pool
+    assert len(pooled) == 4
+    assert {progress.token for progress in sent} == {"partial-1"}
+    first = sent[0].value
+    assert isinstance(first, CompletionList)
+    assert first.items[0].label == "load_3"
+    assert all(isinstance(progress.value, list) for progress in sent[1:])
+
+
+def _completion_server(monkeypatch, tmp_path, count, **settings):
+    monkeypatch.setattr("triggerfish.completion_handler._SEARCH_CHUNK_SIZE", 10)
+    config = TriggerfishConfig(log_file=tmp_path / "log.txt", **settings)
+    server = TriggerfishLanguageServer(config)
+    server.protocol._workspace = Workspace(None)
+    server.index.add_records(
+        tmp_path / "api.py",
+        [(f"load_{i}", SymbolKind.FUNCTION, i, None, None) for i in range(count)],
+    )
+    chunks = []
+    iter_score_jobs = server.index.iter_score_jobs
+
+    def counting(*args, **kwargs):
+        for job in iter_score_jobs(*args, **kwargs):
+            chunks.append(job)
+            yield job
+
+    monkeypatch.setattr(server.index, "iter_score_jobs", counting)
+    uri = (tmp_path / "notes.txt").as_uri()
+    server.workspace.put_text_document(
+        TextDocumentItem(uri=uri, language_id="text", version=1, text="#load_3")
+    )
+    params = CompletionParams(
+        text_document=TextDocumentIdentifier(uri=uri),
+        position=Position(line=0, character=7),
+    )
+    return server, params, chunks
+
+
+@pytest.mark.asyncio
+async def test_superseded_completion_is_dropped(monkeypatch, tmp_path) -> None:
+    server, params, chunks = _completion_server(monkeypatch, tmp_path, 100)
+
+    first = asyncio.ensure_future(server._completion(params))
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(server._completion(params))
+    stale, latest = await asyncio.gather(first, second)
+
+    assert stale == CompletionList(is_incomplete=True, items=[])
+    assert latest.items[0].label == "load_3"
+    # Only the latest request scanned the whole corpus
+    assert len(chunks) < 20
+    assert server._completion_requests == {}
+
+
+@pytest.mark.asyncio
+async def test_completion_scored_on_the_loop_is_still_superseded(
+    monkeypatch, tmp_path
+) -> None:
+    server, params, chunks = _completion_server(
+        monkeypatch, tmp_path, 100, completion_threads=0
+    )
+
+    first = asyncio.ensure_future(server._completion(params))
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(server._completion(params))
+    stale, latest = await asyncio.gather(first, second)
+
+    assert stale == CompletionList(is_incomplete=True, items=[])
+    assert latest.items[0].label == "load_3"
+    assert len(chunks) < 20
+
+
+@pytest.mark.asyncio
+async def test_cancelled_completion_stops_scoring(monkeypatch, tmp_path) -> None:
+    server, params, chunks = _completion_server(monkeypatch, tmp_path, 100)
+
+    task = asyncio.ensure_future(server._completion(params))
+    for _ in range(3):
+        await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert 0 < len(chunks) < 10
+    assert not server.index._pins[SymbolKind.FUNCTION]
+    assert server._completion_requests == {}
+
+
+@pytest.mark.asyncio
+async def test_completion_items_resolve_detail_and_snippet(tmp_path) -> None:
+    server = TriggerfishLanguageServer(TriggerfishConfig(log_file=tmp_path / "log.txt"))
+    server.protocol._workspace = Workspace(None)
+    source = tmp_path / "api.py"
+    source.write_text("".join(f"# line {i}\n" for i in range(1, 5)) + "def load():\n")
+    server.index.add_records(source, [("load", SymbolKind.FUNCTION, 5, None, None)])
+    uri = (tmp_path / "notes.txt").as_uri()
+    server.workspace.put_text_document(
+        TextDocumentItem(uri=uri, language_id="text", version=1, text="#load")
+    )
+    params = CompletionParams(
+        text_document=TextDocumentIdentifier(uri=uri),
+        position=Position(line=0, character=5),
+    )
+
+    item = (await server._completion(params)).items[0]
+    assert item.detail is None and item.documentation is None
+    resolved = await server._resolve_completion(item)
+
+    assert resolved.detail == f"function at {source}:5"
+    assert resolved.documentation.value == (
+        "```py\n# line 2\n# line 3\n# line 4\ndef load():\n```"
+    )
+
+    # An open buffer is shown as edited, not as saved
+    server.workspace.put_text_document(
+        TextDocumentItem(
+            uri=source.as_uri(),
+            language_id="python",
+            version=1,
+            text="import os\n\n\n\ndef load(path):\n    return path\n",
+        )
+    )
+    item = (await server._completion(params)).items[0]
+    resolved = await server._resolve_completion(item)
+    assert resolved.documentation.value == (
+        "```py\ndef load(path):\n    return path\n```"
+    )
+
+
+@pytest.mark.asyncio
+async def test_file_opened_during_indexing_is_not_indexed_twice(tmp_path) -> None:
+    config = TriggerfishConfig(
+        log_file=tmp_path / "log.txt", core_enabled=False, cache_dir=None
+    )
+    server = TriggerfishLanguageServer(config)
+    main = tmp_path / "main.py"
+    main.write_text("def main():\n    pass\n")
+    opened = asyncio.Event()
+
+    async def stream_records_by_file(file_paths):
+        # ctags is still parsing the shard when the editor opens the file
+        await opened.wait()
+        for file_path in file_paths:
+            yield file_path, [("main", "function", 1, None, None)]
+
+    async def parse_code_symbols(file_path):
+        return [Symbol(name="main", kind=SymbolKind.FUNCTION, file_path=main, line=1)]
+
+    server.ctags.stream_records_by_file = stream_records_by_file
+    server._parse_code_symbols = parse_code_symbols
+    server._start_workspace_indexing(tmp_path)
+    while not server.index.get_symbols(SymbolKind.FILE):
+        await asyncio.sleep(0.01)
+    await server._index_file(main)
+    opened.set()
+    await server._index_task
+
+    assert len(server.index.get_symbols(SymbolKind.FUNCTION)) == 1
+    assert len(server.index.get_symbols(SymbolKind.FILE)) == 1
+    assert not server._editor_indexed
+
+
+def test_removed_paths_in_ignored_directories_are_dropped(tmp_path) -> None:
+    server = TriggerfishLanguageServer(TriggerfishConfig(log_file=tmp_path / "log.txt"))
+    server._workspace_root = tmp_path
+    changes = {
+        tmp_path / ".git" / "index.lock": False,
+        tmp_path / "node_modules" / "dep": False,
+        tmp_path / "gone.py": False,
+    }
+
+    changed, removed = server._classify_file_changes(changes)
+
+    assert changed == []
+    assert removed == [tmp_path / "gone.py"]
+
+
+@pytest.mark.asyncio
+async def test_failed_ctags_batch_reparses_the_files_it_did_not_reach(tmp_path) -> None:
+    server = TriggerfishLanguageServer(TriggerfishConfig(log_file=tmp_path / "log.txt"))
+    files = []
+    for name in "abcdef":
+        files.append(tmp_path / f"{name}.py")
+        files[-1].write_text(f"def {name}():\n    pass\n")
+    runs = []
+
+    async def stream_records_by_file(file_paths):
+        runs.append([file_path.stem for file_path in file_paths])
+        for file_path in file_paths:
+            if file_path.stem == "c":
+                raise CTagsTimeoutError("ctags timed out")
+            yield file_path, [(file_path.stem, "function", 1, None, None)]
+
+    server.ctags.stream_records_by_file = stream_records_by_file
+    records = await server._parse_code_records_batch(files)
+
+    assert runs == [
+        ["a", "b", "c", "d", "e", "f"],
+        ["c", "d"],
+        ["c"],
+        ["d"],
+        ["e", "f"],
+    ]
+    assert sorted(path.stem for path in records) == ["a", "b", "d", "e", "f"]
+    assert records[tmp_path / "e.py"][0][0] == "e"
+
+
+@pytest.mark.asyncio
+async def test_failed_disk_change_batch_is_logged(tmp_path, caplog) -> None:
+    config = TriggerfishConfig(log_file=tmp_path / "log.txt", reindex_debounce_ms=10)
+    server = TriggerfishLanguageServer(config)
+    server._workspace_root = tmp_path
+
+    def fail(changes):
+        raise RuntimeError("broken batch")
+
+    server._classify_file_changes = fail
+    server._queue_file_change(tmp_path / "main.py", True)
+    with pytest.raises(RuntimeError):
+        await server._file_changes_task
+
+    assert "Applying disk changes failed" in caplog.text
+    assert "broken batch" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_opened_file_is_filtered_off_the_event_loop(tmp_path) -> None:
+    server = TriggerfishLanguageServer(TriggerfishConfig(log_file=tmp_path / "log.txt"))
+    threads = []
+
+    def should_parse(file_path):
+        threads.append(threading.current_thread())
+        return False
+
+    server._source_filter.should_parse = should_parse
+    assert await server._parse_code_symbols(tmp_path / "main.py") == []
+
+    assert threads and threads[0] is not threading.main_thread()
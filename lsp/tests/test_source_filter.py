@@ -0,0 +1,35 @@
+"""Tests for the pre-ctags source file filter."""
+
+from triggerfish.source_filter import SourceFilter
+
+_MAPS = {
+    "Python": ["*.py"],
+    "TypeScript": ["*.ts", "*.d.ts"],
+    "Make": ["*.mak", "[Mm]akefile"],
+}
+
+
+def test_only_mapped_languages_are_parsed(tmp_path) -> None:
+    source_filter = SourceFilter(_MAPS)
+    for name in ["app.py", "types.d.ts", "Makefile", "notes.md", "LICENSE", "tool"]:
+        (tmp_path / name).write_text("x = 1\n")
+    (tmp_path / "script").write_text("#!/usr/bin/env python\nx = 1\n")
+
+    parsed = {
+        path.name for path in tmp_path.iterdir() if source_filter.should_parse(path)
+    }
+    assert parsed == {"app.py", "types.d.ts", "Makefile", "script"}
+
+
+def test_binary_minified_empty_and_large_files_are_skipped(tmp_path) -> None:
+    source_filter = SourceFilter(max_file_size=1000)
+    (tmp_path / "image.py").write_bytes(b"\x89PNG\r\n\x1a\n\0\0")
+    (tmp_path / "bundle.py").write_text("x=1;" * 600)
+    (tmp_path / "empty.py").write_text("")
+    (tmp_path / "large.py").write_text("x = 1\n" * 200)
+    (tmp_path / "small.py").write_text("x = 1\n")
+
+    parsed = {
+        path.name for path in tmp_path.iterdir() if source_filter.should_parse(path)
+    }
+    assert parsed == {"small.py"}
@@ -1,8 +1,11 @@
 """Tests for symbol indexing."""
 
+import random
 from pathlib import Path
 
-from triggerfish.symbol_index import Symbol, SymbolIndex, SymbolKind
+import pytest
+
+from triggerfish.symbol_index import PrefixIndex, Symbol, SymbolIndex, SymbolKind
 
 
 def test_add_and_search_symbols() -> None:
@@ -36,3 +39,345 @@ def test_stats_counts() -> None:
     stats = index.stats()
     assert stats["total"] == 1
     assert stats["file"] == 1
+
+
+def test_update_file_replaces_only_that_file() -> None:
+    index = SymbolIndex()
+    main = Path("/tmp/main.py")
+    utils = Path("/tmp/utils.py")
+    index.add_symbols(
+        [
+            Symbol(name="main", kind=SymbolKind.FUNCTION, file_path=main, line=1),
+            Symbol(name="helper", kind=SymbolKind.FUNCTION, file_path=utils, line=1),
+        ]
+    )
+    index.update_file(
+        main, [Symbol(name="run", kind=SymbolKind.FUNCTION, file_path=main, line=2)]
+    )
+
+    names = [symbol.name for symbol in index.get_symbols(SymbolKind.FUNCTION)]
+    assert names == ["helper", "run"]
+    assert index.fuzzy_search("main", kind=SymbolKind.FUNCTION) == []
+    assert index.stats() == {"total": 2, "function": 2}
+
+
+def test_clear_file_compacts_tombstones() -> None:
+    index = SymbolIndex()
+    keep = Path("/tmp/keep.py")
+    index.add_symbols(
+        [Symbol(name="keep", kind=SymbolKind.FUNCTION, file_path=keep, line=1)]
+    )
+    for i in range(3000):
+        file_path = Path(f"/tmp/gen_{i}.py")
+        index.add_symbols(
+            [Symbol(name=f"gen_{i}", kind=SymbolKind.FUNCTION, file_path=file_path, line=1)]
+        )
+    for i in range(3000):
+        index.clear_file(Path(f"/tmp/gen_{i}.py"))
+
+    assert len(index._columns[SymbolKind.FUNCTION].choices) < 3001
+    index.clear_file(keep)
+    assert index.get_symbols(SymbolKind.FUNCTION) == []
+    assert index.stats() == {"total": 0}
+
+
+def test_fuzzy_search_matches_unprocessed_scan_after_updates() -> None:
+    from rapidfuzz import fuzz, process, utils
+
+    index = SymbolIndex()
+    names = ["get_user", "GetUserName", "set_user", "user_id", "Users.get", "delete"]
+    for i, name in enumerate(names):
+        file_path = Path(f"/tmp/file_{i}.py")
+        index.add_symbols(
+            [Symbol(name=name, kind=SymbolKind.METHOD, file_path=file_path, line=1)]
+        )
+    index.clear_file(Path("/tmp/file_2.py"))
+    live = index.get_symbols(SymbolKind.METHOD)
+
+    expected = process.extract(
+        "getUs",
+        [symbol.display_name() for symbol in live],
+        scorer=fuzz.WRatio,
+        processor=utils.default_process,
+        score_cutoff=60,
+        limit=50,
+    )
+    results = index.fuzzy_search("getUs", kind=SymbolKind.METHOD)
+    assert [(symbol.name, score) for symbol, score in results] == [
+        (live[i].name, float(score)) for _choice, score, i in expected
+    ]
+
+
+def test_cdist_backend_ranks_like_extract(monkeypatch) -> None:
+    pytest.importorskip("numpy")
+    monkeypatch.setattr("triggerfish.symbol_index._CDIST_MIN_CHOICES", 0)
+    extract_index = SymbolIndex()
+    cdist_index = SymbolIndex(fuzzy_backend="cdist")
+    rng = random.Random(7)
+    words = ["get", "set", "user", "name", "id", "load", "save", "cache", "by"]
+    for i in range(2000):
+        name = "_".join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+        symbol = Symbol(
+            name=name, kind=SymbolKind.FUNCTION, file_path=Path(f"/tmp/{i}.py"), line=1
+        )
+        extract_index.add_symbols([symbol])
+        cdist_index.add_symbols([symbol])
+    for i in range(0, 2000, 3):
+        extract_index.clear_file(Path(f"/tmp/{i}.py"))
+        cdist_index.clear_file(Path(f"/tmp/{i}.py"))
+
+    for query in ["getUser", "save_cache", "idby", "lod"]:
+        expected = extract_index.fuzzy_search(query, kind=SymbolKind.FUNCTION, limit=25)
+        actual = cdist_index.fuzzy_search(query, kind=SymbolKind.FUNCTION, limit=25)
+        assert actual == expected
+
+
+def test_prefilter_scores_only_capped_candidates(monkeypatch) -> None:
+    monkeypatch.setattr("triggerfish.symbol_index._PREFILTER_MIN_CHOICES", 0)
+    index = SymbolIndex(candidate_cap=2)
+    for i, name in enumerate(["load_user", "load_cache", "save_user", "render"]):
+        index.add_symbols(
+            [
+                Symbol(
+                    name=name,
+                    kind=SymbolKind.FUNCTION,
+                    file_path=Path(f"/tmp/{i}.py"),
+                    line=1,
+                )
+            ]
+        )
+
+    results = index.fuzzy_search("loaduser", kind=SymbolKind.FUNCTION, min_score=0)
+    assert [symbol.name for symbol, _score in results] == ["load_user", "load_cache"]
+    # Queries too short for trigrams fall back to the exhaustive scan
+    assert len(index.fuzzy_search("lo", kind=SymbolKind.FUNCTION, min_score=0)) == 4
+
+
+def test_prefilter_skips_removed_symbols_and_survives_compaction(monkeypatch) -> None:
+    monkeypatch.setattr("triggerfish.symbol_index._PREFILTER_MIN_CHOICES", 0)
+    monkeypatch.setattr("triggerfish.symbol_index._COMPACT_MIN_TOMBSTONES", 1)
+    index = SymbolIndex(candidate_cap=10)
+    for i in range(6):
+        index.add_symbols(
+            [
+                Symbol(
+                    name=f"get_user_{i}",
+                    kind=SymbolKind.METHOD,
+                    file_path=Path(f"/tmp/{i}.py"),
+                    line=1,
+                )
+            ]
+        )
+
+    index.clear_file(Path("/tmp/0.py"))
+    names = {
+        symbol.name for symbol, _ in index.fuzzy_search("getuser", SymbolKind.METHOD)
+    }
+    assert names == {f"get_user_{i}" for i in range(1, 6)}
+
+    for i in range(1, 5):
+        index.clear_file(Path(f"/tmp/{i}.py"))
+    index.add_symbols(
+        [
+            Symbol(
+                name="get_username",
+                kind=SymbolKind.METHOD,
+                file_path=Path("/tmp/n.py"),
+                line=1,
+            )
+        ]
+    )
+    names = {
+        symbol.name for symbol, _ in index.fuzzy_search("getuser", SymbolKind.METHOD)
+    }
+    assert names == {"get_user_5", "get_username"}
+
+
+def test_symbols_round_trip_through_columns(monkeypatch) -> None:
+    monkeypatch.setattr("triggerfish.symbol_index._COMPACT_MIN_TOMBSTONES", 1)
+    index = SymbolIndex()
+    method = Symbol(
+        name="save",
+        kind=SymbolKind.METHOD,
+        file_path=Path("/tmp/models.py"),
+        line=42,
+        scope="User",
+        language="Python",
+    )
+    index.add_symbols(
+        [Symbol(name="tmp", kind=SymbolKind.METHOD, file_path=Path("/tmp/a.py"), line=1)]
+    )
+    index.add_symbols([method])
+    index.add_symbols(
+        [Symbol(name="tmp", kind=SymbolKind.METHOD, file_path=Path("/tmp/b.py"), line=1)]
+    )
+    index.clear_file(Path("/tmp/a.py"))
+    index.clear_file(Path("/tmp/b.py"))
+
+    assert index.get_symbols(SymbolKind.METHOD) == [method]
+    assert index.fuzzy_search("User.save") == [(method, 100.0)]
+    index.clear_file(Path("/tmp/models.py"))
+    assert index.get_symbols() == []
+
+
+def test_add_records_matches_add_symbols() -> None:
+    file_path = Path("/tmp/app.py")
+    records = [
+        ("App", SymbolKind.CLASS, 1, None, "Python"),
+        ("run", SymbolKind.METHOD, 2, "App", "Python"),
+    ]
+    from_records = SymbolIndex()
+    from_records.add_records(file_path, records)
+    from_symbols = SymbolIndex()
+    from_symbols.add_symbols(
+        Symbol(name, kind, file_path, line, scope, language)
+        for name, kind, line, scope, language in records
+    )
+
+    assert from_records.get_symbols() == from_symbols.get_symbols()
+    assert from_records.fuzzy_search("App.run") == from_symbols.fuzzy_search("App.run")
+    from_records.clear_file(file_path)
+    assert from_records.stats() == {"total": 0}
+
+
+def test_prefix_search_ranks_exact_then_start_then_word_matches() -> None:
+    index = SymbolIndex()
+    index.add_records(
+        Path("/tmp/a.py"),
+        [
+            ("user_name", SymbolKind.FUNCTION, 1, None, None),
+            ("get_user", SymbolKind.FUNCTION, 2, None, None),
+            ("username", SymbolKind.FUNCTION, 3, None, None),
+            ("user", SymbolKind.FUNCTION, 4, None, None),
+            ("load", SymbolKind.FUNCTION, 5, None, None),
+        ],
+    )
+
+    matches = index.prefix_search("user", SymbolKind.FUNCTION, limit=10)
+    assert [(symbol.name, score) for symbol, score in matches] == [
+        ("get_user", 100.0),
+        ("user", 100.0),
+        ("user_name", 95.0),
+        ("username", 95.0),
+    ]
+    assert len(index.prefix_search("user", SymbolKind.FUNCTION, limit=2)) == 2
+
+
+def test_prefix_search_returns_the_best_matches_not_the_first() -> None:
+    index = SymbolIndex()
+    names = [f"get_user_{i}" for i in range(20)] + ["user_id", "user"]
+    index.add_records(
+        Path("/tmp/a.py"),
+        [
+            (name, SymbolKind.FUNCTION, line, None, None)
+            for line, name in enumerate(names)
+        ],
+    )
+
+    matches = index.prefix_search("user", SymbolKind.FUNCTION, limit=3)
+
+    assert [(symbol.name, score) for symbol, score in matches] == [
+        ("user", 100.0),
+        ("user_id", 95.0),
+        ("get_user_0", 90.0),
+    ]
+
+
+def _built_prefix_index(index: SymbolIndex, kind: SymbolKind) -> None:
+    prefixes = index.prefix_index_due(kind)
+    assert prefixes is not None
+    prefixes.build()
+    index.install_prefix_index(prefixes)
+
+
+def test_prefix_search_scans_a_bounded_tail_until_an_index_is_built(
+    monkeypatch,
+) -> None:
+    monkeypatch.setattr("triggerfish.symbol_index._PREFIX_TAIL_SCAN", 3)
+    index = SymbolIndex()
+    names = ["load", "save", "user_a", "user_b", "get_user", "user"]
+    index.add_records(
+        Path("/tmp/a.py"),
+        [(name, SymbolKind.FUNCTION, 1, None, None) for name in names],
+    )
+
+    # Only the first three slots are scanned while there is no index
+    matches = index.prefix_search("user", SymbolKind.FUNCTION, limit=10)
+    assert [symbol.name for symbol, _score in matches] == ["user_a"]
+
+    _built_prefix_index(index, SymbolKind.FUNCTION)
+    matches = index.prefix_search("user", SymbolKind.FUNCTION, limit=10)
+    assert [(symbol.name, score) for symbol, score in matches] == [
+        ("get_user", 100.0),
+        ("user", 100.0),
+        ("user_a", 95.0),
+        ("user_b", 95.0),
+    ]
+    assert index.prefix_index_due(SymbolKind.FUNCTION) is None
+
+
+def test_prefix_index_survives_changes_and_compaction(monkeypatch) -> None:
+    monkeypatch.setattr("triggerfish.symbol_index._PREFIX_TAIL_SCAN", 2)
+    monkeypatch.setattr("triggerfish.symbol_index._COMPACT_MIN_TOMBSTONES", 2)
+    index = SymbolIndex()
+    for name in ("old_user", "user_name", "stale_user", "load"):
+        index.add_records(
+            Path(f"/tmp/{name}.py"), [(name, SymbolKind.FUNCTION, 1, None, None)]
+        )
+    _built_prefix_index(index, SymbolKind.FUNCTION)
+    # Taken before the compaction below, so its slots are out of date
+    columns = index._columns[SymbolKind.FUNCTION]
+    outdated = PrefixIndex(SymbolKind.FUNCTION, list(columns.choices) * 4, columns)
+    outdated.build()
+
+    index.add_records(Path("/tmp/b.py"), [("user", SymbolKind.FUNCTION, 1, None, None)])
+    for name in ("old_user", "stale_user", "load"):
+        index.clear_file(Path(f"/tmp/{name}.py"))
+    assert len(index._columns[SymbolKind.FUNCTION].choices) == 2
+    index.install_prefix_index(outdated)
+
+    matches = index.prefix_search("user", SymbolKind.FUNCTION, limit=10)
+    assert [(symbol.name, score) for symbol, score in matches] == [
+        ("user", 100.0),
+        ("user_name", 95.0),
+    ]
+    assert index._prefixes[SymbolKind.FUNCTION].size == 1
+
+
+def test_score_jobs_defer_compaction_until_scan_ends() -> None:
+    index = SymbolIndex()
+    for i in range(3000):
+        index.add_records(
+            Path(f"/tmp/gen_{i}.py"), [(f"gen_{i}", SymbolKind.FUNCTION, 1, None, None)]
+        )
+    full = index.score_slots("gen_2999", SymbolKind.FUNCTION, 60)
+
+    jobs = index.iter_score_jobs("gen_2999", SymbolKind.FUNCTION, 60, 1000)
+    first = index.score_job(next(jobs))
+    for i in range(2000):
+        index.clear_file(Path(f"/tmp/gen_{i}.py"))
+    # Slots from the pinned scan still name the same symbols
+    assert len(index._columns[SymbolKind.FUNCTION].choices) == 3000
+    assert index.symbol_at(SymbolKind.FUNCTION, full[0][0]).name == "gen_2999"
+    assert all(index.symbol_at(SymbolKind.FUNCTION, slot) is None for slot, _ in first)
+    rest = [match for job in jobs for match in index.score_job(job)]
+    assert sorted(rest, key=lambda match: -match[1])[0] == full[0]
+
+    # The finished scan lets the kind compact
+    assert len(index._columns[SymbolKind.FUNCTION].choices) == 1000
+
+
+def test_files_under_lists_indexed_files_of_a_subtree() -> None:
+    index = SymbolIndex()
+    for name in ("src/a.py", "src/pkg/b.py", "src/pkg/deep/c.py", "srcs/d.py"):
+        index.add_records(
+            Path("/repo") / name, [("f", SymbolKind.FUNCTION, 1, None, None)]
+        )
+    index.clear_file(Path("/repo/src/pkg/b.py"))
+
+    assert sorted(index.files_under(Path("/repo/src"))) == [
+        Path("/repo/src/a.py"),
+        Path("/repo/src/pkg/deep/c.py"),
+    ]
+    assert index.files_under(Path("/repo/src/a.py")) == []
+    assert index.files_under(Path("/repo/.git")) == []
@@ -0,0 +1,74 @@
+"""Tests for the content-addressed ctags result cache."""
+
+from pathlib import Path
+
+from triggerfish.tag_cache import TagCache
+
+
+def _tags(*names):
+    return [
+        {
+            "name": name,
+            "kind": "function",
+            "line": line,
+            "path": "/original.py",
+            "scope": None,
+            "language": "Python",
+        }
+        for line, name in enumerate(names, start=1)
+    ]
+
+
+def test_identical_content_is_rebased_to_new_path() -> None:
+    cache = TagCache(max_bytes=1 << 20)
+    data = b"def shared():\n    pass\n"
+    cache.put(cache.key(Path("/vendor/a/util.py"), data), _tags("shared"))
+
+    copy = Path("/vendor/b/util.py")
+    tags = cache.get(cache.key(copy, data), copy)
+
+    assert tags == [
+        {
+            "name": "shared",
+            "kind": "function",
+            "line": 1,
+            "path": str(copy),
+            "scope": None,
+            "language": "Python",
+        }
+    ]
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_key_includes_language_and_extensions() -> None:
+    cache = TagCache(max_bytes=1 << 20)
+    data = b"x = 1\n"
+    python_key = cache.key(Path("a.py"), data)
+
+    assert cache.key(Path("b.py"), data) == python_key
+    assert cache.key(Path("a.js"), data) != python_key
+    assert cache.key(Path("a.py"), data, language="Ruby") != python_key
+    assert cache.key(Path("a.py"), b"x = 2\n") != python_key
+
+
+def test_memory_limit_evicts_least_recently_used() -> None:
+    cache = TagCache(max_bytes=700)
+    keys = [cache.key(Path(f"m{i}.py"), str(i).encode()) for i in range(3)]
+    cache.put(keys[0], _tags("first"))
+    cache.put(keys[1], _tags("second"))
+    cache.get(keys[0], Path("m0.py"))
+    cache.put(keys[2], _tags("third"))
+
+    assert cache.get(keys[1], Path("m1.py")) is None
+    assert cache.get(keys[0], Path("m0.py")) is not None
+    assert cache.stats()["bytes"] <= 700
+    assert cache.stats()["entries"] == 2
+
+
+def test_entry_larger_than_limit_is_not_stored() -> None:
+    cache = TagCache(max_bytes=500)
+    key = cache.key(Path("big.py"), b"...")
+    cache.put(key, _tags(*[f"name_{i}" for i in range(10)]))
+
+    assert cache.get(key, Path("big.py")) is None
+    assert cache.stats() == {"entries": 0, "bytes": 0, "hits": 0, "misses": 1}
@@ -0,0 +1,78 @@
+"""Tests for trigger detection and completion routing."""
+
+from pathlib import Path
+
+import pytest
+from lsprotocol.types import CompletionItemKind
+
+from triggerfish.completion_handler import CompletionHandler
+from triggerfish.config import TriggerfishConfig
+from triggerfish.symbol_index import Symbol, SymbolIndex, SymbolKind
+from triggerfish.trigger_dispatch import TriggerDispatcher, find_trigger
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("open @utils", ("@", "utils")),
+        ("@", ("@", "")),
+        ("extends .MyClass", (".", "MyClass")),
+        ("(#save", ("#", "save")),
+        # The first trigger of the word wins
+        ("@src/main.py", ("@", "src/main.py")),
+        ("see @docs/.env", ("@", "docs/.env")),
+        # Earlier words do not count
+        ("Done. Next", None),
+        ("@notes then #load", ("#", "load")),
+        # Triggers inside words do not count
+        ("e.g.", None),
+        ("mail user@example.com", None),
+        ("written in C#", None),
+        ("", None),
+    ],
+)
+def test_find_trigger(line, expected) -> None:
+    match = find_trigger(line, len(line), "@.#")
+    if expected is None:
+        assert match is None
+    else:
+        assert (match.trigger, match.query) == expected
+
+
+def test_find_trigger_stops_at_cursor() -> None:
+    line = "@util rest"
+    match = find_trigger(line, 3, "@.#")
+    assert match is not None and (match.position, match.query) == (0, "ut")
+
+
+def _handler(index: SymbolIndex, trigger: str) -> CompletionHandler:
+    return CompletionHandler(
+        index,
+        TriggerfishConfig(log_file=Path("/tmp/log.txt")),
+        trigger,
+        [SymbolKind.FILE],
+        CompletionItemKind.File,
+    )
+
+
+def test_dispatcher_selects_only_the_trigger_at_the_cursor() -> None:
+    handlers = [_handler(SymbolIndex(), trigger) for trigger in "@.#"]
+    dispatcher = TriggerDispatcher(handlers)
+
+    line = "see @notes. Then #save"
+    assert dispatcher.select(line, len(line)) == (handlers[2], "save")
+    assert dispatcher.select("A sentence. Another", len("A sentence. Another")) is None
+    assert dispatcher.triggers == ["@", ".", "#"]
+
+
+def test_selected_handler_completes_the_query() -> None:
+    index = SymbolIndex()
+    index.add_symbols(
+        [Symbol("utils.py", SymbolKind.FILE, Path("/tmp/utils.py"), line=1)]
+    )
+    dispatcher = TriggerDispatcher([_handler(index, "@")])
+
+    selected = dispatcher.select("open @util", len("open @util"))
+    assert selected is not None
+    handler, query = selected
+    assert [item.label for item in handler.complete(query)] == ["utils.py"]
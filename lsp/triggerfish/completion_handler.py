@@ -2,12 +2,63 @@
 
 from __future__ import annotations
 
-from typing import List, Optional, Tuple
+import heapq
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 
 from lsprotocol.types import CompletionItem, CompletionItemKind
 
 from .config import TriggerfishConfig
-from .symbol_index import Symbol, SymbolIndex, SymbolKind
+from .symbol_index import ScoreJob, Symbol, SymbolIndex, SymbolKind
+from .trigger_dispatch import find_trigger
+
+
+# Documents whose last query is remembered for refinement
+_REFINE_CACHE_SIZE = 32
+# Refinement starts once the query has this many characters
+_REFINE_MIN_QUERY = 3
+# Only kinds this large are refined; smaller ones are cheap to scan in full
+_REFINE_MIN_CORPUS = 50000
+# Candidates are kept down to this many points below the score cutoff
+_REFINE_SCORE_MARGIN = 20
+# Handlers searching this many symbols answer a new word with a first page
+_FIRST_PAGE_MIN_CORPUS = 50000
+# Slots fuzzy scored per partial result when streaming
+STREAM_CHUNK_SIZE = 20000
+# Slots fuzzy scored between the points where a search can be abandoned
+_SEARCH_CHUNK_SIZE = 20000
+
+_T = TypeVar("_T")
+# A search that yields score jobs, is sent their scores and returns a result
+SearchSteps = Generator[ScoreJob, List[Tuple[int, float]], _T]
+
+
+@dataclass
+class _Refinement:
+    """Candidate slots remembered from a document's previous query.
+
+    Slots are kept as sorted ``array("I")`` columns, 4 bytes each, like the
+    index's own slot lists.
+    """
+
+    query: str
+    generation: int
+    min_score: int
+    candidates: Dict[SymbolKind, array[int]]
 
 
 class CompletionHandler:
@@ -26,58 +77,338 @@ class CompletionHandler:
         self._trigger = trigger
         self._symbol_kinds = symbol_kinds
         self._completion_kind = completion_kind
+        self._refinements: OrderedDict[Optional[str], _Refinement] = OrderedDict()
+        # Query that got a first page, per document
+        self._first_pages: OrderedDict[Optional[str], str] = OrderedDict()
+
+    @property
+    def trigger(self) -> str:
+        return self._trigger
+
+    @property
+    def symbol_kinds(self) -> List[SymbolKind]:
+        return list(self._symbol_kinds)
 
     def should_trigger(self, line: str, character: int) -> bool:
-        return line.rfind(self._trigger, 0, character) != -1
+        return self.parse_query(line, character) is not None
 
     def parse_query(self, line: str, character: int) -> Optional[str]:
-        trigger_index = line.rfind(self._trigger, 0, character)
-        if trigger_index == -1:
-            return None
-        query = line[trigger_index + 1 : character]
-        if not query:
-            return ""
-        if any(char.isspace() for char in query):
-            return None
-        return query
+        match = find_trigger(line, character, self._trigger)
+        return match.query if match is not None else None
 
-    def get_completions(self, line: str, character: int) -> List[CompletionItem]:
+    def get_completions(
+        self, line: str, character: int, uri: Optional[str] = None
+    ) -> List[CompletionItem]:
         query = self.parse_query(line, character)
         if query is None:
             return []
+        return self.complete(query, uri)
+
+    def corpus_size(self) -> int:
+        """Return how many symbols a query of this handler searches."""
+        return sum(self._index.count(kind) for kind in self._symbol_kinds)
+
+    def complete_paged(
+        self, query: str, uri: Optional[str] = None
+    ) -> Tuple[List[CompletionItem], bool]:
+        """Return completions and whether they are incomplete.
 
+        With ``completion_first_page`` enabled on a large corpus, the first
+        request for a word in a document only gets ``first_page`` results,
+        marked incomplete so the client asks again as the user keeps typing.
+        That re-request, and every later one extending the same word, runs
+        the full fuzzy search.
+        """
+        return self._run(self.complete_paged_steps(query, uri))
+
+    def complete_paged_steps(
+        self, query: str, uri: Optional[str] = None
+    ) -> SearchSteps[Tuple[List[CompletionItem], bool]]:
+        """Generator form of ``complete_paged``, returning its result.
+
+        It yields a ``ScoreJob`` for each chunk of each kind and expects the
+        job's scores sent back, so the caller decides where scoring runs. A
+        caller that closes it at a yield abandons the search there, so a
+        cancelled or superseded request stops costing CPU time.
+        """
+        if (
+            query
+            and self._config.completion_first_page
+            and self.corpus_size() >= _FIRST_PAGE_MIN_CORPUS
+        ):
+            previous = self._first_pages.get(uri)
+            if previous is None or not query.startswith(previous):
+                self._first_pages[uri] = query
+                self._first_pages.move_to_end(uri)
+                while len(self._first_pages) > _REFINE_CACHE_SIZE:
+                    self._first_pages.popitem(last=False)
+                return self.first_page(query), True
+        items = yield from self._complete_steps(query, uri)
+        return items, False
+
+    def first_page(self, query: str) -> List[CompletionItem]:
+        """Return exact and prefix matches, found without fuzzy scoring."""
+        limit = self._config.max_completion_items
+        matches: List[Tuple[Symbol, float]] = []
+        for kind in self._symbol_kinds:
+            matches.extend(self._index.prefix_search(query, kind, limit))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return [
+            self._to_completion_item(symbol, score) for symbol, score in matches[:limit]
+        ]
+
+    def stream(self, query: str) -> Iterator[List[CompletionItem]]:
+        """Yield completions in batches suitable for partial results.
+
+        The first batch is ``first_page``. Each later batch comes from fuzzy
+        scoring another ``STREAM_CHUNK_SIZE`` symbols and holds the matches
+        that entered the running top ``max_completion_items``, minus those
+        already yielded. Partial results cannot be retracted, so a client may
+        end up with more than the limit; it ranks them by ``sort_text``.
+        """
+        batches: List[List[CompletionItem]] = []
+        steps = self.stream_steps(query, batches.append)
+        try:
+            job = next(steps)
+            while True:
+                yield from batches
+                batches.clear()
+                job = steps.send(self._index.score_job(job))
+        except StopIteration:
+            pass
+        finally:
+            steps.close()
+        yield from batches
+
+    def stream_steps(
+        self, query: str, emit: Callable[[List[CompletionItem]], None]
+    ) -> SearchSteps[None]:
+        """Generator form of ``stream``, passing each batch to ``emit``.
+
+        Like ``complete_paged_steps``, it yields a ``ScoreJob`` per chunk and
+        expects the job's scores sent back.
+        """
+        limit = self._config.max_completion_items
+        min_score = self._config.min_fuzzy_score
+        first = self.first_page(query)
+        sent = {_item_key(item) for item in first}
+        emit(first)
+        top: List[Tuple[float, int, Symbol]] = []
+        order = 0
+        for kind in self._symbol_kinds:
+            # Slots are only meaningful until the kind is compacted
+            with self._index.pinned(kind):
+                jobs = self._index.iter_score_jobs(
+                    query, kind, min_score, STREAM_CHUNK_SIZE, limit=limit
+                )
+                for job in jobs:
+                    for slot, score in (yield job):
+                        symbol = self._index.symbol_at(kind, slot)
+                        if symbol is None:
+                            continue
+                        # Ties keep the earlier match, like a single full scan
+                        heapq.heappush(top, (score, -order, symbol))
+                        order += 1
+                        if len(top) > limit:
+                            heapq.heappop(top)
+                    batch = []
+                    for score, _order, symbol in sorted(top, reverse=True):
+                        item = self._to_completion_item(symbol, score)
+                        key = _item_key(item)
+                        if key not in sent:
+                            sent.add(key)
+                            batch.append(item)
+                    emit(batch)
+
+    def complete(self, query: str, uri: Optional[str] = None) -> List[CompletionItem]:
+        """Return completions for the text typed after this handler's trigger."""
+        return self._run(self._complete_steps(query, uri))
+
+    def _complete_steps(
+        self, query: str, uri: Optional[str]
+    ) -> SearchSteps[List[CompletionItem]]:
         # Collect symbols from all kinds
         all_matches: List[Tuple[Symbol, float]] = []
 
         if query == "":
             # For empty query, get all symbols from all specified kinds
             for kind in self._symbol_kinds:
-                symbols = self._index.get_symbols(kind)
+                remaining = self._config.max_completion_items - len(all_matches)
+                symbols = self._index.get_symbols(kind, limit=remaining)
                 all_matches.extend([(symbol, 0.0) for symbol in symbols])
             # Limit to max_completion_items
             all_matches = all_matches[: self._config.max_completion_items]
         else:
             # For non-empty query, search across all specified kinds
-            for kind in self._symbol_kinds:
-                matches = self._index.fuzzy_search(
-                    query,
-                    kind=kind,
-                    limit=self._config.max_completion_items,
-                    min_score=self._config.min_fuzzy_score,
-                )
-                all_matches.extend(matches)
+            all_matches = yield from self._search(query, uri)
             # Sort by score descending and limit
             all_matches.sort(key=lambda x: x[1], reverse=True)
             all_matches = all_matches[: self._config.max_completion_items]
 
         return [self._to_completion_item(symbol, score) for symbol, score in all_matches]
 
+    def _search(
+        self, query: str, uri: Optional[str]
+    ) -> SearchSteps[List[Tuple[Symbol, float]]]:
+        """Fuzzy search every kind, refining the document's previous query.
+
+        WRatio scores are not monotonic as a query grows, so refinement is
+        only used where it is both worthwhile and reliable: on kinds large
+        enough that the top results are saturated with strong matches.
+        Candidates are kept with a relaxed cutoff, and any refinement that
+        does not fill the result limit falls back to a full scan.
+        """
+        min_score = self._config.min_fuzzy_score
+        generation = self._index.generation
+        previous = self._refinement_for(query, uri)
+        candidates: Dict[SymbolKind, array[int]] = {}
+        matches: List[Tuple[Symbol, float]] = []
+        for kind in self._symbol_kinds:
+            # Slots are only meaningful until the kind is compacted
+            with self._index.pinned(kind):
+                kind_matches = yield from self._search_kind(
+                    query, kind, previous, candidates
+                )
+                for slot, score in kind_matches:
+                    symbol = self._index.symbol_at(kind, slot)
+                    if symbol is not None:
+                        matches.append((symbol, score))
+
+        self._remember(uri, query, min_score, generation, candidates)
+        return matches
+
+    def _search_kind(
+        self,
+        query: str,
+        kind: SymbolKind,
+        previous: Optional[_Refinement],
+        candidates: Dict[SymbolKind, array[int]],
+    ) -> SearchSteps[List[Tuple[int, float]]]:
+        """Return a kind's best (slot, score) pairs, recording its candidates."""
+        limit = self._config.max_completion_items
+        min_score = self._config.min_fuzzy_score
+        refine = (
+            self._config.completion_refine
+            and len(query) >= _REFINE_MIN_QUERY
+            and self._index.count(kind) >= _REFINE_MIN_CORPUS
+        )
+        if not refine:
+            return (yield from self._scan(query, kind, min_score, limit))
+
+        slots = previous.candidates.get(kind) if previous else None
+        relaxed = max(1, min_score - _REFINE_SCORE_MARGIN)
+        scored = yield from self._scan(query, kind, relaxed, slots=slots)
+        kind_matches = [item for item in scored if item[1] >= min_score][:limit]
+        if slots is not None and len(kind_matches) < limit:
+            scored = yield from self._scan(query, kind, relaxed)
+            kind_matches = [item for item in scored if item[1] >= min_score][:limit]
+        candidates[kind] = array("I", sorted(slot for slot, _score in scored))
+        return kind_matches
+
+    def _scan(
+        self,
+        query: str,
+        kind: SymbolKind,
+        min_score: int,
+        limit: Optional[int] = None,
+        slots: Optional[Sequence[int]] = None,
+    ) -> SearchSteps[List[Tuple[int, float]]]:
+        """Score a kind chunk by chunk, yielding a job for each chunk."""
+        scored: List[Tuple[int, float]] = []
+        jobs = self._index.iter_score_jobs(
+            query, kind, min_score, _SEARCH_CHUNK_SIZE, limit=limit, slots=slots
+        )
+        for job in jobs:
+            scored.extend((yield job))
+        # Stable, so score ties stay in slot order as in a single scan
+        scored.sort(key=lambda item: -item[1])
+        return scored[:limit] if limit is not None else scored
+
+    def _refinement_for(self, query: str, uri: Optional[str]) -> Optional[_Refinement]:
+        previous = self._refinements.get(uri)
+        if previous is None:
+            return None
+        if (
+            previous.generation != self._index.generation
+            or previous.min_score != self._config.min_fuzzy_score
+            or not query.startswith(previous.query)
+        ):
+            return None
+        return previous
+
+    def _remember(
+        self,
+        uri: Optional[str],
+        query: str,
+        min_score: int,
+        generation: int,
+        candidates: Dict[SymbolKind, array[int]],
+    ) -> None:
+        if not candidates:
+            self._refinements.pop(uri, None)
+            return
+        self._refinements[uri] = _Refinement(
+            query=query,
+            generation=generation,
+            min_score=min_score,
+            candidates=candidates,
+        )
+        self._refinements.move_to_end(uri)
+        while len(self._refinements) > _REFINE_CACHE_SIZE:
+            self._refinements.popitem(last=False)
+
+    def _run(self, steps: SearchSteps[_T]) -> _T:
+        """Run a search to the end, scoring its jobs inline."""
+        try:
+            job = next(steps)
+            while True:
+                job = steps.send(self._index.score_job(job))
+        except StopIteration as done:
+            return done.value
+
     def _to_completion_item(self, symbol: Symbol, score: float) -> CompletionItem:
+        """Build a lean item; ``detail`` is left to ``completionItem/resolve``."""
         sort_text = f"{100 - int(score):03d}"
         return CompletionItem(
             label=symbol.name,
             kind=self._completion_kind,
-            detail=f"{symbol.kind.value} at {symbol.file_path}:{symbol.line}",
             sort_text=sort_text,
             insert_text=symbol.name,
+            data=[
+                symbol.kind.value,
+                self._index.path_id(symbol.file_path),
+                symbol.line,
+            ],
         )
+
+
+def decode_item_data(
+    data: Any, index: SymbolIndex
+) -> Optional[Tuple[SymbolKind, Path, int]]:
+    """Return the kind, path and line an item's ``data`` handle points to.
+
+    Items carry ``[kind, path ID, line]`` rather than the path itself. Returns
+    None for data that is not such a handle, e.g. from an older session.
+    """
+    if not isinstance(data, list) or len(data) != 3:
+        return None
+    kind_value, path_id, line = data
+    if not isinstance(path_id, int) or not isinstance(line, int):
+        return None
+    try:
+        kind = SymbolKind(kind_value)
+    except ValueError:
+        return None
+    file_path = index.path_at(path_id)
+    if file_path is None:
+        return None
+    return kind, file_path, line
+
+
+def item_detail(kind: SymbolKind, file_path: Path, line: int) -> str:
+    return f"{kind.value} at {file_path}:{line}"
+
+
+def _item_key(item: CompletionItem) -> Tuple[str, Tuple[Any, ...]]:
+    return item.label, tuple(item.data)
+
@@ -2,13 +2,16 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
+import logging
 import os
 
 from dotenv import load_dotenv
 
+from .symbol_index import FUZZY_BACKENDS
+
 
 _ENV_PREFIX = "TRIGGERFISH_"
 
@@ -37,18 +40,40 @@ class TriggerfishConfig:
     log_level: str = "INFO"
     ctags_executable: str = "ctags"
     ctags_timeout: int = 30
+    ctags_batch_size: int = 2000
+    ctags_lean_output: bool = True
+    ctags_interactive: bool = True
+    ctags_cache_max_bytes: int = 32 * 1024 * 1024
+    index_workers: int = field(default_factory=lambda: os.cpu_count() or 1)
+    index_exclude: List[str] = field(default_factory=list)
+    index_use_git: bool = False
+    index_max_file_size: int = 1024 * 1024
+    watch_files: bool = True
+    cache_dir: Optional[Path] = None
+    cache_content_hash: bool = False
+    reindex_debounce_ms: int = 300
     min_fuzzy_score: int = 60
     max_completion_items: int = 50
+    fuzzy_backend: str = "extract"
+    completion_refine: bool = True
+    completion_first_page: bool = False
+    completion_threads: int = 2
+    completion_processes: int = 0
+    fuzzy_prefilter: bool = False
+    fuzzy_candidate_cap: int = 5000
     core_enabled: bool = True
     core_executable: str = "triggerfish-core"
     core_timeout: int = 10
 
     @classmethod
     def default(cls) -> "TriggerfishConfig":
-        """Create default config and ensure log directory exists."""
-        log_dir = Path.home() / ".triggerfish" / "logs"
+        """Create default config and ensure log and cache directories exist."""
+        base_dir = Path.home() / ".triggerfish"
+        log_dir = base_dir / "logs"
         log_dir.mkdir(parents=True, exist_ok=True)
-        return cls(log_file=log_dir / "triggerfish.log")
+        cache_dir = base_dir / "cache"
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        return cls(log_file=log_dir / "triggerfish.log", cache_dir=cache_dir)
 
     @classmethod
     def from_env(cls) -> "TriggerfishConfig":
@@ -58,8 +83,28 @@ class TriggerfishConfig:
         log_file = os.getenv(f"{_ENV_PREFIX}LOG_FILE")
         ctags_executable = os.getenv(f"{_ENV_PREFIX}CTAGS_EXECUTABLE")
         ctags_timeout = _get_int_env(f"{_ENV_PREFIX}CTAGS_TIMEOUT")
+        ctags_batch_size = _get_int_env(f"{_ENV_PREFIX}CTAGS_BATCH_SIZE")
+        ctags_lean_output = os.getenv(f"{_ENV_PREFIX}CTAGS_LEAN_OUTPUT", "1")
+        ctags_interactive = os.getenv(f"{_ENV_PREFIX}CTAGS_INTERACTIVE", "1")
+        ctags_cache_max_bytes = _get_int_env(f"{_ENV_PREFIX}CTAGS_CACHE_MAX_BYTES")
+        index_workers = _get_int_env(f"{_ENV_PREFIX}INDEX_WORKERS")
+        index_exclude = os.getenv(f"{_ENV_PREFIX}INDEX_EXCLUDE")
+        index_use_git = os.getenv(f"{_ENV_PREFIX}INDEX_USE_GIT", "0")
+        index_max_file_size = _get_int_env(f"{_ENV_PREFIX}INDEX_MAX_FILE_SIZE")
+        watch_files = os.getenv(f"{_ENV_PREFIX}WATCH_FILES", "1")
+        cache_enabled = os.getenv(f"{_ENV_PREFIX}CACHE_ENABLED", "1")
+        cache_dir = os.getenv(f"{_ENV_PREFIX}CACHE_DIR")
+        cache_content_hash = os.getenv(f"{_ENV_PREFIX}CACHE_CONTENT_HASH", "0")
+        reindex_debounce_ms = _get_int_env(f"{_ENV_PREFIX}REINDEX_DEBOUNCE_MS")
         min_fuzzy_score = _get_int_env(f"{_ENV_PREFIX}MIN_FUZZY_SCORE")
         max_completion_items = _get_int_env(f"{_ENV_PREFIX}MAX_COMPLETION_ITEMS")
+        fuzzy_backend = os.getenv(f"{_ENV_PREFIX}FUZZY_BACKEND")
+        completion_refine = os.getenv(f"{_ENV_PREFIX}COMPLETION_REFINE", "1")
+        first_page = os.getenv(f"{_ENV_PREFIX}COMPLETION_FIRST_PAGE", "0")
+        completion_threads = _get_int_env(f"{_ENV_PREFIX}COMPLETION_THREADS")
+        completion_processes = _get_int_env(f"{_ENV_PREFIX}COMPLETION_PROCESSES")
+        fuzzy_prefilter = os.getenv(f"{_ENV_PREFIX}FUZZY_PREFILTER", "0")
+        fuzzy_candidate_cap = _get_int_env(f"{_ENV_PREFIX}FUZZY_CANDIDATE_CAP")
         core_enabled = os.getenv(f"{_ENV_PREFIX}CORE_ENABLED", "1")
         core_executable = os.getenv(f"{_ENV_PREFIX}CORE_EXECUTABLE")
         core_timeout = _get_int_env(f"{_ENV_PREFIX}CORE_TIMEOUT")
@@ -72,10 +117,50 @@ class TriggerfishConfig:
             config.ctags_executable = ctags_executable
         if ctags_timeout is not None:
             config.ctags_timeout = ctags_timeout
+        if ctags_batch_size is not None:
+            config.ctags_batch_size = ctags_batch_size
+        config.ctags_lean_output = ctags_lean_output.lower() in ("1", "true", "yes")
+        config.ctags_interactive = ctags_interactive.lower() in ("1", "true", "yes")
+        if ctags_cache_max_bytes is not None:
+            config.ctags_cache_max_bytes = ctags_cache_max_bytes
+        if index_workers is not None:
+            config.index_workers = index_workers
+        if index_exclude:
+            patterns = [pattern.strip() for pattern in index_exclude.split(",")]
+            config.index_exclude = [pattern for pattern in patterns if pattern]
+        config.index_use_git = index_use_git.lower() in ("1", "true", "yes")
+        if index_max_file_size is not None:
+            config.index_max_file_size = index_max_file_size
+        config.watch_files = watch_files.lower() in ("1", "true", "yes")
+        if cache_dir:
+            config.cache_dir = Path(cache_dir)
+        if cache_enabled.lower() not in ("1", "true", "yes"):
+            config.cache_dir = None
+        config.cache_content_hash = cache_content_hash.lower() in ("1", "true", "yes")
+        if reindex_debounce_ms is not None:
+            config.reindex_debounce_ms = reindex_debounce_ms
         if min_fuzzy_score is not None:
             config.min_fuzzy_score = min_fuzzy_score
         if max_completion_items is not None:
             config.max_completion_items = max_completion_items
+        if fuzzy_backend and fuzzy_backend.lower() in FUZZY_BACKENDS:
+            config.fuzzy_backend = fuzzy_backend.lower()
+        elif fuzzy_backend:
+            logging.warning(
+                "Unknown %sFUZZY_BACKEND %r, using %r",
+                _ENV_PREFIX,
+                fuzzy_backend,
+                config.fuzzy_backend,
+            )
+        config.completion_refine = completion_refine.lower() in ("1", "true", "yes")
+        config.completion_first_page = first_page.lower() in ("1", "true", "yes")
+        if completion_threads is not None:
+            config.completion_threads = completion_threads
+        if completion_processes is not None:
+            config.completion_processes = completion_processes
+        config.fuzzy_prefilter = fuzzy_prefilter.lower() in ("1", "true", "yes")
+        if fuzzy_candidate_cap is not None:
+            config.fuzzy_candidate_cap = fuzzy_candidate_cap
         config.core_enabled = core_enabled.lower() in ("1", "true", "yes")
         if core_executable:
             config.core_executable = core_executable
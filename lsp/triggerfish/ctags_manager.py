@@ -2,13 +2,47 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+import asyncio
 import json
-import subprocess
+import logging
+import os
+import tempfile
 
 from .config import TriggerfishConfig
+from .tag_cache import TagCache
+
+try:
+    import orjson
+except ImportError:  # orjson only speeds up decoding
+    orjson = None
+
+_loads: Callable[[Union[str, bytes]], Any] = (
+    orjson.loads if orjson is not None else json.loads
+)
+
+# Fields the index keeps: name, input file, line, kind (long name), scope, language
+_LEAN_FIELDS = "NFnKsl"
+
+# A tag as ctags reports it: (name, kind, line, scope, language)
+TagRecord = Tuple[str, str, int, Optional[str], Optional[str]]
+
+_T = TypeVar("_T")
 
 
 class CTagsError(RuntimeError):
@@ -23,78 +57,557 @@ class CTagsTimeoutError(CTagsError):
     """Raised when ctags execution times out."""
 
 
+class CTagsInteractiveUnsupportedError(CTagsError):
+    """Raised when ctags does not support ``--_interactive`` mode."""
+
+
 @dataclass
 class CTagsManager:
-    """Manage calls to universal-ctags."""
+    """Manage calls to universal-ctags.
+
+    ctags runs as an asyncio subprocess, so the event loop keeps serving
+    requests while it works. A run is killed once ``ctags_timeout``
+    elapses, or when the awaiting task is cancelled. Batch runs only time
+    out when ctags produces no output for that long.
+    """
 
     config: TriggerfishConfig
+    cache: Optional[TagCache] = field(default=None, init=False, compare=False)
+    _interactive: Optional[InteractiveCTags] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _interactive_unsupported: bool = field(
+        default=False, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        if self.config.ctags_cache_max_bytes > 0:
+            self.cache = TagCache(self.config.ctags_cache_max_bytes)
 
-    def generate_tags(
+    async def generate_tags(
         self, file_path: Path, language: Optional[str] = None
     ) -> List[Dict[str, Any]]:
-        """Generate tags for a file. Returns normalized tag dictionaries."""
-        command = [
+        """Generate tags for a file. Returns normalized tag dictionaries.
+
+        Content that was parsed before, under any path, is served from the
+        tag cache without running ctags. The file is only read and hashed
+        here when the cache is enabled, and then on a worker thread.
+        """
+        cache = self.cache
+        if cache is None:
+            return await self._generate_fresh(file_path, None, language, on_disk=True)
+
+        def read() -> Tuple[bytes, Tuple[bytes, str]]:
+            data = file_path.read_bytes()
+            return data, cache.key(file_path, data, language)
+
+        try:
+            data, key = await asyncio.to_thread(read)
+        except OSError:  # ctags reports why the file cannot be read
+            return await self._generate_file(file_path, language)
+        return await self._generate_cached(file_path, data, key, language, on_disk=True)
+
+    async def generate_tags_for_text(
+        self, file_path: Path, text: str, language: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Generate tags for unsaved buffer contents.
+
+        The text is sent to the interactive ctags session when possible.
+        Otherwise it is written to a temporary file with the same name as
+        ``file_path`` so ctags detects the language the same way. Either way
+        the returned tags report ``file_path`` as their path.
+        """
+        data = text.encode("utf-8")
+        if self.cache is None:
+            return await self._generate_fresh(file_path, data, language, on_disk=False)
+        key = self.cache.key(file_path, data, language)
+        return await self._generate_cached(
+            file_path, data, key, language, on_disk=False
+        )
+
+    async def generate_tags_batch(
+        self, file_paths: Sequence[Path]
+    ) -> Dict[Path, List[Dict[str, Any]]]:
+        """Generate tags for many files with a single ctags run.
+
+        Args:
+            file_paths: Files to parse.
+
+        Returns:
+            Mapping of every input path to its normalized tags. Files that
+            produce no tags map to an empty list.
+        """
+        results: Dict[Path, List[Dict[str, Any]]] = {}
+        async for file_path, tags in self.stream_tags_by_file(file_paths):
+            results.setdefault(file_path, []).extend(tags)
+        return results
+
+    async def stream_tags(
+        self, file_paths: Sequence[Path]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield normalized tags for many files as a single ctags run emits them.
+
+        The file list is fed to ctags on stdin (``-L -``) and its JSON output is
+        read line by line, so tags are usable while ctags is still running and
+        the output is never held in memory as a whole.
+
+        Raises:
+            CTagsError: Once the output is exhausted, if ctags failed or timed
+                out. Tags yielded before that point are still valid.
+        """
+        if not file_paths:
+            return
+        async for line in self._stream(self._batch_command(), _file_list(file_paths)):
+            tag = _parse_ctags_line(line)
+            if tag is not None:
+                yield tag
+
+    def stream_tags_by_file(
+        self, file_paths: Sequence[Path]
+    ) -> AsyncIterator[Tuple[Path, List[Dict[str, Any]]]]:
+        """Yield ``(path, tags)`` for each input file as ctags finishes it.
+
+        ctags writes each file's tags contiguously, so a file's group is
+        yielded as soon as output moves on to the next file. Files without
+        tags are yielded with an empty list once ctags has finished.
+        """
+
+        async def tags() -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+            async for tag in self.stream_tags(file_paths):
+                yield tag["path"], tag
+
+        return _group_by_file(file_paths, tags())
+
+    def stream_records_by_file(
+        self, file_paths: Sequence[Path]
+    ) -> AsyncIterator[Tuple[Path, List[TagRecord]]]:
+        """Like ``stream_tags_by_file``, decoding tags into ``TagRecord`` tuples.
+
+        This is the cheapest way to get tags out of ctags: no per-tag dict
+        is built beyond the decoded JSON object.
+        """
+
+        async def records() -> AsyncIterator[Tuple[str, TagRecord]]:
+            if not file_paths:
+                return
+            stdin = _file_list(file_paths)
+            async for line in self._stream(self._batch_command(), stdin):
+                record = _parse_ctags_record(line)
+                if record is not None:
+                    yield record
+
+        return _group_by_file(file_paths, records())
+
+    async def list_language_maps(self) -> Dict[str, List[str]]:
+        """Return the file name patterns ctags maps to each language.
+
+        Parsed from ``ctags --list-maps``, so user configuration that adds
+        or removes mappings is reflected. Patterns are shell globs such as
+        ``*.py`` or ``[Mm]akefile``.
+        """
+        stdout = await self._run([self.config.ctags_executable, "--list-maps"])
+        maps: Dict[str, List[str]] = {}
+        for line in stdout.splitlines():
+            fields = line.split()
+            if len(fields) < 2 or fields[0].startswith("#"):
+                continue
+            maps[fields[0]] = fields[1:]
+        return maps
+
+    async def verify_ctags_available(self) -> bool:
+        """Return True if ctags is available."""
+        try:
+            await self._run([self.config.ctags_executable, "--version"])
+        except CTagsError:
+            return False
+        return True
+
+    async def close(self) -> None:
+        """Stop the interactive ctags session, if one is running."""
+        if self._interactive is not None:
+            await self._interactive.close()
+
+    async def _generate_cached(
+        self,
+        file_path: Path,
+        data: bytes,
+        key: Tuple[bytes, str],
+        language: Optional[str],
+        on_disk: bool,
+    ) -> List[Dict[str, Any]]:
+        """Return tags for ``data`` as the contents of ``file_path``, caching them."""
+        assert self.cache is not None
+        cached = self.cache.get(key, file_path)
+        if cached is not None:
+            return cached
+        tags = await self._generate_fresh(file_path, data, language, on_disk)
+        self.cache.put(key, tags)
+        return tags
+
+    async def _generate_fresh(
+        self,
+        file_path: Path,
+        data: Optional[bytes],
+        language: Optional[str],
+        on_disk: bool,
+    ) -> List[Dict[str, Any]]:
+        """Run ctags on ``file_path``, or on ``data`` as its contents when given."""
+        tags = None
+        if language is None:
+            tags = await self._generate_interactive(file_path, data)
+        if tags is not None:
+            return tags
+        if on_disk or data is None:
+            return await self._generate_file(file_path, language)
+        return await self._generate_buffer(file_path, data, language)
+
+    async def _generate_file(
+        self, file_path: Path, language: Optional[str]
+    ) -> List[Dict[str, Any]]:
+        command = self._base_command()
+        if language:
+            command.append(f"--language-force={language}")
+        command.append(str(file_path))
+        return _parse_ctags_output(await self._run(command))
+
+    async def _generate_buffer(
+        self, file_path: Path, data: bytes, language: Optional[str]
+    ) -> List[Dict[str, Any]]:
+        with tempfile.TemporaryDirectory(prefix="triggerfish-") as tmp_dir:
+            buffer_path = Path(tmp_dir) / file_path.name
+            buffer_path.write_bytes(data)
+            tags = await self._generate_file(buffer_path, language)
+        for tag in tags:
+            tag["path"] = str(file_path)
+        return tags
+
+    async def _generate_interactive(
+        self, file_path: Path, data: Optional[bytes] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Parse with the interactive session, or return None if it is unavailable."""
+        if not self.config.ctags_interactive or self._interactive_unsupported:
+            return None
+        if self._interactive is None:
+            self._interactive = InteractiveCTags(
+                self._base_command(), self.config.ctags_timeout
+            )
+        try:
+            return await self._interactive.generate_tags(file_path, data)
+        except CTagsInteractiveUnsupportedError:
+            logging.info("ctags has no interactive mode, starting it per file")
+            self._interactive_unsupported = True
+            return None
+
+    def _base_command(self) -> List[str]:
+        if self.config.ctags_lean_output:
+            # Line numbers instead of search patterns, which are never used
+            return [
+                self.config.ctags_executable,
+                "--output-format=json",
+                f"--fields={_LEAN_FIELDS}",
+                "--excmd=number",
+            ]
+        return [
             self.config.ctags_executable,
             "--output-format=json",
             "--fields=*",
             "--excmd=pattern",
         ]
-        if language:
-            command.append(f"--language-force={language}")
-        command.append(str(file_path))
 
+    def _batch_command(self) -> List[str]:
+        return [*self._base_command(), "-L", "-"]
+
+    async def _run(self, command: List[str]) -> str:
+        process = await _spawn(command, stdin=asyncio.subprocess.DEVNULL)
         try:
-            completed = subprocess.run(
-                command,
-                capture_output=True,
-                text=True,
-                check=True,
-                timeout=self.config.ctags_timeout,
+            stdout, _ = await asyncio.wait_for(
+                process.communicate(), self.config.ctags_timeout
             )
-        except FileNotFoundError as exc:
-            raise CTagsNotFoundError("ctags executable not found") from exc
-        except subprocess.TimeoutExpired as exc:
+        except asyncio.TimeoutError as exc:
             raise CTagsTimeoutError("ctags timed out") from exc
-        except subprocess.CalledProcessError as exc:
-            raise CTagsError("ctags execution failed") from exc
+        finally:
+            await _reap(process)
+        if process.returncode != 0:
+            raise CTagsError("ctags execution failed")
+        return stdout.decode("utf-8", errors="replace")
 
-        return _parse_ctags_output(completed.stdout)
+    async def _stream(self, command: List[str], stdin: bytes) -> AsyncIterator[bytes]:
+        """Run ctags and yield its stdout line by line.
 
-    def verify_ctags_available(self) -> bool:
-        """Return True if ctags is available."""
+        stdin is written by a separate task so a large file list cannot
+        deadlock against a full stdout pipe. A batch of thousands of files
+        may rightly take longer than ``ctags_timeout``, so the process is
+        only killed once it has produced no output for that long. Time the
+        consumer spends on a line is not counted, since ctags may be blocked
+        on the pipe meanwhile. It is also killed when the consumer stops
+        iterating.
+        """
+        process = await _spawn(command, stdin=asyncio.subprocess.PIPE)
+        loop = asyncio.get_running_loop()
+        timeout = self.config.ctags_timeout
+        timed_out = False
+        # When output was last awaited, or None while the consumer holds a line
+        waiting_since: Optional[float] = loop.time()
+
+        def expire() -> None:
+            nonlocal timed_out, timer
+            idle = 0.0 if waiting_since is None else loop.time() - waiting_since
+            if idle < timeout:
+                timer = loop.call_later(timeout - idle, expire)
+                return
+            timed_out = True
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+
+        timer = loop.call_later(timeout, expire)
+        writer = asyncio.ensure_future(_write_stdin(process.stdin, stdin))
         try:
-            completed = subprocess.run(
-                [self.config.ctags_executable, "--version"],
-                capture_output=True,
-                text=True,
-                check=False,
-                timeout=self.config.ctags_timeout,
-            )
-        except FileNotFoundError:
-            return False
-        return completed.returncode == 0
+            if process.stdout is not None:
+                async for line in process.stdout:
+                    waiting_since = None
+                    yield line
+                    waiting_since = loop.time()
+            await process.wait()
+        finally:
+            timer.cancel()
+            writer.cancel()
+            await _reap(process)
+        if timed_out:
+            raise CTagsTimeoutError("ctags timed out")
+        if process.returncode != 0:
+            raise CTagsError("ctags execution failed")
+
+
+class InteractiveCTags:
+    """A long-lived ``ctags --_interactive`` process for reparsing single files.
+
+    Starting ctags costs tens of milliseconds, more than parsing one edited
+    buffer takes. The session keeps one process running and sends it
+    ``generate-tags`` commands over stdin, with buffer contents inlined.
+    Requests are served one at a time. A process that crashes or exceeds
+    ``timeout`` is killed and replaced on the next request.
+    """
+
+    def __init__(self, command: List[str], timeout: float) -> None:
+        self._command = [*command, "--_interactive"]
+        self._timeout = timeout
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def generate_tags(
+        self, file_path: Path, data: Optional[bytes] = None
+    ) -> List[Dict[str, Any]]:
+        """Parse ``file_path``, or ``data`` as its contents when given.
+
+        Raises:
+            CTagsInteractiveUnsupportedError: If ctags has no interactive mode.
+            CTagsTimeoutError: If ctags did not answer within the timeout.
+            CTagsError: If ctags could not be started or crashed.
+        """
+        request: Dict[str, Any] = {
+            "command": "generate-tags",
+            "filename": str(file_path),
+        }
+        if data is not None:
+            request["size"] = len(data)
+        payload = json.dumps(request).encode() + b"\n" + (data or b"")
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # A cancelled caller must not leave a half-read response for the next one
+        task = asyncio.ensure_future(self._request(payload))
+        task.add_done_callback(_retrieve_exception)
+        return await asyncio.shield(task)
+
+    async def close(self) -> None:
+        """Stop the ctags process; the next request starts a new one."""
+        process, self._process = self._process, None
+        if process is not None:
+            await _reap(process)
+
+    async def _request(self, payload: bytes) -> List[Dict[str, Any]]:
+        assert self._lock is not None
+        async with self._lock:
+            process = await self._ensure_process()
+            try:
+                return await asyncio.wait_for(
+                    self._exchange(process, payload), self._timeout
+                )
+            except asyncio.TimeoutError as exc:
+                await self.close()
+                raise CTagsTimeoutError("ctags timed out") from exc
+            except (CTagsError, asyncio.CancelledError):
+                await self.close()
+                raise
+
+    async def _ensure_process(self) -> asyncio.subprocess.Process:
+        if self._process is not None and self._process.returncode is None:
+            return self._process
+        await self.close()
+        process = await _spawn(self._command, stdin=asyncio.subprocess.PIPE)
+        assert process.stdout is not None
+        try:
+            banner = await asyncio.wait_for(process.stdout.readline(), self._timeout)
+        except asyncio.TimeoutError:
+            banner = b""
+        entry = _decode_entry(banner)
+        if entry is None or entry.get("_type") != "program":
+            await _reap(process)
+            raise CTagsInteractiveUnsupportedError("ctags has no interactive mode")
+        self._process = process
+        return process
+
+    @staticmethod
+    async def _exchange(
+        process: asyncio.subprocess.Process, payload: bytes
+    ) -> List[Dict[str, Any]]:
+        assert process.stdin is not None and process.stdout is not None
+        try:
+            process.stdin.write(payload)
+            await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as exc:
+            raise CTagsError("ctags exited") from exc
+        tags: List[Dict[str, Any]] = []
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                raise CTagsError("ctags exited during a request")
+            entry = _decode_entry(line)
+            if entry is None:
+                continue
+            entry_type = entry.get("_type")
+            if entry_type == "tag":
+                tags.append(_normalize_tag(entry))
+            elif entry_type == "completed":
+                return tags
+            elif entry_type == "error" and entry.get("fatal"):
+                raise CTagsError(f"ctags failed: {entry.get('message')}")
+
+
+async def _spawn(command: List[str], stdin: int) -> asyncio.subprocess.Process:
+    try:
+        return await asyncio.create_subprocess_exec(
+            *command,
+            stdin=stdin,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    except FileNotFoundError as exc:
+        raise CTagsNotFoundError("ctags executable not found") from exc
+    except OSError as exc:
+        raise CTagsError(f"ctags could not be started: {exc}") from exc
+
+
+def _retrieve_exception(task: asyncio.Future[Any]) -> None:
+    """Mark a shielded task's exception as seen when its caller went away."""
+    if not task.cancelled():
+        task.exception()
+
+
+async def _reap(process: asyncio.subprocess.Process) -> None:
+    """Kill ``process`` if it is still running and wait for it to exit."""
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        # Shielded so a cancelled caller still leaves no zombie behind
+        await asyncio.shield(process.wait())
+
+
+async def _group_by_file(
+    file_paths: Iterable[Path], items: AsyncIterable[Tuple[str, _T]]
+) -> AsyncIterator[Tuple[Path, List[_T]]]:
+    """Group ``(path string, item)`` pairs into per-file lists as they arrive."""
+    paths_by_name = {str(file_path): file_path for file_path in file_paths}
+    remaining = dict.fromkeys(paths_by_name.values())
+    current: Optional[Path] = None
+    current_items: List[_T] = []
+    async for name, item in items:
+        file_path = paths_by_name.get(name)
+        if file_path is None:
+            continue
+        if file_path != current:
+            if current is not None:
+                yield current, current_items
+            current, current_items = file_path, []
+            remaining.pop(file_path, None)
+        current_items.append(item)
+    if current is not None:
+        yield current, current_items
+    for file_path in remaining:
+        yield file_path, []
+
+
+def _file_list(file_paths: Iterable[Path]) -> bytes:
+    return b"".join(os.fsencode(file_path) + b"\n" for file_path in file_paths)
+
+
+async def _write_stdin(pipe: Optional[asyncio.StreamWriter], data: bytes) -> None:
+    if pipe is None:
+        return
+    try:
+        pipe.write(data)
+        await pipe.drain()
+        pipe.close()
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # ctags exited early; its exit status reports why
 
 
 def _parse_ctags_output(stdout: str) -> List[Dict[str, Any]]:
     tags: List[Dict[str, Any]] = []
     for line in stdout.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            entry = json.loads(line)
-        except json.JSONDecodeError:
-            continue
-        if entry.get("_type") != "tag":
-            continue
-        tags.append(
-            {
-                "name": entry.get("name"),
-                "kind": entry.get("kind"),
-                "line": entry.get("line"),
-                "path": entry.get("path"),
-                "scope": entry.get("scope"),
-                "language": entry.get("language"),
-            }
-        )
+        tag = _parse_ctags_line(line)
+        if tag is not None:
+            tags.append(tag)
     return tags
+
+
+def _parse_ctags_line(line: Union[str, bytes]) -> Optional[Dict[str, Any]]:
+    """Normalize one line of ctags JSON output, or return None if not a tag."""
+    entry = _decode_entry(line)
+    if entry is None or entry.get("_type") != "tag":
+        return None
+    return _normalize_tag(entry)
+
+
+def _decode_entry(line: Union[str, bytes]) -> Optional[Dict[str, Any]]:
+    """Decode one line of ctags JSON output, or return None if it is not JSON."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        entry = _loads(line)
+    except ValueError:  # malformed JSON or invalid UTF-8
+        return None
+    return entry if isinstance(entry, dict) else None
+
+
+def _normalize_tag(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "name": entry.get("name"),
+        "kind": entry.get("kind"),
+        "line": entry.get("line"),
+        "path": entry.get("path"),
+        "scope": entry.get("scope"),
+        "language": entry.get("language"),
+    }
+
+
+def _parse_ctags_record(line: bytes) -> Optional[Tuple[str, TagRecord]]:
+    """Decode one line of ctags JSON output into ``(path, record)``."""
+    try:
+        entry = _loads(line)
+    except ValueError:
+        return None
+    if entry.get("_type") != "tag":
+        return None
+    get = entry.get
+    return get("path"), (
+        get("name"),
+        get("kind"),
+        get("line"),
+        get("scope"),
+        get("language"),
+    )
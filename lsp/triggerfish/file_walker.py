@@ -0,0 +1,293 @@
+"""Workspace file discovery honoring ignore files."""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Tuple
+
+# Gitignore-style patterns excluded from every workspace, before ignore files
+DEFAULT_EXCLUDES = (
+    ".*/",  # .git, .venv, .tox, .mypy_cache, ...
+    "__pycache__/",
+    "node_modules/",
+    "venv/",
+    "env/",
+    "dist/",
+    "build/",
+)
+
+IGNORE_FILES = (".gitignore", ".ignore")
+
+_GIT_TIMEOUT = 30
+_GITLINK_MODE = "160000"
+
+
+@dataclass(frozen=True)
+class _IgnoreRule:
+    regex: Pattern[str]
+    negated: bool
+    dir_only: bool
+    # Unanchored patterns (no inner slash) match the name at any depth
+    anchored: bool
+
+    def matches(self, relative: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if not self.anchored:
+            relative = relative.rsplit("/", 1)[-1]
+        return self.regex.fullmatch(relative) is not None
+
+
+# Rules of one ignore file, with the workspace-relative directory they apply to
+_RuleSet = Tuple[str, Tuple[_IgnoreRule, ...]]
+
+
+def parse_ignore_patterns(lines: Iterable[str]) -> Tuple[_IgnoreRule, ...]:
+    """Parse gitignore-style lines into rules, skipping blanks and comments."""
+    rules = []
+    for line in lines:
+        pattern = line.rstrip("\n").rstrip()
+        if not pattern or pattern.startswith("#"):
+            continue
+        negated = pattern.startswith("!")
+        if negated:
+            pattern = pattern[1:]
+        elif pattern.startswith(("\\#", "\\!")):
+            pattern = pattern[1:]
+        dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if not pattern:
+            continue
+        anchored = "/" in pattern
+        rules.append(
+            _IgnoreRule(
+                regex=re.compile(_translate(pattern.lstrip("/"))),
+                negated=negated,
+                dir_only=dir_only,
+                anchored=anchored,
+            )
+        )
+    return tuple(rules)
+
+
+def walk_files(
+    root: Path, excludes: Iterable[str] = DEFAULT_EXCLUDES
+) -> Iterator[Path]:
+    """Yield the files under ``root`` that are not excluded or ignored.
+
+    Walks iteratively with ``os.scandir`` so entry types come from the
+    directory listing instead of a stat per entry. ``excludes`` apply from the
+    root; each directory's ``.gitignore`` and ``.ignore`` apply below it, with
+    deeper files and later lines taking precedence. Symlinked directories are
+    not followed.
+    """
+    stack: List[Tuple[str, str, Tuple[_RuleSet, ...]]] = [
+        (str(root), "", (("", parse_ignore_patterns(excludes)),))
+    ]
+    while stack:
+        directory, relative_dir, rule_sets = stack.pop()
+        own_rules = _read_ignore_files(directory)
+        if own_rules:
+            rule_sets = rule_sets + ((relative_dir, own_rules),)
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    relative = (
+                        f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                    )
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        if not is_dir and not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    if _ignored(rule_sets, relative, is_dir):
+                        continue
+                    if is_dir:
+                        stack.append((entry.path, relative, rule_sets))
+                    else:
+                        yield Path(entry.path)
+        except OSError as exc:
+            logging.debug("Skipping unreadable directory %s: %s", directory, exc)
+
+
+class IgnoreFilter:
+    """Check individual workspace paths against excludes and ignore files.
+
+    Applies the same rules as ``walk_files`` without walking the tree. Ignore
+    files are read once per directory for the lifetime of the filter, so a
+    new filter should be created when they may have changed.
+    """
+
+    def __init__(self, root: Path, excludes: Iterable[str] = DEFAULT_EXCLUDES):
+        self._root = root
+        root_rules: Tuple[_RuleSet, ...] = (("", parse_ignore_patterns(excludes)),)
+        own_rules = _read_ignore_files(str(root))
+        if own_rules:
+            root_rules += (("", own_rules),)
+        # Directory -> (ignored, rule sets applying to its entries)
+        self._directories: Dict[str, Tuple[bool, Tuple[_RuleSet, ...]]] = {
+            "": (False, root_rules)
+        }
+
+    def ignored(self, path: Path, is_dir: bool = False) -> bool:
+        """Return whether a path is excluded, ignored or outside the root."""
+        try:
+            relative = path.relative_to(self._root).as_posix()
+        except ValueError:
+            return True
+        if relative == ".":
+            return False
+        parent, _slash, _name = relative.rpartition("/")
+        parent_ignored, rule_sets = self._directory(parent)
+        return parent_ignored or _ignored(rule_sets, relative, is_dir)
+
+    def _directory(self, relative_dir: str) -> Tuple[bool, Tuple[_RuleSet, ...]]:
+        cached = self._directories.get(relative_dir)
+        if cached is not None:
+            return cached
+        parent, _slash, _name = relative_dir.rpartition("/")
+        parent_ignored, rule_sets = self._directory(parent)
+        ignored = parent_ignored or _ignored(rule_sets, relative_dir, True)
+        if not ignored:
+            own_rules = _read_ignore_files(str(self._root / relative_dir))
+            if own_rules:
+                rule_sets = rule_sets + ((relative_dir, own_rules),)
+        self._directories[relative_dir] = (ignored, rule_sets)
+        return ignored, rule_sets
+
+
+def git_files(
+    root: Path, excludes: Iterable[str] = DEFAULT_EXCLUDES
+) -> Optional[List[Path]]:
+    """List the workspace's tracked and untracked, non-ignored files via git.
+
+    Returns None when ``root`` is not inside a git work tree or git fails, so
+    callers can fall back to ``walk_files``. Only git's own ignore rules apply
+    (``.ignore`` files are not read); ``excludes`` are applied on top.
+    """
+    tracked = _git_ls_files(root, "--stage")
+    untracked = _git_ls_files(root, "--others", "--exclude-standard")
+    deleted = _git_ls_files(root, "--deleted")
+    if tracked is None or untracked is None or deleted is None:
+        return None
+    relative_paths: Dict[str, None] = {}
+    for entry in tracked:
+        info, _tab, path = entry.partition("\t")
+        # Submodules are listed as gitlinks; their contents are not indexed
+        if not info.startswith(_GITLINK_MODE):
+            relative_paths[path] = None
+    relative_paths.update(dict.fromkeys(untracked))
+    for path in deleted:
+        relative_paths.pop(path, None)
+
+    rule_sets = (("", parse_ignore_patterns(excludes)),)
+    excluded_dirs: Dict[str, bool] = {}
+    files = []
+    for relative in relative_paths:
+        if _excluded_path(rule_sets, relative, excluded_dirs):
+            continue
+        files.append(root / relative)
+    return files
+
+
+def _git_ls_files(root: Path, *args: str) -> Optional[List[str]]:
+    try:
+        result = subprocess.run(
+            ["git", "ls-files", "-z", *args],
+            cwd=root,
+            capture_output=True,
+            timeout=_GIT_TIMEOUT,
+            check=True,
+        )
+    except (OSError, subprocess.SubprocessError) as exc:
+        logging.info("git ls-files unavailable for %s: %s", root, exc)
+        return None
+    output = result.stdout.decode("utf-8", errors="surrogateescape")
+    return [path for path in output.split("\0") if path]
+
+
+def _read_ignore_files(directory: str) -> Tuple[_IgnoreRule, ...]:
+    rules: Tuple[_IgnoreRule, ...] = ()
+    for name in IGNORE_FILES:
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as handle:
+                rules += parse_ignore_patterns(handle)
+        except (OSError, UnicodeDecodeError):
+            continue
+    return rules
+
+
+def _ignored(rule_sets: Iterable[_RuleSet], relative: str, is_dir: bool) -> bool:
+    """Return whether the last rule matching a path ignores it."""
+    ignored = False
+    for base, rules in rule_sets:
+        local = relative[len(base) + 1 :] if base else relative
+        for rule in rules:
+            if rule.matches(local, is_dir):
+                ignored = not rule.negated
+    return ignored
+
+
+def _excluded_path(
+    rule_sets: Tuple[_RuleSet, ...], relative: str, excluded_dirs: Dict[str, bool]
+) -> bool:
+    """Return whether a file or any of its parent directories is excluded."""
+    parts = relative.split("/")
+    for depth in range(1, len(parts)):
+        directory = "/".join(parts[:depth])
+        excluded = excluded_dirs.get(directory)
+        if excluded is None:
+            excluded = excluded_dirs[directory] = _ignored(rule_sets, directory, True)
+        if excluded:
+            return True
+    return _ignored(rule_sets, relative, False)
+
+
+def _translate(pattern: str) -> str:
+    """Translate a gitignore glob into a regular expression."""
+    parts = []
+    index = 0
+    length = len(pattern)
+    while index < length:
+        if pattern.startswith("**/", index) and index == 0:
+            parts.append("(?:.*/)?")
+            index += 3
+        elif pattern.startswith("/**/", index):
+            parts.append("(?:/.*)?/")
+            index += 4
+        elif pattern.startswith("/**", index) and index + 3 == length:
+            parts.append("/.*")
+            index += 3
+        elif pattern.startswith("**", index):
+            parts.append(".*")
+            index += 2
+        elif pattern[index] == "*":
+            parts.append("[^/]*")
+            index += 1
+        elif pattern[index] == "?":
+            parts.append("[^/]")
+            index += 1
+        elif pattern[index] == "[":
+            end = pattern.find("]", index + 2)
+            if end == -1:
+                parts.append(re.escape("["))
+                index += 1
+                continue
+            body = pattern[index + 1 : end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            parts.append("[" + body.replace("\\", "\\\\") + "]")
+            index = end + 1
+        elif pattern[index] == "\\" and index + 1 < length:
+            parts.append(re.escape(pattern[index + 1]))
+            index += 2
+        else:
+            parts.append(re.escape(pattern[index]))
+            index += 1
+    return "".join(parts)
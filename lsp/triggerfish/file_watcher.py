@@ -0,0 +1,70 @@
+"""Native file system watching for clients without watched-file support."""
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+try:
+    from watchdog.observers import Observer
+except ImportError:  # watchdog is only needed for the native watcher
+    Observer = None
+
+# Called with the changed path and whether it was created
+ChangeCallback = Callable[[Path, bool], None]
+
+
+class NativeFileWatcher:
+    """Watch a directory tree with watchdog (inotify on Linux).
+
+    Callbacks run on watchdog's observer thread; callers must hand them over
+    to their event loop themselves.
+    """
+
+    def __init__(self, root: Path, on_change: ChangeCallback) -> None:
+        self._root = root
+        self._on_change = on_change
+        self._observer: Optional[Any] = None
+
+    def start(self) -> bool:
+        """Start watching, returning False if that is not possible."""
+        if Observer is None:
+            return False
+        observer = Observer()
+        observer.daemon = True
+        try:
+            observer.schedule(
+                _EventHandler(self._on_change), str(self._root), recursive=True
+            )
+            observer.start()
+        except OSError as exc:  # e.g. the inotify watch limit was reached
+            logging.warning("Cannot watch %s: %s", self._root, exc)
+            return False
+        self._observer = observer
+        return True
+
+    def stop(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+
+class _EventHandler:
+    """Translate watchdog events into change callbacks."""
+
+    def __init__(self, on_change: ChangeCallback) -> None:
+        self._on_change = on_change
+
+    def dispatch(self, event: Any) -> None:
+        event_type = event.event_type
+        # Directory modifications only mean an entry changed, which has its own event
+        if event.is_directory and event_type == "modified":
+            return
+        if event_type == "moved":
+            self._on_change(Path(os.fsdecode(event.src_path)), False)
+            self._on_change(Path(os.fsdecode(event.dest_path)), True)
+        elif event_type in ("created", "modified", "deleted"):
+            created = event_type == "created"
+            self._on_change(Path(os.fsdecode(event.src_path)), created)
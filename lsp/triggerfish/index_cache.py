@@ -0,0 +1,372 @@
+"""Persistent on-disk cache of per-file symbols.
+
+The cache is a compact binary file that is memory-mapped rather than parsed.
+Layout (little-endian):
+
+- header: magic, version, string/file/symbol counts, root string id and the
+  offsets of the sections below
+- string table: ``string_count + 1`` u32 offsets into a UTF-8 blob; names,
+  scopes, languages and paths are interned here once
+- file records: fixed-width, sorted by path bytes so a file is found with a
+  binary search
+- symbol records: fixed-width, contiguous per file
+
+Opening the cache costs one ``mmap`` call regardless of its size, only the
+records of files that are looked up are decoded, and editor instances on the
+same workspace share the mapped pages.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from .symbol_index import SymbolKind, SymbolRecord
+
+_MAGIC = b"TFIX"
+_CACHE_VERSION = 2
+_NO_STRING = 0xFFFFFFFF
+_NO_HASH = bytes(16)
+_KINDS = list(SymbolKind)
+_KIND_CODES = {kind: code for code, kind in enumerate(_KINDS)}
+
+# magic, version, string count, file count, symbol count, root string id,
+# string offsets, string data, file records, symbol records
+_HEADER = struct.Struct("<4sHxxIIIIQQQQ")
+# path id, first symbol, symbol count, mtime_ns, size, content hash
+_FILE = struct.Struct("<IIIxxxxqq16s")
+# name id, scope id, language id, line, kind
+_SYMBOL = struct.Struct("<IIIIB3x")
+_OFFSET = struct.Struct("<I")
+
+
+@dataclass(frozen=True)
+class FileStamp:
+    """Identity of a file's contents at the time it was parsed."""
+
+    mtime_ns: int
+    size: int
+    content_hash: Optional[str] = None
+
+
+class IndexCache:
+    """Symbol cache for one workspace, stored under the triggerfish cache dir.
+
+    Entries are keyed by file path and validated against the file's mtime and
+    size. When content hashing is enabled, a file whose mtime changed but whose
+    bytes did not (e.g. after a branch switch) is still served from the cache.
+    """
+
+    def __init__(
+        self, cache_dir: Path, workspace_root: Path, use_content_hash: bool = False
+    ) -> None:
+        """Initialize a cache for the given workspace.
+
+        Args:
+            cache_dir: Directory holding cache files.
+            workspace_root: Workspace whose symbols are cached.
+            use_content_hash: Record and compare content hashes.
+        """
+        self.workspace_root = workspace_root
+        self.use_content_hash = use_content_hash
+        key = hashlib.sha1(str(workspace_root).encode("utf-8")).hexdigest()[:16]
+        self.path = cache_dir / f"{key}.tfidx"
+        self._mapped: Optional[_MappedIndex] = None
+        # Files parsed in this session
+        self._entries: Dict[Path, Tuple[FileStamp, List[SymbolRecord]]] = {}
+        # Files served from the mapped cache, with their current stamp
+        self._reused: Dict[Path, Tuple[FileStamp, int]] = {}
+
+    def load(self) -> None:
+        """Map the cache file. A missing or invalid file is ignored."""
+        self.close()
+        try:
+            mapped = _MappedIndex.open(self.path)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, struct.error) as exc:
+            logging.warning("Ignoring unreadable index cache %s: %s", self.path, exc)
+            return
+        if mapped.root != str(self.workspace_root):
+            mapped.close()
+            return
+        self._mapped = mapped
+
+    def close(self) -> None:
+        """Unmap the cache file."""
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+
+    def stamp(self, file_path: Path) -> Optional[FileStamp]:
+        """Return the current stamp of a file, or None if it cannot be read."""
+        try:
+            stat = file_path.stat()
+        except OSError:
+            return None
+        return FileStamp(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+
+    def lookup_records(
+        self, file_path: Path, stamp: FileStamp
+    ) -> Optional[List[SymbolRecord]]:
+        """Return cached code symbols if the file is unchanged since it was parsed.
+
+        The records are ready for ``SymbolIndex.add_records``.
+        """
+        entry = self._entries.get(file_path)
+        if entry is not None:
+            cached_stamp, records = entry
+            if not self._matches(file_path, cached_stamp, stamp):
+                return None
+            return records
+
+        if self._mapped is None:
+            return None
+        position = self._mapped.find(str(file_path))
+        if position is None:
+            return None
+        cached_stamp = self._mapped.file_stamp(position)
+        if not self._matches(file_path, cached_stamp, stamp):
+            return None
+        if cached_stamp.mtime_ns != stamp.mtime_ns:
+            cached_stamp = FileStamp(
+                stamp.mtime_ns, stamp.size, cached_stamp.content_hash
+            )
+        self._reused[file_path] = (cached_stamp, position)
+        return list(self._mapped.file_records(position))
+
+    def store_records(
+        self, file_path: Path, stamp: FileStamp, records: List[SymbolRecord]
+    ) -> None:
+        """Record the code symbols parsed from a file."""
+        self._reused.pop(file_path, None)
+        self._entries[file_path] = (stamp, records)
+
+    def save(self) -> None:
+        """Write entries for files seen in this session back to disk.
+
+        The file is replaced atomically, so other processes keep reading their
+        existing mapping until they reload.
+        """
+        if self.use_content_hash:
+            self._fill_content_hashes()
+
+        files: List[Tuple[str, FileStamp, List[SymbolRecord]]] = []
+        for file_path, (stamp, records) in self._entries.items():
+            files.append((str(file_path), stamp, records))
+        if self._mapped is not None:
+            for file_path, (stamp, position) in self._reused.items():
+                records = list(self._mapped.file_records(position))
+                files.append((str(file_path), stamp, records))
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with tmp_path.open("wb") as handle:
+                _write_index(handle, str(self.workspace_root), files)
+            self.close()
+            os.replace(tmp_path, self.path)
+        except OSError as exc:
+            logging.warning("Failed to write index cache %s: %s", self.path, exc)
+            tmp_path.unlink(missing_ok=True)
+            return
+
+        self._entries.clear()
+        self._reused.clear()
+        self.load()
+        if self._mapped is not None:
+            for position in range(self._mapped.file_count):
+                file_path = Path(self._mapped.file_path(position))
+                stamp = self._mapped.file_stamp(position)
+                self._reused[file_path] = (stamp, position)
+
+    def _matches(self, file_path: Path, cached: FileStamp, current: FileStamp) -> bool:
+        if cached.size != current.size:
+            return False
+        if cached.mtime_ns == current.mtime_ns:
+            return True
+        if not (self.use_content_hash and cached.content_hash):
+            return False
+        return _hash_file(file_path) == cached.content_hash
+
+    def _fill_content_hashes(self) -> None:
+        for file_path, (stamp, records) in list(self._entries.items()):
+            if stamp.content_hash:
+                continue
+            # Only hash files that still match what was parsed
+            if self.stamp(file_path) != stamp:
+                continue
+            content_hash = _hash_file(file_path)
+            stamp = FileStamp(stamp.mtime_ns, stamp.size, content_hash)
+            self._entries[file_path] = (stamp, records)
+
+
+class _MappedIndex:
+    """Read-only view over a memory-mapped cache file."""
+
+    def __init__(self, buffer: mmap.mmap) -> None:
+        self._buffer = buffer
+        (
+            magic,
+            version,
+            self.string_count,
+            self.file_count,
+            self.symbol_count,
+            root_id,
+            self._string_offsets,
+            self._string_data,
+            self._files,
+            self._symbols,
+        ) = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC or version != _CACHE_VERSION:
+            raise ValueError("not a triggerfish index cache")
+        end = self._symbols + self.symbol_count * _SYMBOL.size
+        if end > len(buffer) or self._files + self.file_count * _FILE.size > end:
+            raise ValueError("truncated index cache")
+        self._strings: Dict[int, str] = {}
+        self.root = self.string(root_id)
+
+    @classmethod
+    def open(cls, path: Path) -> _MappedIndex:
+        with path.open("rb") as handle:
+            buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(buffer)
+        except (ValueError, struct.error):
+            buffer.close()
+            raise
+
+    def close(self) -> None:
+        self._buffer.close()
+
+    def string(self, string_id: int) -> Optional[str]:
+        if string_id == _NO_STRING:
+            return None
+        cached = self._strings.get(string_id)
+        if cached is None:
+            cached = self._string_bytes(string_id).decode("utf-8")
+            self._strings[string_id] = cached
+        return cached
+
+    def find(self, path: str) -> Optional[int]:
+        """Binary search the sorted file records for a path."""
+        target = path.encode("utf-8")
+        low, high = 0, self.file_count
+        while low < high:
+            middle = (low + high) // 2
+            current = self._string_bytes(self._file(middle)[0])
+            if current < target:
+                low = middle + 1
+            elif current > target:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def file_path(self, position: int) -> str:
+        return self._string_bytes(self._file(position)[0]).decode("utf-8")
+
+    def file_stamp(self, position: int) -> FileStamp:
+        _path_id, _start, _count, mtime_ns, size, digest = self._file(position)
+        content_hash = None if digest == _NO_HASH else digest.hex()
+        return FileStamp(mtime_ns=mtime_ns, size=size, content_hash=content_hash)
+
+    def file_records(self, position: int) -> Iterator[SymbolRecord]:
+        _path_id, start, count, _mtime, _size, _digest = self._file(position)
+        for offset in range(
+            self._symbols + start * _SYMBOL.size,
+            self._symbols + (start + count) * _SYMBOL.size,
+            _SYMBOL.size,
+        ):
+            name_id, scope_id, language_id, line, kind = _SYMBOL.unpack_from(
+                self._buffer, offset
+            )
+            yield (
+                self.string(name_id) or "",
+                _KINDS[kind],
+                line,
+                self.string(scope_id),
+                self.string(language_id),
+            )
+
+    def _file(self, position: int) -> Tuple[int, int, int, int, int, bytes]:
+        return _FILE.unpack_from(self._buffer, self._files + position * _FILE.size)
+
+    def _string_bytes(self, string_id: int) -> bytes:
+        offset = self._string_offsets + string_id * _OFFSET.size
+        start = _OFFSET.unpack_from(self._buffer, offset)[0]
+        end = _OFFSET.unpack_from(self._buffer, offset + _OFFSET.size)[0]
+        return self._buffer[self._string_data + start : self._string_data + end]
+
+
+def _write_index(
+    handle: BinaryIO, root: str, files: List[Tuple[str, FileStamp, List[SymbolRecord]]]
+) -> None:
+    strings: Dict[str, int] = {}
+
+    def intern(value: Optional[str]) -> int:
+        if value is None:
+            return _NO_STRING
+        string_id = strings.get(value)
+        if string_id is None:
+            string_id = strings[value] = len(strings)
+        return string_id
+
+    root_id = intern(root)
+    file_records = bytearray()
+    symbol_records = bytearray()
+    symbol_count = 0
+    files.sort(key=lambda item: item[0].encode("utf-8"))
+    for path, stamp, records in files:
+        digest = bytes.fromhex(stamp.content_hash) if stamp.content_hash else _NO_HASH
+        file_records += _FILE.pack(
+            intern(path), symbol_count, len(records), stamp.mtime_ns, stamp.size, digest
+        )
+        for name, kind, line, scope, language in records:
+            symbol_records += _SYMBOL.pack(
+                intern(name), intern(scope), intern(language), line, _KIND_CODES[kind]
+            )
+        symbol_count += len(records)
+
+    string_offsets = bytearray()
+    string_data = bytearray()
+    for value in strings:
+        string_offsets += _OFFSET.pack(len(string_data))
+        string_data += value.encode("utf-8")
+    string_offsets += _OFFSET.pack(len(string_data))
+
+    offsets_at = _HEADER.size
+    data_at = offsets_at + len(string_offsets)
+    files_at = data_at + len(string_data)
+    symbols_at = files_at + len(file_records)
+    header = _HEADER.pack(
+        _MAGIC,
+        _CACHE_VERSION,
+        len(strings),
+        len(files),
+        symbol_count,
+        root_id,
+        offsets_at,
+        data_at,
+        files_at,
+        symbols_at,
+    )
+    for chunk in (header, string_offsets, string_data, file_records, symbol_records):
+        handle.write(chunk)
+
+
+def _hash_file(file_path: Path) -> Optional[str]:
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with file_path.open("rb") as handle:
+            for chunk in iter(lambda: handle.read(1 << 20), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
@@ -0,0 +1,225 @@
+"""Fuzzy scoring off the LSP event loop.
+
+Completion searches hand their chunks to a ``SearchPool`` as ``ScoreJob``
+objects. By default a job runs on a worker thread. rapidfuzz's cdist releases
+the GIL while it scores, so the event loop keeps serving didChange and other
+messages meanwhile.
+
+Prefix indexes for first-page completions are sorted on the worker threads
+as well, and installed in the index once built.
+
+With worker processes enabled, each process scores against a read-only
+snapshot of a kind's corpus. The snapshot is written to a temporary file and
+loaded by a worker the first time that worker needs it. A job only goes to
+the processes when the published snapshot has the same kind version the
+job's scan started from. Its slots then mean the same thing in the snapshot
+and in the index, so results never mix index generations. Until a snapshot
+of the current version is published, jobs run on the thread pool.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Coroutine, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .symbol_index import PrefixIndex, ScoreJob, SymbolIndex, SymbolKind, score_choices
+
+# Corpus entries pickled per write, so publishing never holds the GIL for long
+_SNAPSHOT_CHUNK = 20000
+
+# Snapshot loaded in a worker process, per kind: (path, corpus)
+_loaded: Dict[str, Tuple[str, List[Optional[str]]]] = {}
+
+
+class SearchPool:
+    """Runs score jobs on worker threads or snapshot-holding processes."""
+
+    def __init__(self, index: SymbolIndex, threads: int, processes: int = 0) -> None:
+        """Create the pool; executors start their workers on first use.
+
+        Args:
+            index: Index whose jobs are scored.
+            threads: Worker threads. ``0`` scores jobs on the calling thread.
+            processes: Worker processes scoring against corpus snapshots.
+                ``0`` disables them.
+        """
+        self._index = index
+        self._threads: Optional[ThreadPoolExecutor] = None
+        if threads > 0:
+            self._threads = ThreadPoolExecutor(
+                max_workers=threads, thread_name_prefix="triggerfish-search"
+            )
+        self._processes: Optional[ProcessPoolExecutor] = None
+        if processes > 0:
+            # Forking would copy the event loop and the index into each worker
+            context = multiprocessing.get_context("spawn")
+            self._processes = ProcessPoolExecutor(processes, mp_context=context)
+        self._snapshot_dir: Optional[Path] = None
+        # Published snapshot per kind: (kind version, path)
+        self._snapshots: Dict[SymbolKind, Tuple[int, str]] = {}
+        self._publishing: Dict[SymbolKind, asyncio.Task[None]] = {}
+        self._building: Dict[SymbolKind, asyncio.Task[None]] = {}
+
+    async def score(self, job: ScoreJob) -> List[Tuple[int, float]]:
+        """Return the job's (slot, score) pairs, best first."""
+        loop = asyncio.get_running_loop()
+        if self._processes is not None:
+            snapshot = self._snapshots.get(job.kind)
+            if snapshot is not None and snapshot[0] == job.version:
+                try:
+                    return await loop.run_in_executor(
+                        self._processes,
+                        _score_snapshot,
+                        job.kind.value,
+                        snapshot[1],
+                        job.processed_query,
+                        job.slots,
+                        job.limit,
+                        job.min_score,
+                        self._index.fuzzy_backend,
+                    )
+                except OSError:
+                    # Replaced by a newer snapshot before the worker loaded it
+                    pass
+            else:
+                self._publish(job.kind)
+        if self._threads is None:
+            # Let other messages, such as a newer completion, in between jobs
+            await asyncio.sleep(0)
+            return self._index.score_job(job)
+        return await loop.run_in_executor(
+            self._threads, partial(self._index.score_job, job, release_gil=True)
+        )
+
+    def prepare_prefix_search(self, kinds: Iterable[SymbolKind]) -> None:
+        """Start building the prefix indexes ``prefix_search`` is due for.
+
+        Until one is installed, ``prefix_search`` serves the previous index
+        and scans a bounded number of the slots it does not cover.
+        """
+        for kind in kinds:
+            if kind in self._building:
+                continue
+            index = self._index.prefix_index_due(kind)
+            if index is not None:
+                self._track(
+                    self._building,
+                    kind,
+                    self._build_prefix_index(index),
+                    "prefix index",
+                )
+
+    def close(self) -> None:
+        """Stop the workers and delete published snapshots."""
+        for task in [*self._publishing.values(), *self._building.values()]:
+            task.cancel()
+        executors: List[Optional[Executor]] = [self._threads, self._processes]
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        if self._snapshot_dir is not None:
+            shutil.rmtree(self._snapshot_dir, ignore_errors=True)
+            self._snapshot_dir = None
+        self._snapshots.clear()
+
+    def _publish(self, kind: SymbolKind) -> None:
+        """Start writing a snapshot of the kind's current corpus."""
+        if kind in self._publishing:
+            return
+        version, choices = self._index.snapshot_choices(kind)
+        self._track(
+            self._publishing,
+            kind,
+            self._write_snapshot(kind, version, choices),
+            "snapshot",
+        )
+
+    def _track(
+        self,
+        tasks: Dict[SymbolKind, asyncio.Task[None]],
+        kind: SymbolKind,
+        work: Coroutine[None, None, None],
+        what: str,
+    ) -> None:
+        """Run ``work`` as the kind's task in ``tasks`` until it finishes."""
+        task = asyncio.ensure_future(work)
+        tasks[kind] = task
+
+        def forget(done: asyncio.Task[None]) -> None:
+            if tasks.get(kind) is done:
+                del tasks[kind]
+            if not done.cancelled() and done.exception() is not None:
+                logging.error(
+                    "Failed to build %s %s",
+                    kind.value,
+                    what,
+                    exc_info=done.exception(),
+                )
+
+        task.add_done_callback(forget)
+
+    async def _build_prefix_index(self, index: PrefixIndex) -> None:
+        await asyncio.get_running_loop().run_in_executor(self._threads, index.build)
+        self._index.install_prefix_index(index)
+
+    async def _write_snapshot(
+        self, kind: SymbolKind, version: int, choices: List[Optional[str]]
+    ) -> None:
+        if self._snapshot_dir is None:
+            self._snapshot_dir = Path(tempfile.mkdtemp(prefix="triggerfish-search-"))
+        path = self._snapshot_dir / f"{kind.value}-{version}.pickle"
+        await asyncio.get_running_loop().run_in_executor(
+            self._threads, _write_corpus, path, choices
+        )
+        previous = self._snapshots.get(kind)
+        self._snapshots[kind] = (version, str(path))
+        if previous is not None:
+            Path(previous[1]).unlink(missing_ok=True)
+
+
+def _write_corpus(path: Path, choices: List[Optional[str]]) -> None:
+    with path.open("wb") as stream:
+        for start in range(0, len(choices), _SNAPSHOT_CHUNK):
+            pickle.dump(choices[start : start + _SNAPSHOT_CHUNK], stream)
+
+
+def _read_corpus(path: str) -> List[Optional[str]]:
+    choices: List[Optional[str]] = []
+    with open(path, "rb") as stream:
+        while True:
+            try:
+                choices.extend(pickle.load(stream))
+            except EOFError:
+                return choices
+
+
+def _score_snapshot(
+    kind: str,
+    path: str,
+    processed_query: str,
+    slots: Sequence[int],
+    limit: Optional[int],
+    min_score: int,
+    backend: str,
+) -> List[Tuple[int, float]]:
+    """Score slots of a snapshot in a worker process, loading it if needed."""
+    loaded = _loaded.get(kind)
+    if loaded is None or loaded[0] != path:
+        loaded = _loaded[kind] = (path, _read_corpus(path))
+    choices = loaded[1]
+    subset = [choices[slot] for slot in slots]
+    # Parallelism comes from the pool; one cdist thread per process
+    return [
+        (slots[index], score)
+        for index, score in score_choices(
+            processed_query, subset, limit, min_score, backend, workers=1
+        )
+    ]
@@ -2,51 +2,86 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
+import math
+import textwrap
+import uuid
+from itertools import islice
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from lsprotocol.types import (
+    CompletionItem,
     CompletionItemKind,
     CompletionList,
     CompletionOptions,
     CompletionParams,
     DidChangeTextDocumentParams,
+    DidChangeWatchedFilesParams,
+    DidChangeWatchedFilesRegistrationOptions,
     DidOpenTextDocumentParams,
+    FileChangeType,
+    FileSystemWatcher,
     InitializeParams,
     InitializeResult,
+    MarkupContent,
+    MarkupKind,
+    ProgressParams,
+    ProgressToken,
+    Registration,
+    RegistrationParams,
     ServerCapabilities,
     TextDocumentSyncKind,
+    WorkDoneProgressBegin,
+    WorkDoneProgressEnd,
+    WorkDoneProgressReport,
 )
 from pygls.lsp.server import LanguageServer
-from pygls.uris import to_fs_path
-
-from .completion_handler import CompletionHandler
+from pygls.uris import from_fs_path, to_fs_path
+
+from .completion_handler import (
+    STREAM_CHUNK_SIZE,
+    CompletionHandler,
+    SearchSteps,
+    decode_item_data,
+    item_detail,
+)
 from .config import TriggerfishConfig
 from .core_client import CoreClient, CoreConfig
-from .ctags_manager import CTagsManager, CTagsError
-from .symbol_index import Symbol, SymbolIndex, SymbolKind
-
-
-_IGNORED_DIRS = frozenset(
-    {
-        ".git",
-        ".hg",
-        ".svn",
-        "__pycache__",
-        ".mypy_cache",
-        ".pytest_cache",
-        ".ruff_cache",
-        ".tox",
-        ".nox",
-        ".venv",
-        "venv",
-        "env",
-        "node_modules",
-        "dist",
-        "build",
-    }
-)
+from .ctags_manager import CTagsManager, CTagsError, TagRecord
+from .file_walker import DEFAULT_EXCLUDES, IgnoreFilter, git_files, walk_files
+from .file_watcher import NativeFileWatcher
+from .index_cache import FileStamp, IndexCache
+from .search_pool import SearchPool
+from .source_filter import SourceFilter
+from .symbol_index import Symbol, SymbolIndex, SymbolKind, SymbolRecord
+from .trigger_dispatch import TriggerDispatcher
+
+
+# Yield to the event loop every N walked files so requests are served while
+# the workspace is being indexed.
+_WALK_YIELD_INTERVAL = 500
+# Walked files checked against the index cache per worker thread call
+_CACHE_CHECK_CHUNK = 2000
+
+# Lines of source shown either side of a symbol in resolved documentation
+_SNIPPET_CONTEXT = 3
+# Snippet lines are cut to this many characters (minified sources)
+_SNIPPET_MAX_LINE = 200
+
+_T = TypeVar("_T")
 
 
 class TriggerfishLanguageServer(LanguageServer):
@@ -55,8 +90,16 @@ class TriggerfishLanguageServer(LanguageServer):
     def __init__(self, config: TriggerfishConfig) -> None:
         super().__init__("triggerfish", "0.1.0")
         self.config = config
-        self.index = SymbolIndex()
+        self.index = SymbolIndex(
+            fuzzy_backend=config.fuzzy_backend,
+            candidate_cap=(
+                config.fuzzy_candidate_cap if config.fuzzy_prefilter else None
+            ),
+        )
         self.ctags = CTagsManager(config)
+        self.search_pool = SearchPool(
+            self.index, config.completion_threads, config.completion_processes
+        )
 
         # Create completion handlers for different triggers
         self.file_completion = CompletionHandler(
@@ -72,6 +115,9 @@ class TriggerfishLanguageServer(LanguageServer):
             [SymbolKind.METHOD, SymbolKind.FUNCTION],
             CompletionItemKind.Method,
         )
+        self.completion_dispatcher = TriggerDispatcher(
+            [self.file_completion, self.class_completion, self.method_completion]
+        )
 
         core_config = CoreConfig(
             core_executable=config.core_executable,
@@ -81,6 +127,20 @@ class TriggerfishLanguageServer(LanguageServer):
         self.core_client = CoreClient(core_config)
 
         self._workspace_root: Optional[Path] = None
+        self._index_task: Optional[asyncio.Task[None]] = None
+        self._index_cache: Optional[IndexCache] = None
+        # Replaced by one using ctags' language maps once indexing starts
+        self._source_filter = SourceFilter(max_file_size=config.index_max_file_size)
+        self._reindex_tasks: Dict[str, asyncio.Task[None]] = {}
+        # Files the editor indexed during workspace indexing, which skips them
+        self._editor_indexed: Set[Path] = set()
+        # Latest completion request per document; older ones are dropped
+        self._completion_requests: Dict[str, int] = {}
+        self._completion_count = 0
+        # Paths changed on disk, mapped to whether any event created them
+        self._file_changes: Dict[Path, bool] = {}
+        self._file_changes_task: Optional[asyncio.Task[None]] = None
+        self._native_watcher: Optional[NativeFileWatcher] = None
         self._setup_logging()
         self._register_handlers()
 
@@ -95,12 +155,11 @@ class TriggerfishLanguageServer(LanguageServer):
         @self.feature("initialize")
         async def initialize(params: InitializeParams) -> InitializeResult:
             self._workspace_root = _get_workspace_root(params)
-            if self._workspace_root:
-                await self._index_workspace(self._workspace_root)
             capabilities = ServerCapabilities(
                 text_document_sync=TextDocumentSyncKind.Incremental,
                 completion_provider=CompletionOptions(
-                    trigger_characters=["@", ".", "#"]
+                    trigger_characters=self.completion_dispatcher.triggers,
+                    resolve_provider=True,
                 ),
             )
             return InitializeResult(capabilities=capabilities)
@@ -108,6 +167,10 @@ class TriggerfishLanguageServer(LanguageServer):
         @self.feature("initialized")
         async def initialized(_params) -> None:
             logging.info("Triggerfish LSP initialized")
+            if self._workspace_root:
+                self._start_workspace_indexing(self._workspace_root)
+                if self.config.watch_files:
+                    await self._watch_workspace(self._workspace_root)
 
         @self.feature("textDocument/didOpen")
         async def did_open(params: DidOpenTextDocumentParams) -> None:
@@ -116,118 +179,606 @@ class TriggerfishLanguageServer(LanguageServer):
 
         @self.feature("textDocument/didChange")
         async def did_change(params: DidChangeTextDocumentParams) -> None:
-            file_path = Path(to_fs_path(params.text_document.uri))
-            await self._index_file(file_path)
+            self._schedule_reindex(params.text_document.uri)
+
+        @self.feature("workspace/didChangeWatchedFiles")
+        async def did_change_watched_files(params: DidChangeWatchedFilesParams) -> None:
+            for change in params.changes:
+                created = change.type == FileChangeType.Created
+                self._queue_file_change(Path(to_fs_path(change.uri)), created)
 
         @self.feature("textDocument/completion")
-        async def completion(params: CompletionParams) -> CompletionList:
+        async def completion(
+            params: CompletionParams,
+        ) -> Union[CompletionList, List[CompletionItem]]:
             return await self._completion(params)
 
+        @self.feature("completionItem/resolve")
+        async def completion_item_resolve(item: CompletionItem) -> CompletionItem:
+            return await self._resolve_completion(item)
+
+        @self.feature("shutdown")
+        async def shutdown(_params) -> None:
+            if self.ctags.cache is not None:
+                logging.info("ctags result cache: %s", self.ctags.cache.stats())
+            await self.ctags.close()
+            self.search_pool.close()
+            if self._native_watcher is not None:
+                self._native_watcher.stop()
+                self._native_watcher = None
+
     async def _index_file(self, file_path: Path) -> None:
-        file_symbol_name = _relative_name(self._workspace_root, file_path)
-        symbols = [
-            Symbol(
-                name=file_symbol_name,
-                kind=SymbolKind.FILE,
-                file_path=file_path,
-                line=1,
-            )
-        ]
+        symbols = [self._file_symbol(file_path)]
 
         # Also parse code symbols if ctags is available
-        code_symbols = self._parse_code_symbols(file_path)
+        code_symbols = await self._parse_code_symbols(file_path)
         if code_symbols:
             symbols.extend(code_symbols)
 
+        self._update_from_editor(file_path, symbols)
+
+    def _schedule_reindex(self, uri: str) -> None:
+        """Re-parse a document once edits have been quiet for the debounce period.
+
+        A pending or in-flight reparse of the same document is cancelled, so
+        only the latest buffer contents are parsed.
+        """
+        pending = self._reindex_tasks.get(uri)
+        if pending is not None:
+            pending.cancel()
+        task = asyncio.ensure_future(self._reindex_document(uri))
+        self._reindex_tasks[uri] = task
+
+        def forget(done: asyncio.Task[None]) -> None:
+            if self._reindex_tasks.get(uri) is done:
+                del self._reindex_tasks[uri]
+
+        task.add_done_callback(forget)
+
+    async def _reindex_document(self, uri: str) -> None:
+        await asyncio.sleep(self.config.reindex_debounce_ms / 1000)
+        file_path = Path(to_fs_path(uri))
+        text = self.workspace.get_text_document(uri).source
+        code_symbols = await self._parse_buffer_symbols(file_path, text)
+        symbols = [self._file_symbol(file_path), *code_symbols]
+        self._update_from_editor(file_path, symbols)
+
+    def _update_from_editor(self, file_path: Path, symbols: List[Symbol]) -> None:
+        """Replace a file's symbols with ones parsed for the editor.
+
+        Workspace indexing only ever adds symbols, so while it runs the file
+        is marked for it to skip rather than add them a second time.
+        """
+        if self.indexing:
+            self._editor_indexed.add(file_path)
         self.index.update_file(file_path, symbols)
 
+    async def _watch_workspace(self, workspace_path: Path) -> None:
+        """Watch for files changed outside the editor.
+
+        Prefers the client's watcher via dynamic registration and falls back
+        to a native watcher when watchdog is installed.
+        """
+        capabilities = getattr(self.protocol, "client_capabilities", None)
+        workspace = capabilities.workspace if capabilities else None
+        watched = workspace.did_change_watched_files if workspace else None
+        if watched and watched.dynamic_registration:
+            registration = Registration(
+                id=f"triggerfish/{uuid.uuid4()}",
+                method="workspace/didChangeWatchedFiles",
+                register_options=DidChangeWatchedFilesRegistrationOptions(
+                    watchers=[FileSystemWatcher(glob_pattern="**/*")]
+                ),
+            )
+            try:
+                await self.client_register_capability_async(
+                    RegistrationParams(registrations=[registration])
+                )
+                return
+            except Exception as exc:  # client refused the registration
+                logging.debug("Client file watching unavailable: %s", exc)
+
+        loop = asyncio.get_running_loop()
+        watcher = NativeFileWatcher(
+            workspace_path,
+            lambda path, created: loop.call_soon_threadsafe(
+                self._queue_file_change, path, created
+            ),
+        )
+        if watcher.start():
+            self._native_watcher = watcher
+        else:
+            logging.info("File watching unavailable, disk changes need a restart")
+
+    def _queue_file_change(self, file_path: Path, created: bool) -> None:
+        """Record a file changed on disk; changes are applied in batches."""
+        self._file_changes[file_path] = self._file_changes.get(file_path) or created
+        if self._file_changes_task is None or self._file_changes_task.done():
+            self._file_changes_task = asyncio.ensure_future(self._apply_file_changes())
+            self._file_changes_task.add_done_callback(_log_file_changes_failure)
+
+    async def _apply_file_changes(self) -> None:
+        """Apply queued disk changes in batches, a debounce period after the first.
+
+        Bursts such as a branch switch are coalesced into one batch, and only
+        the files that changed are reparsed. The delay is not restarted by
+        later changes, so a file that is written continuously cannot hold
+        back the batch. Changes that arrive during
+        workspace indexing are applied after it finishes.
+        """
+        while self._file_changes:
+            await asyncio.sleep(self.config.reindex_debounce_ms / 1000)
+            if self._index_task is not None:
+                await asyncio.wait([self._index_task])
+            changes, self._file_changes = self._file_changes, {}
+            changed, removed = await asyncio.to_thread(
+                self._classify_file_changes, changes
+            )
+            self._clear_paths(removed)
+            # Open documents are kept in sync with their buffers by didChange
+            open_paths = {
+                Path(to_fs_path(uri)) for uri in self.workspace.text_documents
+            }
+            changed = [path for path in changed if path not in open_paths]
+            if not changed:
+                continue
+            records_by_file = await self._parse_code_records_batch(changed)
+            for file_path in changed:
+                self.index.update_file(file_path, [self._file_symbol(file_path)])
+                self.index.add_records(file_path, records_by_file.get(file_path, []))
+            logging.info(
+                "Applied disk changes: %d updated, %d removed",
+                len(changed),
+                len(removed),
+            )
+
+    def _classify_file_changes(
+        self, changes: Dict[Path, bool]
+    ) -> Tuple[List[Path], List[Path]]:
+        """Split changed paths into files to reparse and paths that are gone."""
+        excludes = [*DEFAULT_EXCLUDES, *self.config.index_exclude]
+        ignore = IgnoreFilter(self._workspace_root or Path.cwd(), excludes)
+        changed: List[Path] = []
+        removed: List[Path] = []
+        for path, created in changes.items():
+            if path.is_file():
+                if not ignore.ignored(path):
+                    changed.append(path)
+            elif path.is_dir():
+                # A new directory (e.g. from a checkout) may not report its files
+                if created and not ignore.ignored(path, is_dir=True):
+                    changed.extend(
+                        file_path
+                        for file_path in walk_files(path, excludes)
+                        if not ignore.ignored(file_path)
+                    )
+            elif not ignore.ignored(path, is_dir=True):
+                # Gone, so it may have been a file or a directory
+                removed.append(path)
+        return changed, removed
+
+    def _clear_paths(self, paths: List[Path]) -> None:
+        """Remove deleted files, and every indexed file under deleted directories."""
+        for path in paths:
+            self.index.clear_file(path)
+            for file_path in self.index.files_under(path):
+                self.index.clear_file(file_path)
+
+    @property
+    def indexing(self) -> bool:
+        """Return True while background workspace indexing is running."""
+        return self._index_task is not None and not self._index_task.done()
+
+    def _start_workspace_indexing(self, workspace_path: Path) -> None:
+        """Index the workspace in the background, serving partial results."""
+        if self.indexing:
+            return
+        self._index_task = asyncio.ensure_future(self._index_workspace(workspace_path))
+        self._index_task.add_done_callback(_log_index_task_failure)
+
     async def _index_workspace(self, workspace_path: Path) -> None:
         if self.core_client.start():
             logging.info("Core subprocess available")
         else:
             logging.info("Running without core subprocess")
 
-        for file_path in self._walk_project_files(workspace_path):
-            self._add_file_symbol(file_path)
-            # Also parse code symbols from each file
-            code_symbols = self._parse_code_symbols(file_path)
-            if code_symbols:
-                self.index.add_symbols(code_symbols)
+        token = await self._begin_progress("Indexing workspace")
+        try:
+            self._source_filter = await self._load_source_filter()
+            cache = await self._load_index_cache(workspace_path)
+            stamps: Dict[Path, FileStamp] = {}
+
+            # FILE symbols are available as soon as the walk reaches them
+            files: List[Path] = []
+            for count, file_path in enumerate(
+                await self._workspace_files(workspace_path), start=1
+            ):
+                if count % _WALK_YIELD_INTERVAL == 0:
+                    await asyncio.sleep(0)
+                if file_path in self._editor_indexed:
+                    continue
+                self._add_file_symbol(file_path)
+                files.append(file_path)
+            if cache is not None:
+                files = await self._add_cached_symbols(cache, files, stamps)
+
+            await self._index_files(files, token, stamps)
+            if cache is not None:
+                await asyncio.to_thread(cache.save)
+        finally:
+            self._editor_indexed.clear()
+            self._end_progress(token)
         logging.info("Indexed workspace: %s", self.index.stats())
 
-    async def _completion(self, params: CompletionParams) -> CompletionList:
-        if not params.text_document.uri.endswith(".txt"):
+    async def _add_cached_symbols(
+        self, cache: IndexCache, files: List[Path], stamps: Dict[Path, FileStamp]
+    ) -> List[Path]:
+        """Index unchanged files from the cache and return the files to parse.
+
+        Stamping stats every file and may hash its contents, so the cache is
+        checked on a worker thread, a chunk of files at a time. The stamps of
+        the files to parse are added to ``stamps``.
+        """
+        changed: List[Path] = []
+        for start in range(0, len(files), _CACHE_CHECK_CHUNK):
+            chunk = files[start : start + _CACHE_CHECK_CHUNK]
+            hits, misses = await asyncio.to_thread(_check_index_cache, cache, chunk)
+            for file_path, records in hits:
+                if records and file_path not in self._editor_indexed:
+                    self.index.add_records(file_path, records)
+            for file_path, stamp in misses:
+                if file_path in self._editor_indexed:
+                    continue
+                if stamp is not None:
+                    stamps[file_path] = stamp
+                changed.append(file_path)
+        return changed
+
+    async def _load_index_cache(self, workspace_path: Path) -> Optional[IndexCache]:
+        if self.config.cache_dir is None:
+            return None
+        cache = IndexCache(
+            self.config.cache_dir,
+            workspace_path,
+            use_content_hash=self.config.cache_content_hash,
+        )
+        await asyncio.to_thread(cache.load)
+        self._index_cache = cache
+        return cache
+
+    async def _index_files(
+        self,
+        files: List[Path],
+        token: Optional[str],
+        stamps: Optional[Dict[Path, FileStamp]] = None,
+    ) -> None:
+        """Parse files with concurrent ctags runs, merging results as they stream in.
+
+        At most ``index_workers`` ctags processes run at once. Each streams
+        its shard's symbols file by file, so the index fills up while ctags
+        is still running. Results for files with a stamp are also recorded in
+        the index cache.
+        """
+        if not files:
+            return
+        workers = max(1, self.config.index_workers)
+        shards = _shard_files(files, self.config.ctags_batch_size, workers)
+        slots = asyncio.Semaphore(workers)
+
+        def merge(file_path: Path, records: List[SymbolRecord]) -> None:
+            if file_path in self._editor_indexed:
+                return
+            if records:
+                self.index.add_records(file_path, records)
+            stamp = stamps.get(file_path) if stamps else None
+            if self._index_cache is not None and stamp is not None:
+                self._index_cache.store_records(file_path, stamp, records)
+
+        async def parse_shard(shard: List[Path]) -> List[Path]:
+            async with slots:
+                async for file_path, records in self._stream_code_records(shard):
+                    merge(file_path, records)
+            return shard
+
+        pending = [asyncio.ensure_future(parse_shard(shard)) for shard in shards]
+        try:
+            done = 0
+            for finished in asyncio.as_completed(pending):
+                shard = await finished
+                done += len(shard)
+                self._report_progress(token, done, len(files))
+        finally:
+            # Cancelling a shard kills its ctags process
+            for task in pending:
+                task.cancel()
+
+    async def _begin_progress(self, title: str) -> Optional[str]:
+        """Create a work done progress if the client supports it."""
+        capabilities = getattr(self.protocol, "client_capabilities", None)
+        window = capabilities.window if capabilities else None
+        if not (window and window.work_done_progress):
+            return None
+
+        token = f"triggerfish/{uuid.uuid4()}"
+        try:
+            await self.work_done_progress.create_async(token)
+        except Exception as exc:  # client refused the progress token
+            logging.debug("Work done progress unavailable: %s", exc)
+            return None
+        self.work_done_progress.begin(
+            token, WorkDoneProgressBegin(title=title, percentage=0)
+        )
+        return token
+
+    def _report_progress(self, token: Optional[str], done: int, total: int) -> None:
+        if token is None:
+            return
+        percentage = int(done * 100 / total) if total else 100
+        self.work_done_progress.report(
+            token,
+            WorkDoneProgressReport(
+                message=f"{done}/{total} files", percentage=percentage
+            ),
+        )
+
+    def _end_progress(self, token: Optional[str]) -> None:
+        if token is None:
+            return
+        self.work_done_progress.end(token, WorkDoneProgressEnd())
+
+    async def _completion(
+        self, params: CompletionParams
+    ) -> Union[CompletionList, List[CompletionItem]]:
+        """Answer a completion request unless a newer one supersedes it.
+
+        Each request claims its document. The search yields to the event loop
+        between scored chunks and is abandoned as soon as a later request for
+        the same document arrives or the client cancels this one, so typing
+        fast only pays for the completions that are shown. A superseded
+        request gets an empty incomplete list.
+        """
+        uri = params.text_document.uri
+        if not uri.endswith(".txt"):
             return CompletionList(is_incomplete=False, items=[])
 
-        document = self.workspace.get_text_document(params.text_document.uri)
+        self._completion_count += 1
+        request = self._completion_count
+        self._completion_requests[uri] = request
+        try:
+            # Let requests already queued behind this one claim the document
+            await asyncio.sleep(0)
+            result = await self._complete(params, request)
+        finally:
+            if self._completion_requests.get(uri) == request:
+                del self._completion_requests[uri]
+        if result is None:
+            return CompletionList(is_incomplete=True, items=[])
+        return result
+
+    async def _complete(
+        self, params: CompletionParams, request: int
+    ) -> Optional[Union[CompletionList, List[CompletionItem]]]:
+        uri = params.text_document.uri
+        if self._superseded(uri, request):
+            return None
+        document = self.workspace.get_text_document(uri)
         line_text = ""
         if params.position.line < len(document.lines):
             line_text = document.lines[params.position.line]
 
-        # Check which trigger was used and route to appropriate handler
-        handlers = [
-            self.file_completion,
-            self.class_completion,
-            self.method_completion,
-        ]
-
-        for handler in handlers:
-            if handler.should_trigger(line_text, params.position.character):
-                items = handler.get_completions(line_text, params.position.character)
-                return CompletionList(is_incomplete=False, items=items)
-
-        return CompletionList(is_incomplete=False, items=[])
+        # Results are partial until background indexing finishes
+        selected = self.completion_dispatcher.select(
+            line_text, params.position.character
+        )
+        if selected is None:
+            return CompletionList(is_incomplete=self.indexing, items=[])
+        handler, query = selected
+        token = params.partial_result_token
+        if self.config.completion_first_page or token is not None:
+            # First pages are looked up in prefix indexes built in the pool
+            self.search_pool.prepare_prefix_search(handler.symbol_kinds)
+        if token is not None and query and handler.corpus_size() > STREAM_CHUNK_SIZE:
+            await self._stream_completions(handler, query, token, uri, request)
+            return []
+        steps = handler.complete_paged_steps(query, uri)
+        paged = await self._run_search(steps, uri, request)
+        if paged is None:
+            return None
+        items, incomplete = paged
+        return CompletionList(is_incomplete=incomplete or self.indexing, items=items)
+
+    async def _run_search(
+        self, steps: SearchSteps[_T], uri: str, request: int
+    ) -> Optional[_T]:
+        """Run a search, scoring its jobs in the search pool.
+
+        Returns None once the request is superseded. The search is closed
+        however this returns, including when ``$/cancelRequest`` cancels the
+        request's task while a job is being scored.
+        """
+        try:
+            job = next(steps)
+            while True:
+                scores = await self.search_pool.score(job)
+                if self._superseded(uri, request):
+                    return None
+                job = steps.send(scores)
+        except StopIteration as done:
+            return done.value
+        finally:
+            steps.close()
+
+    def _superseded(self, uri: str, request: int) -> bool:
+        return self._completion_requests.get(uri) != request
+
+    async def _stream_completions(
+        self,
+        handler: CompletionHandler,
+        query: str,
+        token: ProgressToken,
+        uri: str,
+        request: int,
+    ) -> None:
+        """Report completions as partial results while the corpus is scored.
+
+        The first page goes out at once as a ``CompletionList``; fuzzy matches
+        follow as item batches, one per chunk scored in the search pool.
+        Streaming stops once the request is superseded.
+        """
+        reported = False
+
+        def report(items: List[CompletionItem]) -> None:
+            nonlocal reported
+            if not reported:
+                first = CompletionList(is_incomplete=self.indexing, items=items)
+                self.progress(ProgressParams(token=token, value=first))
+                reported = True
+            elif items:
+                self.progress(ProgressParams(token=token, value=items))
+
+        await self._run_search(handler.stream_steps(query, report), uri, request)
+
+    async def _resolve_completion(self, item: CompletionItem) -> CompletionItem:
+        """Fill in the detail and a source snippet of a completion item.
+
+        Completion responses only carry a ``data`` handle per item; the
+        client asks for the rest of the item it is showing.
+        """
+        target = decode_item_data(item.data, self.index)
+        if target is None:
+            return item
+        kind, file_path, line = target
+        item.detail = item_detail(kind, file_path, line)
+        snippet = await self._source_snippet(file_path, line)
+        if snippet:
+            item.documentation = MarkupContent(
+                kind=MarkupKind.Markdown, value=_fence(snippet, file_path)
+            )
+        return item
+
+    async def _source_snippet(self, file_path: Path, line: int) -> str:
+        """Return the lines around ``line``, from the open buffer if any."""
+        first = max(line - _SNIPPET_CONTEXT, 1)
+        last = line + _SNIPPET_CONTEXT
+        document = self.workspace.text_documents.get(from_fs_path(str(file_path)))
+        if document is not None:
+            return _snippet(document.lines[first - 1 : last])
+        return await asyncio.to_thread(_read_snippet, file_path, first, last)
+
+    async def _load_source_filter(self) -> SourceFilter:
+        language_maps: Optional[Dict[str, List[str]]] = None
+        try:
+            language_maps = await self.ctags.list_language_maps()
+        except CTagsError as exc:
+            logging.warning("ctags language maps unavailable: %s", exc)
+        return SourceFilter(language_maps, self.config.index_max_file_size)
 
-    def _parse_code_symbols(self, file_path: Path) -> List[Symbol]:
+    async def _parse_code_symbols(self, file_path: Path) -> List[Symbol]:
         """Parse code symbols (class, method, function) from a file using ctags."""
+        # The filter reads the head of the file, which is kept off the loop
+        if not await asyncio.to_thread(self._source_filter.should_parse, file_path):
+            return []
         try:
-            tags = self.ctags.generate_tags(file_path)
+            tags = await self.ctags.generate_tags(file_path)
         except CTagsError:
             # If ctags fails, just return empty list (file is still indexed)
             return []
+        return _tags_to_symbols(file_path, tags)
 
-        symbols: List[Symbol] = []
-        for tag in tags:
-            # Map ctags kind to our SymbolKind
-            kind = _map_ctags_kind(tag.get("kind"))
-            if kind is None:
-                continue
-
-            symbols.append(
-                Symbol(
-                    name=tag.get("name", ""),
-                    kind=kind,
-                    file_path=file_path,
-                    line=tag.get("line", 1),
-                    scope=tag.get("scope"),
-                    language=tag.get("language"),
-                )
+    async def _parse_buffer_symbols(self, file_path: Path, text: str) -> List[Symbol]:
+        """Parse code symbols from unsaved buffer contents."""
+        try:
+            tags = await self.ctags.generate_tags_for_text(file_path, text)
+        except CTagsError:
+            return []
+        return _tags_to_symbols(file_path, tags)
+
+    async def _parse_code_records_batch(
+        self, file_paths: List[Path]
+    ) -> Dict[Path, List[SymbolRecord]]:
+        """Parse code symbols for many files with one ctags invocation."""
+        return {
+            file_path: records
+            async for file_path, records in self._stream_code_records(file_paths)
+        }
+
+    async def _stream_code_records(
+        self, file_paths: List[Path]
+    ) -> AsyncIterator[Tuple[Path, List[SymbolRecord]]]:
+        """Yield ``(path, records)`` per file as one ctags run parses them.
+
+        Files that are not worth parsing (binary, oversized, minified or in no
+        language ctags knows) are yielded with no symbols without running
+        ctags.
+        """
+        # The filter reads the head of every file, which is kept off the loop
+        parseable = await asyncio.to_thread(
+            list, filter(self._source_filter.should_parse, file_paths)
+        )
+        if len(parseable) < len(file_paths):
+            wanted = set(parseable)
+            for file_path in file_paths:
+                if file_path not in wanted:
+                    yield file_path, []
+        if not parseable:
+            return
+        async for item in self._stream_ctags_records(parseable):
+            yield item
+
+    async def _stream_ctags_records(
+        self, file_paths: List[Path]
+    ) -> AsyncIterator[Tuple[Path, List[SymbolRecord]]]:
+        """Yield ``(path, records)`` per file from ctags, recovering from failures.
+
+        When a run fails, the files it did not finish are parsed again in two
+        halves, so one file that crashes or hangs ctags only costs the files
+        in its own half their symbols until it is isolated. A single file
+        that still fails keeps its FILE symbol only.
+        """
+        finished: Set[Path] = set()
+        try:
+            async for file_path, tags in self.ctags.stream_records_by_file(file_paths):
+                finished.add(file_path)
+                yield file_path, _to_symbol_records(tags)
+            return
+        except CTagsError as exc:
+            remaining = [path for path in file_paths if path not in finished]
+            if not remaining:
+                return
+            if len(remaining) == 1:
+                logging.warning("ctags failed on %s: %s", remaining[0], exc)
+                return
+            logging.info(
+                "ctags batch of %d files failed (%s), retrying %d of them",
+                len(file_paths),
+                exc,
+                len(remaining),
             )
-
-        return symbols
-
-    def _walk_project_files(self, workspace_path: Path) -> Iterable[Path]:
-        """Walk all files in workspace, skipping ignored directories."""
-        for item in workspace_path.iterdir():
-            if item.name.startswith(".") and item.is_dir():
-                continue
-            if item.name in _IGNORED_DIRS:
-                continue
-            if item.is_file():
+        middle = len(remaining) // 2
+        for half in (remaining[:middle], remaining[middle:]):
+            async for item in self._stream_ctags_records(half):
                 yield item
-            elif item.is_dir():
-                yield from self._walk_project_files(item)
+
+    async def _workspace_files(self, workspace_path: Path) -> Iterable[Path]:
+        """Return the workspace files to index, skipping excluded and ignored ones."""
+        excludes = [*DEFAULT_EXCLUDES, *self.config.index_exclude]
+        if self.config.index_use_git:
+            files = await asyncio.to_thread(git_files, workspace_path, excludes)
+            if files is not None:
+                return files
+        return walk_files(workspace_path, excludes)
 
     def _add_file_symbol(self, file_path: Path) -> None:
         """Add a FILE symbol for @ completion without running ctags."""
-        file_symbol_name = _relative_name(self._workspace_root, file_path)
-        symbol = Symbol(
-            name=file_symbol_name,
+        self.index.add_symbols([self._file_symbol(file_path)])
+
+    def _file_symbol(self, file_path: Path) -> Symbol:
+        return Symbol(
+            name=_relative_name(self._workspace_root, file_path),
             kind=SymbolKind.FILE,
             file_path=file_path,
             line=1,
         )
-        self.index.add_symbols([symbol])
 
 
 def create_server(config: Optional[TriggerfishConfig] = None) -> TriggerfishLanguageServer:
@@ -246,6 +797,66 @@ def _get_workspace_root(params: InitializeParams) -> Optional[Path]:
     return None
 
 
+def _check_index_cache(
+    cache: IndexCache, files: List[Path]
+) -> Tuple[
+    List[Tuple[Path, List[SymbolRecord]]], List[Tuple[Path, Optional[FileStamp]]]
+]:
+    """Split files into cache hits with their records and misses with their stamps."""
+    hits: List[Tuple[Path, List[SymbolRecord]]] = []
+    misses: List[Tuple[Path, Optional[FileStamp]]] = []
+    for file_path in files:
+        stamp = cache.stamp(file_path)
+        records = cache.lookup_records(file_path, stamp) if stamp else None
+        if records is None:
+            misses.append((file_path, stamp))
+        else:
+            hits.append((file_path, records))
+    return hits, misses
+
+
+def _shard_files(
+    files: List[Path], batch_size: int, workers: int
+) -> List[List[Path]]:
+    """Split files into shards no larger than batch_size, one per worker or more."""
+    shard_size = min(max(1, batch_size), math.ceil(len(files) / workers))
+    return [files[i : i + shard_size] for i in range(0, len(files), shard_size)]
+
+
+def _read_snippet(file_path: Path, first: int, last: int) -> str:
+    try:
+        with file_path.open(encoding="utf-8", errors="replace") as stream:
+            return _snippet(list(islice(stream, first - 1, last)))
+    except OSError:
+        return ""
+
+
+def _snippet(lines: List[str]) -> str:
+    """Join source lines for display, or return "" for binary content."""
+    text = "".join(line[:_SNIPPET_MAX_LINE].rstrip() + "\n" for line in lines)
+    if "\0" in text:
+        return ""
+    return textwrap.dedent(text).strip("\n")
+
+
+def _fence(snippet: str, file_path: Path) -> str:
+    """Wrap a snippet in a Markdown code block tagged with the file type."""
+    fence = "```"
+    while fence in snippet:
+        fence += "`"
+    return f"{fence}{file_path.suffix.lstrip('.')}\n{snippet}\n{fence}"
+
+
+def _log_index_task_failure(task: asyncio.Task[None]) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Workspace indexing failed", exc_info=task.exception())
+
+
+def _log_file_changes_failure(task: asyncio.Task[None]) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Applying disk changes failed", exc_info=task.exception())
+
+
 def _relative_name(workspace_root: Optional[Path], file_path: Path) -> str:
     if workspace_root:
         try:
@@ -255,32 +866,64 @@ def _relative_name(workspace_root: Optional[Path], file_path: Path) -> str:
     return file_path.name
 
 
+def _tags_to_symbols(file_path: Path, tags: List[Dict[str, Any]]) -> List[Symbol]:
+    symbols: List[Symbol] = []
+    for tag in tags:
+        # Map ctags kind to our SymbolKind
+        kind = _map_ctags_kind(tag.get("kind"))
+        if kind is None:
+            continue
+
+        symbols.append(
+            Symbol(
+                name=tag.get("name", ""),
+                kind=kind,
+                file_path=file_path,
+                line=tag.get("line", 1),
+                scope=tag.get("scope"),
+                language=tag.get("language"),
+            )
+        )
+
+    return symbols
+
+
+def _to_symbol_records(tags: Iterable[TagRecord]) -> List[SymbolRecord]:
+    """Keep the tags whose kind maps to a SymbolKind, as index records."""
+    records: List[SymbolRecord] = []
+    for name, ctags_kind, line, scope, language in tags:
+        kind = _map_ctags_kind(ctags_kind)
+        if kind is not None:
+            records.append((name or "", kind, line or 1, scope, language))
+    return records
+
+
+# Map common ctags kinds to our SymbolKind
+_CTAGS_KINDS = {
+    # Classes
+    "class": SymbolKind.CLASS,
+    "interface": SymbolKind.CLASS,
+    "struct": SymbolKind.CLASS,
+    "enum": SymbolKind.CLASS,
+    "type": SymbolKind.CLASS,
+    # Methods
+    "method": SymbolKind.METHOD,
+    "member": SymbolKind.METHOD,
+    # Functions
+    "function": SymbolKind.FUNCTION,
+    "func": SymbolKind.FUNCTION,
+    "procedure": SymbolKind.FUNCTION,
+    "subroutine": SymbolKind.FUNCTION,
+    # Variables
+    "variable": SymbolKind.VARIABLE,
+    "var": SymbolKind.VARIABLE,
+    "field": SymbolKind.VARIABLE,
+    "constant": SymbolKind.VARIABLE,
+}
+
+
 def _map_ctags_kind(ctags_kind: Optional[str]) -> Optional[SymbolKind]:
     """Map ctags kind string to SymbolKind."""
     if not ctags_kind:
         return None
-
-    # Map common ctags kinds to our SymbolKind
-    kind_mapping = {
-        # Classes
-        "class": SymbolKind.CLASS,
-        "interface": SymbolKind.CLASS,
-        "struct": SymbolKind.CLASS,
-        "enum": SymbolKind.CLASS,
-        "type": SymbolKind.CLASS,
-        # Methods
-        "method": SymbolKind.METHOD,
-        "member": SymbolKind.METHOD,
-        # Functions
-        "function": SymbolKind.FUNCTION,
-        "func": SymbolKind.FUNCTION,
-        "procedure": SymbolKind.FUNCTION,
-        "subroutine": SymbolKind.FUNCTION,
-        # Variables
-        "variable": SymbolKind.VARIABLE,
-        "var": SymbolKind.VARIABLE,
-        "field": SymbolKind.VARIABLE,
-        "constant": SymbolKind.VARIABLE,
-    }
-
-    return kind_mapping.get(ctags_kind.lower())
+    return _CTAGS_KINDS.get(ctags_kind.lower())
@@ -0,0 +1,82 @@
+"""Cheap checks deciding which files are worth running ctags on."""
+
+from __future__ import annotations
+
+import fnmatch
+import re
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, Optional, Pattern
+
+# Bytes read from the start of a file to detect binary or minified content
+_SNIFF_BYTES = 8192
+# A line this long in the sniffed head means generated/minified content
+_MAX_LINE_LENGTH = 2000
+
+
+class SourceFilter:
+    """Decide whether a file is source code ctags can extract symbols from.
+
+    A file is parsed only if its name matches a ctags language mapping (when
+    maps are known), it is no larger than ``max_file_size`` bytes (0 disables
+    the limit), and its first bytes are neither binary nor minified.
+    Extensionless files starting with a ``#!`` line are also parsed, since
+    ctags can pick their language from the interpreter.
+    """
+
+    def __init__(
+        self,
+        language_maps: Optional[Dict[str, Iterable[str]]] = None,
+        max_file_size: int = 0,
+    ) -> None:
+        self._max_file_size = max_file_size
+        self._extensions: Optional[FrozenSet[str]] = None
+        self._name_pattern: Optional[Pattern[str]] = None
+        if language_maps is not None:
+            extensions = set()
+            name_patterns = []
+            for patterns in language_maps.values():
+                for pattern in patterns:
+                    if pattern.startswith("."):  # exuberant ctags lists bare ".ext"
+                        pattern = "*" + pattern
+                    suffix = pattern[1:]
+                    if pattern.startswith("*.") and not _has_glob(suffix):
+                        extensions.add(suffix.lower())
+                    else:
+                        name_patterns.append(fnmatch.translate(pattern))
+            self._extensions = frozenset(extensions)
+            if name_patterns:
+                self._name_pattern = re.compile("|".join(name_patterns))
+
+    def should_parse(self, file_path: Path) -> bool:
+        """Return True if ctags should be run on a file."""
+        mapped = self._is_mapped(file_path.name)
+        if mapped is False and file_path.suffix:
+            return False
+        try:
+            if self._max_file_size and file_path.stat().st_size > self._max_file_size:
+                return False
+            with open(file_path, "rb") as handle:
+                head = handle.read(_SNIFF_BYTES)
+        except OSError:
+            return False
+        if not head or b"\0" in head:
+            return False
+        if mapped is False and not head.startswith(b"#!"):
+            return False
+        return max(len(line) for line in head.split(b"\n")) < _MAX_LINE_LENGTH
+
+    def _is_mapped(self, name: str) -> Optional[bool]:
+        """Return whether ctags maps a file name to a language (None if unknown)."""
+        if self._extensions is None:
+            return None
+        # Match multi-part extensions such as ".d.ts" as well as the last one
+        position = name.find(".", 1)
+        while position != -1:
+            if name[position:].lower() in self._extensions:
+                return True
+            position = name.find(".", position + 1)
+        return bool(self._name_pattern and self._name_pattern.match(name))
+
+
+def _has_glob(text: str) -> bool:
+    return any(char in text for char in "*?[")
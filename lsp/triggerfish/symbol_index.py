@@ -2,13 +2,43 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+import heapq
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from enum import Enum
+from itertools import takewhile
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Tuple
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
 from rapidfuzz import fuzz, process, utils
 
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the cdist backend
+    np = None
+
+FUZZY_BACKENDS = ("extract", "cdist")
+
+# Below this many choices, process.extract beats cdist's thread start-up cost
+_CDIST_MIN_CHOICES = 20000
+# Below this many choices, an exhaustive scan is cheap enough to skip prefiltering
+_PREFILTER_MIN_CHOICES = 20000
+
 
 class SymbolKind(Enum):
     """Supported symbol kinds."""
@@ -38,41 +68,482 @@ class Symbol:
         return self.name
 
 
-class SymbolIndex:
-    """In-memory symbol index with fuzzy search."""
+# A symbol of a known file: (name, kind, line, scope, language)
+SymbolRecord = Tuple[str, SymbolKind, int, Optional[str], Optional[str]]
+
+
+@dataclass(frozen=True)
+class ScoreJob:
+    """One chunk of a fuzzy scan, self-contained so it can be scored anywhere.
+
+    ``choices`` is the kind's corpus as it was when the scan started and
+    ``version`` the kind's version then; only ``slots`` of it are scored.
+    """
+
+    kind: SymbolKind
+    version: int
+    processed_query: str
+    slots: Sequence[int]
+    limit: Optional[int]
+    min_score: int
+    choices: Sequence[Optional[str]] = field(repr=False, compare=False)
+
+
+# Compact a kind's slots once tombstones outnumber live symbols (and this many)
+_COMPACT_MIN_TOMBSTONES = 1024
+# Slots not yet in a kind's prefix index that prefix_search scans directly
+_PREFIX_TAIL_SCAN = 20000
+
+
+class _KindColumns:
+    """Columnar storage for one kind's slots.
+
+    Names are packed UTF-8 in ``names``, slot ``i`` ending at
+    ``name_ends[i]``. ``files``, ``scopes`` and ``languages`` hold IDs into
+    the index's intern tables. A tombstoned slot has ``None`` as its choice.
+    """
+
+    __slots__ = (
+        "names",
+        "name_ends",
+        "choices",
+        "files",
+        "lines",
+        "scopes",
+        "languages",
+        "live",
+    )
 
     def __init__(self) -> None:
-        self._symbols: List[Symbol] = []
-        self._by_file: Dict[Path, List[Symbol]] = {}
-        self._by_kind: Dict[SymbolKind, List[Symbol]] = {}
+        self.names = bytearray()
+        self.name_ends = array("I")
+        self.choices: List[Optional[str]] = []
+        self.files = array("I")
+        self.lines = array("I")
+        self.scopes = array("I")
+        self.languages = array("I")
+        self.live = 0
+
+
+class PrefixIndex:
+    """A kind's corpus entries sorted for prefix lookups.
+
+    ``starts`` holds slots ordered by their choice. ``word_slots`` and
+    ``word_offsets`` locate every later word of the choices, ordered by the
+    text from that word on. ``choices`` keeps the corpus as it was when the
+    index was taken, so entries stay in order after their slots are
+    tombstoned. Slots from ``size`` on were appended since.
+
+    Taking an index only copies the corpus; ``build`` does the sorting and
+    may run on any thread, since it reads nothing but that copy.
+    """
+
+    __slots__ = (
+        "kind",
+        "choices",
+        "size",
+        "starts",
+        "word_slots",
+        "word_offsets",
+        "_columns",
+    )
+
+    def __init__(
+        self,
+        kind: SymbolKind,
+        choices: List[Optional[str]],
+        columns: Optional[_KindColumns] = None,
+    ) -> None:
+        self.kind = kind
+        self.choices = choices
+        self.size = len(choices)
+        self.starts = array("I")
+        self.word_slots = array("I")
+        self.word_offsets = array("I")
+        # The columns the slots belong to, until the index is installed
+        self._columns = columns
+
+    def build(self) -> None:
+        """Sort the copied corpus."""
+        choices = self.choices
+        live = [slot for slot, choice in enumerate(choices) if choice is not None]
+        # Stable sorts of slot-ordered input, so equal texts stay in slot order
+        self.starts = array("I", sorted(live, key=lambda slot: choices[slot] or ""))
+        words = [
+            (slot, offset) for slot in live for offset in _word_offsets(choices[slot])
+        ]
+        words.sort(key=lambda word: (choices[word[0]] or "")[word[1] :])
+        self.word_slots = array("I", (slot for slot, _offset in words))
+        self.word_offsets = array("I", (offset for _slot, offset in words))
+
+    def find(self, prefix: str, words: bool) -> Iterator[Tuple[int, str]]:
+        """Yield ``(slot, text)`` of entries starting with ``prefix``, in order.
+
+        Entries equal to ``prefix`` come first. ``words`` selects the later
+        words of the choices instead of the whole choices.
+        """
+        slots = self.word_slots if words else self.starts
+        low, high = 0, len(slots)
+        while low < high:
+            middle = (low + high) // 2
+            if self._text(middle, words) < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        for position in range(low, len(slots)):
+            text = self._text(position, words)
+            if not text.startswith(prefix):
+                return
+            yield slots[position], text
+
+    def compacted(self, live: List[int]) -> PrefixIndex:
+        """Return the index renumbered for a compaction that kept ``live``.
+
+        Entries keep their order, so nothing is sorted again.
+        """
+        size = bisect_left(live, self.size)
+        positions = array("i", [-1]) * self.size
+        for position, slot in enumerate(live[:size]):
+            positions[slot] = position
+        index = PrefixIndex(self.kind, [self.choices[slot] for slot in live[:size]])
+        index.starts = array(
+            "I", (positions[slot] for slot in self.starts if positions[slot] >= 0)
+        )
+        for slot, offset in zip(self.word_slots, self.word_offsets):
+            if positions[slot] >= 0:
+                index.word_slots.append(positions[slot])
+                index.word_offsets.append(offset)
+        return index
+
+    def _text(self, position: int, words: bool) -> str:
+        if words:
+            choice = self.choices[self.word_slots[position]] or ""
+            return choice[self.word_offsets[position] :]
+        return self.choices[self.starts[position]] or ""
+
+
+class SymbolIndex:
+    """In-memory symbol index with fuzzy search.
+
+    Symbols are stored column-wise per kind rather than as ``Symbol``
+    objects: names packed into one byte buffer, search choices in a list, and
+    file path, line, scope and language as ``array`` columns (paths, scopes
+    and languages as IDs into shared intern tables).
+    ``Symbol`` objects are only materialized for the results handed out.
+
+    Removing a file tombstones its slots, so the cost of
+    ``clear_file``/``update_file`` is proportional to that file's symbol
+    count, not the index size. A kind's slots are compacted once tombstones
+    outnumber live symbols, which keeps the amortized cost constant per
+    removed symbol. Compaction is put off while the kind is ``pinned``, e.g.
+    by an ``iter_score_jobs`` scan.
+
+    The search corpus of a kind is its display names already run through
+    ``utils.default_process``. Queries hand that list straight to rapidfuzz
+    instead of rebuilding and re-processing it.
+
+    With a ``candidate_cap``, each kind also keeps a trigram inverted index
+    over the same corpus. Large kinds then score only the ``candidate_cap``
+    slots sharing the most trigrams with the query instead of every symbol.
+    Postings of removed symbols are skipped at query time and dropped when the
+    kind is compacted.
+
+    ``generation`` changes on every mutation; slot positions returned by
+    ``score_slots`` are only meaningful within the generation they came from.
+    ``kind_version`` does the same for a single kind, so a snapshot of one
+    kind's corpus stays usable while other kinds change.
+    """
+
+    def __init__(
+        self, fuzzy_backend: str = "extract", candidate_cap: Optional[int] = None
+    ) -> None:
+        """Initialize an empty index.
+
+        Args:
+            fuzzy_backend: ``"extract"`` scores with ``process.extract``;
+                ``"cdist"`` scores large kinds with a multithreaded
+                ``process.cdist`` over the whole corpus (requires numpy).
+            candidate_cap: Enable the trigram prefilter, scoring at most this
+                many candidates per kind. ``None`` always scans exhaustively.
+        """
+        if fuzzy_backend not in FUZZY_BACKENDS:
+            raise ValueError(f"Unknown fuzzy backend: {fuzzy_backend}")
+        if fuzzy_backend == "cdist" and np is None:
+            logging.warning("numpy is not installed, using the extract backend")
+            fuzzy_backend = "extract"
+        self._fuzzy_backend = fuzzy_backend
+        self._candidate_cap = candidate_cap
+        self._trigrams: Dict[SymbolKind, Dict[str, array[int]]] = {}
+        self._prefixes: Dict[SymbolKind, PrefixIndex] = {}
+        self._columns: Dict[SymbolKind, _KindColumns] = {}
+        self._by_file: Dict[Path, Dict[SymbolKind, array[int]]] = {}
+        self._paths: List[Path] = []
+        self._path_ids: Dict[Path, int] = {}
+        # Directory tree of every path seen, to find files under a directory
+        self._dir_files: Dict[Path, List[Path]] = {}
+        self._subdirs: Dict[Path, Set[Path]] = {}
+        # ID 0 is reserved for a missing scope or language
+        self._strings: List[Optional[str]] = [None]
+        self._string_ids: Dict[Optional[str], int] = {None: 0}
+        self._generation = 0
+        # Chunked scans in progress per kind; compaction waits for them
+        self._pins: Counter[SymbolKind] = Counter()
+        # Bumped whenever a kind's corpus changes
+        self._versions: Counter[SymbolKind] = Counter()
+
+    @property
+    def generation(self) -> int:
+        """Counter bumped whenever symbols are added or removed."""
+        return self._generation
+
+    @property
+    def fuzzy_backend(self) -> str:
+        return self._fuzzy_backend
+
+    def kind_version(self, kind: SymbolKind) -> int:
+        """Counter bumped whenever symbols of ``kind`` are added or removed."""
+        return self._versions[kind]
 
     def add_symbols(self, symbols: Iterable[Symbol]) -> None:
+        self._generation += 1
         for symbol in symbols:
-            self._symbols.append(symbol)
-            self._by_file.setdefault(symbol.file_path, []).append(symbol)
-            self._by_kind.setdefault(symbol.kind, []).append(symbol)
+            self._append(
+                self._path_id(symbol.file_path),
+                symbol.name,
+                symbol.kind,
+                symbol.line,
+                symbol.scope,
+                symbol.language,
+            )
+
+    def add_records(self, file_path: Path, records: Iterable[SymbolRecord]) -> None:
+        """Add one file's symbols without building ``Symbol`` objects."""
+        self._generation += 1
+        file_id = self._path_id(file_path)
+        for name, kind, line, scope, language in records:
+            self._append(file_id, name, kind, line, scope, language)
 
     def clear_file(self, file_path: Path) -> None:
-        symbols = self._by_file.pop(file_path, [])
-        if not symbols:
+        file_slots = self._by_file.pop(file_path, None)
+        if not file_slots:
             return
-        symbols_set = set(symbols)
-        self._symbols = [symbol for symbol in self._symbols if symbol not in symbols_set]
-        for kind, kind_symbols in list(self._by_kind.items()):
-            filtered = [symbol for symbol in kind_symbols if symbol not in symbols_set]
-            if filtered:
-                self._by_kind[kind] = filtered
-            else:
-                self._by_kind.pop(kind, None)
+        self._generation += 1
+        for kind, positions in file_slots.items():
+            columns = self._columns[kind]
+            for position in positions:
+                columns.choices[position] = None
+            columns.live -= len(positions)
+            self._versions[kind] += 1
+            self._compact_if_sparse(kind)
 
     def update_file(self, file_path: Path, symbols: Iterable[Symbol]) -> None:
         self.clear_file(file_path)
         self.add_symbols(symbols)
 
-    def get_symbols(self, kind: Optional[SymbolKind] = None) -> List[Symbol]:
-        if kind is None:
-            return list(self._symbols)
-        return list(self._by_kind.get(kind, []))
+    def get_symbols(
+        self, kind: Optional[SymbolKind] = None, limit: Optional[int] = None
+    ) -> List[Symbol]:
+        """Return live symbols of a kind (or every kind), in slot order.
+
+        Args:
+            kind: Kind to list, or ``None`` for all kinds.
+            limit: Stop after materializing this many symbols.
+        """
+        kinds = list(self._columns) if kind is None else [kind]
+        symbols: List[Symbol] = []
+        for symbol_kind in kinds:
+            columns = self._columns.get(symbol_kind)
+            for slot, choice in enumerate(columns.choices if columns else []):
+                if limit is not None and len(symbols) >= limit:
+                    return symbols
+                if choice is not None:
+                    symbols.append(self._materialize(symbol_kind, slot))
+        return symbols
+
+    def file_paths(self) -> List[Path]:
+        """Return the paths of all files with indexed symbols."""
+        return list(self._by_file)
+
+    def files_under(self, directory: Path) -> List[Path]:
+        """Return the indexed files below ``directory``, at any depth.
+
+        Only the directory's own subtree is visited, not every indexed file.
+        """
+        files: List[Path] = []
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            files.extend(
+                path
+                for path in self._dir_files.get(current, ())
+                if path in self._by_file
+            )
+            pending.extend(self._subdirs.get(current, ()))
+        return files
+
+    def path_id(self, file_path: Path) -> Optional[int]:
+        """Return the ID of a path seen by the index, or None.
+
+        IDs are never reused, so one stays valid for the life of the index
+        even after the file's symbols are removed.
+        """
+        return self._path_ids.get(file_path)
+
+    def path_at(self, path_id: int) -> Optional[Path]:
+        """Return the path with a ``path_id``, or None if there is none."""
+        if 0 <= path_id < len(self._paths):
+            return self._paths[path_id]
+        return None
+
+    def count(self, kind: SymbolKind) -> int:
+        """Return the number of live symbols of a kind."""
+        columns = self._columns.get(kind)
+        return columns.live if columns is not None else 0
+
+    def symbol_at(self, kind: SymbolKind, slot: int) -> Optional[Symbol]:
+        """Return the symbol in a slot returned by ``score_slots``.
+
+        Returns None if the symbol has been removed since.
+        """
+        if self._columns[kind].choices[slot] is None:
+            return None
+        return self._materialize(kind, slot)
+
+    def score_slots(
+        self,
+        query: str,
+        kind: SymbolKind,
+        min_score: int,
+        limit: Optional[int] = None,
+        slots: Optional[Sequence[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """Score a kind's symbols, or only the given slots, against a query.
+
+        Returns:
+            (slot, score) pairs, best first, ties in slot order.
+        """
+        columns = self._columns.get(kind)
+        choices = columns.choices if columns is not None else []
+        processed_query = utils.default_process(query)
+        if slots is None:
+            slots = self._prefilter(kind, processed_query)
+        if slots is None:
+            return self._score(processed_query, choices, limit, min_score)
+        subset = [choices[slot] for slot in slots]
+        return [
+            (slots[index], score)
+            for index, score in self._score(processed_query, subset, limit, min_score)
+        ]
+
+    def prefix_index_due(self, kind: SymbolKind) -> Optional[PrefixIndex]:
+        """Take a new prefix index of ``kind`` if ``prefix_search`` needs one.
+
+        It is due once the slots the installed index does not cover exceed
+        ``_PREFIX_TAIL_SCAN`` and a quarter of those it does. Taking it only
+        copies the corpus list; call ``build`` on any thread and then
+        ``install_prefix_index``.
+        """
+        columns = self._columns.get(kind)
+        if columns is None:
+            return None
+        current = self._prefixes.get(kind)
+        indexed = current.size if current is not None else 0
+        if len(columns.choices) - indexed <= max(_PREFIX_TAIL_SCAN, indexed // 4):
+            return None
+        return PrefixIndex(kind, list(columns.choices), columns)
+
+    def install_prefix_index(self, index: PrefixIndex) -> None:
+        """Serve ``prefix_search`` from a built index.
+
+        An index taken before its kind was compacted is discarded, since its
+        slots no longer mean the same thing, as is one older than the
+        installed index.
+        """
+        columns, index._columns = index._columns, None
+        if columns is None or columns is not self._columns.get(index.kind):
+            return
+        current = self._prefixes.get(index.kind)
+        if current is None or current.size < index.size:
+            self._prefixes[index.kind] = index
+
+    def iter_score_jobs(
+        self,
+        query: str,
+        kind: SymbolKind,
+        min_score: int,
+        chunk_size: int,
+        limit: Optional[int] = None,
+        slots: Optional[Sequence[int]] = None,
+    ) -> Iterator[ScoreJob]:
+        """Split a ``score_slots`` scan into jobs of ``chunk_size`` slots.
+
+        Each job can be scored with ``score_job`` on any thread, or against a
+        snapshot of the kind's corpus taken at the job's ``version``. The
+        kind is pinned until the generator is finished or closed; callers
+        that pass the scored slots to ``symbol_at`` afterwards must hold
+        ``pinned`` around both. Symbols added during the scan are not scored.
+        """
+        columns = self._columns.get(kind)
+        if columns is None:
+            return
+        processed_query = utils.default_process(query)
+        if slots is None:
+            slots = self._prefilter(kind, processed_query)
+        if slots is None:
+            slots = range(len(columns.choices))
+        version = self._versions[kind]
+        with self.pinned(kind):
+            for start in range(0, len(slots), chunk_size):
+                yield ScoreJob(
+                    kind=kind,
+                    version=version,
+                    processed_query=processed_query,
+                    slots=slots[start : start + chunk_size],
+                    limit=limit,
+                    min_score=min_score,
+                    choices=columns.choices,
+                )
+
+    @contextmanager
+    def pinned(self, kind: SymbolKind) -> Iterator[None]:
+        """Put off compacting ``kind`` so slot numbers stay valid meanwhile.
+
+        Hold it from scoring slots until they are passed to ``symbol_at``.
+        """
+        self._pins[kind] += 1
+        try:
+            yield
+        finally:
+            self._pins[kind] -= 1
+            self._compact_if_sparse(kind)
+
+    def score_job(
+        self, job: ScoreJob, release_gil: bool = False
+    ) -> List[Tuple[int, float]]:
+        """Return a job's (slot, score) pairs, best first, ties in slot order.
+
+        Args:
+            job: Chunk from ``iter_score_jobs``.
+            release_gil: Score with single-threaded cdist when numpy is
+                installed. ``process.extract`` holds the GIL while scoring,
+                so a job run on a worker thread would still stall the event
+                loop; cdist releases it.
+        """
+        subset = [job.choices[slot] for slot in job.slots]
+        backend, workers = self._fuzzy_backend, -1
+        if release_gil and np is not None:
+            backend, workers = "cdist", 1
+        return [
+            (job.slots[index], score)
+            for index, score in score_choices(
+                job.processed_query, subset, job.limit, job.min_score, backend, workers
+            )
+        ]
+
+    def snapshot_choices(self, kind: SymbolKind) -> Tuple[int, List[Optional[str]]]:
+        """Return the kind's version and a copy of its corpus at that version."""
+        columns = self._columns.get(kind)
+        return self._versions[kind], list(columns.choices if columns else [])
 
     def fuzzy_search(
         self,
@@ -82,25 +553,339 @@ class SymbolIndex:
         min_score: int = 60,
     ) -> List[Tuple[Symbol, float]]:
         """Fuzzy search using rapidfuzz."""
-        candidates = self.get_symbols(kind)
-        if not candidates:
-            return []
-        choices = [symbol.display_name() for symbol in candidates]
-        results = process.extract(
-            query,
-            choices,
-            scorer=fuzz.WRatio,
-            processor=utils.default_process,
-            score_cutoff=min_score,
-            limit=limit,
-        )
+        if kind is not None:
+            return [
+                (self._materialize(kind, slot), score)
+                for slot, score in self.score_slots(query, kind, min_score, limit)
+            ]
+
+        # Every kind's choices concatenated; offsets[i] is where kinds[i] starts
+        offsets: List[int] = []
+        kinds = list(self._columns)
+        choices: List[Optional[str]] = []
+        for columns in self._columns.values():
+            offsets.append(len(choices))
+            choices.extend(columns.choices)
         matches: List[Tuple[Symbol, float]] = []
-        for _match, score, index in results:
-            matches.append((candidates[index], float(score)))
+        for index, score in self._score(
+            utils.default_process(query), choices, limit, min_score
+        ):
+            owner = bisect_right(offsets, index) - 1
+            symbol = self._materialize(kinds[owner], index - offsets[owner])
+            matches.append((symbol, score))
         return matches
 
+    def prefix_search(
+        self, query: str, kind: SymbolKind, limit: int
+    ) -> List[Tuple[Symbol, float]]:
+        """Find the best exact and prefix matches without fuzzy scoring.
+
+        Exact matches of the whole corpus entry or its last word score 100,
+        matches at its start 95 and at the start of any other word 90. The
+        best ``limit`` are returned by score, exact ones in slot order and
+        the others alphabetically.
+
+        Matches are looked up in the kind's installed ``PrefixIndex``, which
+        is never built here. Only the first ``_PREFIX_TAIL_SCAN`` slots it
+        does not cover are scanned, so until ``prefix_index_due`` has been
+        acted on, later slots of a large kind are not searched.
+        """
+        columns = self._columns.get(kind)
+        processed = utils.default_process(query)
+        if columns is None or not processed or limit <= 0:
+            return []
+        index = self._prefixes.get(kind)
+        if index is None:
+            index = PrefixIndex(kind, [])
+        choices = columns.choices
+        word = " " + processed
+        tail = [
+            (slot, choices[slot] or "")
+            for slot in range(
+                index.size, min(len(choices), index.size + _PREFIX_TAIL_SCAN)
+            )
+            if choices[slot] is not None
+        ]
+        starts = index.find(processed, words=False)
+        words = index.find(processed, words=True)
+        # Entries equal to the query come first in their range
+        equal = [
+            *(slot for slot, _text in takewhile(_equals(processed), starts)),
+            *(slot for slot, _text in takewhile(_equals(processed), words)),
+            *(slot for slot, choice in tail if choice == processed),
+            *(slot for slot, choice in tail if choice.endswith(word)),
+        ]
+        tiers: List[Tuple[Iterable[int], float]] = [
+            (sorted(equal), 100.0),
+            (_inexact(processed, index.find(processed, words=False)), 95.0),
+            ((slot for slot, choice in tail if choice.startswith(processed)), 95.0),
+            (_inexact(processed, index.find(processed, words=True)), 90.0),
+            ((slot for slot, choice in tail if word in choice), 90.0),
+        ]
+        ranked: Dict[int, float] = {}
+        for slots, score in tiers:
+            for slot in slots:
+                if len(ranked) >= limit:
+                    break
+                if choices[slot] is not None:
+                    # A slot matching several ways keeps its best score
+                    ranked.setdefault(slot, score)
+        return [
+            (self._materialize(kind, slot), score) for slot, score in ranked.items()
+        ]
+
     def stats(self) -> Dict[str, int]:
-        stats: Dict[str, int] = {"total": len(self._symbols)}
-        for kind, symbols in self._by_kind.items():
-            stats[kind.value] = len(symbols)
+        stats: Dict[str, int] = {
+            "total": sum(columns.live for columns in self._columns.values())
+        }
+        for kind, columns in self._columns.items():
+            if columns.live:
+                stats[kind.value] = columns.live
         return stats
+
+    def _score(
+        self,
+        processed_query: str,
+        choices: Sequence[Optional[str]],
+        limit: Optional[int],
+        min_score: int,
+    ) -> List[Tuple[int, float]]:
+        return score_choices(
+            processed_query, choices, limit, min_score, self._fuzzy_backend
+        )
+
+    def _prefilter(self, kind: SymbolKind, processed_query: str) -> Optional[List[int]]:
+        """Return the slots sharing the most trigrams with the query.
+
+        Returns None when the exhaustive scan should be used instead.
+        """
+        if self._candidate_cap is None or self.count(kind) < _PREFILTER_MIN_CHOICES:
+            return None
+        if len(processed_query.replace(" ", "")) < 3:
+            return None
+        grams = _trigrams(processed_query)
+        postings = self._trigrams.get(kind, {})
+        hits: Counter[int] = Counter()
+        for gram in grams:
+            posting = postings.get(gram)
+            if posting is not None:
+                hits.update(posting)
+        choices = self._columns[kind].choices
+        for slot in [slot for slot in hits if choices[slot] is None]:
+            del hits[slot]
+        # Prefer earlier slots on equal counts so results don't depend on set order
+        best = heapq.nlargest(
+            self._candidate_cap, hits.items(), key=lambda item: (item[1], -item[0])
+        )
+        # Slot order keeps score ties ordered like the exhaustive scan
+        return sorted(slot for slot, _count in best)
+
+    def _compact_if_sparse(self, kind: SymbolKind) -> None:
+        columns = self._columns.get(kind)
+        if columns is None:
+            return
+        tombstones = len(columns.choices) - columns.live
+        if tombstones < _COMPACT_MIN_TOMBSTONES or tombstones <= columns.live:
+            return
+        if not self._pins[kind]:
+            self._compact(kind)
+
+    def _compact(self, kind: SymbolKind) -> None:
+        """Drop tombstones from a kind's slots and renumber its file entries."""
+        old = self._columns[kind]
+        live = [slot for slot, choice in enumerate(old.choices) if choice is not None]
+        columns = _KindColumns()
+        for slot in live:
+            columns.names += old.names[_name_start(old, slot) : old.name_ends[slot]]
+            columns.name_ends.append(len(columns.names))
+        columns.choices = [old.choices[slot] for slot in live]
+        columns.files = array("I", (old.files[slot] for slot in live))
+        columns.lines = array("I", (old.lines[slot] for slot in live))
+        columns.scopes = array("I", (old.scopes[slot] for slot in live))
+        columns.languages = array("I", (old.languages[slot] for slot in live))
+        columns.live = len(live)
+        self._columns[kind] = columns
+        self._versions[kind] += 1
+        prefixes = self._prefixes.get(kind)
+        if prefixes is not None:
+            self._prefixes[kind] = prefixes.compacted(live)
+        for file_id in set(columns.files):
+            self._by_file[self._paths[file_id]][kind] = array("I")
+        for position, file_id in enumerate(columns.files):
+            self._by_file[self._paths[file_id]][kind].append(position)
+        if self._candidate_cap is not None:
+            postings: Dict[str, array[int]] = {}
+            for position, choice in enumerate(columns.choices):
+                for gram in _trigrams(choice or ""):
+                    postings.setdefault(gram, array("I")).append(position)
+            self._trigrams[kind] = postings
+
+    def _append(
+        self,
+        file_id: int,
+        name: str,
+        kind: SymbolKind,
+        line: int,
+        scope: Optional[str],
+        language: Optional[str],
+    ) -> None:
+        columns = self._columns.get(kind)
+        if columns is None:
+            columns = self._columns[kind] = _KindColumns()
+        slot = len(columns.choices)
+        file_slots = self._by_file.setdefault(self._paths[file_id], {})
+        file_slots.setdefault(kind, array("I")).append(slot)
+        choice = utils.default_process(f"{scope}.{name}" if scope else name)
+        if self._candidate_cap is not None:
+            postings = self._trigrams.setdefault(kind, {})
+            for gram in _trigrams(choice):
+                postings.setdefault(gram, array("I")).append(slot)
+        columns.names += name.encode()
+        columns.name_ends.append(len(columns.names))
+        columns.choices.append(choice)
+        columns.files.append(file_id)
+        columns.lines.append(line)
+        columns.scopes.append(self._string_id(scope))
+        columns.languages.append(self._string_id(language))
+        columns.live += 1
+        self._versions[kind] += 1
+
+    def _materialize(self, kind: SymbolKind, slot: int) -> Symbol:
+        columns = self._columns[kind]
+        name = columns.names[_name_start(columns, slot) : columns.name_ends[slot]]
+        return Symbol(
+            name=name.decode(),
+            kind=kind,
+            file_path=self._paths[columns.files[slot]],
+            line=columns.lines[slot],
+            scope=self._strings[columns.scopes[slot]],
+            language=self._strings[columns.languages[slot]],
+        )
+
+    def _path_id(self, file_path: Path) -> int:
+        path_id = self._path_ids.get(file_path)
+        if path_id is None:
+            path_id = self._path_ids[file_path] = len(self._paths)
+            self._paths.append(file_path)
+            self._dir_files.setdefault(file_path.parent, []).append(file_path)
+            child = file_path.parent
+            for parent in child.parents:
+                subdirs = self._subdirs.setdefault(parent, set())
+                if child in subdirs:
+                    break
+                subdirs.add(child)
+                child = parent
+        return path_id
+
+    def _string_id(self, value: Optional[str]) -> int:
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+        return string_id
+
+
+def score_choices(
+    processed_query: str,
+    choices: Sequence[Optional[str]],
+    limit: Optional[int],
+    min_score: int,
+    backend: str = "extract",
+    workers: int = -1,
+) -> List[Tuple[int, float]]:
+    """Return (choice index, score) pairs, best first, ties by index.
+
+    Args:
+        processed_query: Query already run through ``utils.default_process``.
+        choices: Processed corpus entries; ``None`` entries never match.
+        limit: Maximum number of pairs, or ``None`` for all matches.
+        min_score: Score cutoff.
+        backend: One of ``FUZZY_BACKENDS``; cdist needs numpy.
+        workers: Threads cdist may use, ``-1`` for one per core.
+    """
+    # A zero cutoff would let cdist's zero scores for tombstones through
+    if backend == "cdist" and np is not None and min_score > 0:
+        # Single-threaded cdist has no thread start-up cost to amortize
+        if workers == 1 or len(choices) >= _CDIST_MIN_CHOICES:
+            return _cdist_top(processed_query, choices, limit, min_score, workers)
+    # Choices are pre-processed; tombstones are None, which rapidfuzz skips
+    results = process.extract(
+        processed_query,
+        choices,
+        scorer=fuzz.WRatio,
+        processor=None,
+        score_cutoff=min_score,
+        limit=limit,
+    )
+    return [(index, float(score)) for _match, score, index in results]
+
+
+def _name_start(columns: _KindColumns, slot: int) -> int:
+    return columns.name_ends[slot - 1] if slot else 0
+
+
+def _cdist_top(
+    processed_query: str,
+    choices: Sequence[Optional[str]],
+    limit: Optional[int],
+    min_score: int,
+    workers: int = -1,
+) -> List[Tuple[int, float]]:
+    """Score the whole corpus with cdist and select the top ``limit`` matches.
+
+    Ordering matches ``process.extract``: score descending, then index.
+    """
+    if limit is not None and limit <= 0:
+        return []
+    scores: Any = process.cdist(
+        [processed_query],
+        choices,
+        scorer=fuzz.WRatio,
+        processor=None,
+        score_cutoff=min_score,
+        dtype=np.float64,
+        workers=workers,
+    )[0]
+    selected = np.flatnonzero(scores >= min_score)
+    if limit is not None and len(selected) > limit:
+        selected_scores = scores[selected]
+        kth = selected_scores[np.argpartition(-selected_scores, limit - 1)[limit - 1]]
+        above = selected[selected_scores > kth]
+        ties = selected[selected_scores == kth][: limit - len(above)]
+        selected = np.concatenate([above, ties])
+    order = np.lexsort((selected, -scores[selected]))
+    return [(int(index), float(scores[index])) for index in selected[order]]
+
+
+def _word_offsets(choice: Optional[str]) -> Iterator[int]:
+    """Offsets in a corpus entry where a word other than the first starts."""
+    if choice is None:
+        return
+    offset = choice.find(" ")
+    while offset != -1:
+        yield offset + 1
+        offset = choice.find(" ", offset + 1)
+
+
+def _equals(prefix: str) -> Callable[[Tuple[int, str]], bool]:
+    return lambda match: match[1] == prefix
+
+
+def _inexact(prefix: str, matches: Iterator[Tuple[int, str]]) -> Iterator[int]:
+    """Slots of prefix matches that are longer than the prefix itself."""
+    return (slot for slot, text in matches if text != prefix)
+
+
+def _trigrams(text: str) -> Set[str]:
+    """Character trigrams of each whitespace-separated token.
+
+    Tokens shorter than three characters contribute themselves.
+    """
+    grams: Set[str] = set()
+    for token in text.split():
+        if len(token) < 3:
+            grams.add(token)
+            continue
+        for start in range(len(token) - 2):
+            grams.add(token[start : start + 3])
+    return grams
@@ -0,0 +1,96 @@
+"""In-memory cache of ctags results keyed by file contents.
+
+Vendored copies, generated stubs and reverted edits all hand ctags bytes it
+has already parsed. Entries are keyed by a hash of the bytes plus whatever
+decides the language (the forced language, or else the file name's
+extensions), so identical content is parsed once and its tags are rebased
+onto each new path.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Approximate bytes held per entry and per tag besides the string contents
+_ENTRY_OVERHEAD = 200
+_TAG_OVERHEAD = 120
+
+# name, kind, line, scope, language (the path is supplied on lookup)
+_CachedTag = Tuple[Any, Any, Any, Any, Any]
+_Key = Tuple[bytes, str]
+
+
+class TagCache:
+    """LRU cache of per-file tag lists bounded by an estimate of its memory use.
+
+    Attributes:
+        hits: Lookups served from the cache.
+        misses: Lookups that found nothing.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[_Key, Tuple[List[_CachedTag], int]] = OrderedDict()
+        self._bytes = 0
+
+    def key(self, file_path: Path, data: bytes, language: Optional[str] = None) -> _Key:
+        """Return the cache key for ``data`` parsed as ``file_path``."""
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if language:
+            return digest, f"language:{language}"
+        # ctags picks the language from the extensions, or the whole name
+        return digest, "".join(file_path.suffixes) or file_path.name
+
+    def get(self, key: _Key, file_path: Path) -> Optional[List[Dict[str, Any]]]:
+        """Return cached tags for ``key`` reporting ``file_path``, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        path = str(file_path)
+        return [
+            {
+                "name": name,
+                "kind": kind,
+                "line": line,
+                "path": path,
+                "scope": scope,
+                "language": language,
+            }
+            for name, kind, line, scope, language in entry[0]
+        ]
+
+    def put(self, key: _Key, tags: List[Dict[str, Any]]) -> None:
+        """Store normalized tags for ``key``, evicting least recently used ones."""
+        cached = [
+            (tag["name"], tag["kind"], tag["line"], tag["scope"], tag["language"])
+            for tag in tags
+        ]
+        size = _ENTRY_OVERHEAD + sum(
+            _TAG_OVERHEAD + len(tag[0] or "") + len(tag[3] or "") for tag in cached
+        )
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[1]
+        self._entries[key] = (cached, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
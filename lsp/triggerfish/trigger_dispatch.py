@@ -0,0 +1,68 @@
+"""Routing of completion requests to the handler of the trigger being typed."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Collection, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .completion_handler import CompletionHandler
+
+
+@dataclass(frozen=True)
+class TriggerMatch:
+    """A trigger character and the query typed after it."""
+
+    trigger: str
+    position: int
+    query: str
+
+
+def find_trigger(
+    line: str, character: int, triggers: Collection[str]
+) -> Optional[TriggerMatch]:
+    """Find the trigger that starts the word being typed at ``character``.
+
+    The line is scanned backward from the cursor once, stopping at the first
+    whitespace. A trigger only counts at the start of a word, not directly
+    after a letter, digit or underscore, so ``e.g.``, ``user@example.com``
+    and ``C#`` do not open completions. If the word holds several triggers
+    the first one wins: ``@src/.env`` is a file query for ``src/.env``.
+    """
+    character = min(character, len(line))
+    found = -1
+    for position in range(character - 1, -1, -1):
+        char = line[position]
+        if char.isspace():
+            break
+        if char in triggers and (position == 0 or not _is_word(line[position - 1])):
+            found = position
+    if found == -1:
+        return None
+    return TriggerMatch(line[found], found, line[found + 1 : character])
+
+
+class TriggerDispatcher:
+    """Pick the one handler a completion request's trigger selects."""
+
+    def __init__(self, handlers: Iterable[CompletionHandler]) -> None:
+        self._handlers: Dict[str, CompletionHandler] = {
+            handler.trigger: handler for handler in handlers
+        }
+
+    @property
+    def triggers(self) -> List[str]:
+        return list(self._handlers)
+
+    def select(
+        self, line: str, character: int
+    ) -> Optional[Tuple[CompletionHandler, str]]:
+        """Return the handler of the trigger at the cursor and its query."""
+        match = find_trigger(line, character, self._handlers)
+        if match is None:
+            return None
+        return self._handlers[match.trigger], match.query
+
+
+def _is_word(char: str) -> bool:
+    return char.isalnum() or char == "_"